@@ -1,7 +1,12 @@
 """Interface for ``python -m test_rig_bluesky``."""
 
-from argparse import ArgumentParser
+import json
+import sys
+import tempfile
+from argparse import ArgumentParser, Namespace
 from collections.abc import Sequence
+from dataclasses import asdict
+from pathlib import Path
 
 from . import __version__
 
@@ -17,7 +22,116 @@ def main(args: Sequence[str] | None = None) -> None:
         action="version",
         version=__version__,
     )
-    parser.parse_args(args)
+    subparsers = parser.add_subparsers(dest="command")
+
+    estimate_parser = subparsers.add_parser(
+        "estimate", help="Predict how long a plan will take, without hardware"
+    )
+    estimate_parser.add_argument("plan", help="Name of the plan, e.g. spectroscopy")
+    estimate_parser.add_argument(
+        "--params",
+        type=json.loads,
+        default={},
+        help="Plan parameters as JSON, e.g. '{\"exposure_time\": 0.05}'",
+    )
+    estimate_parser.add_argument(
+        "--ca-latency",
+        type=float,
+        default=0.005,
+        help="Time for one Channel Access round trip, in seconds",
+    )
+    estimate_parser.set_defaults(func=_estimate, parser=estimate_parser)
+
+    importtime_parser = subparsers.add_parser(
+        "importtime", help="Break down the time taken to import a module"
+    )
+    importtime_parser.add_argument(
+        "module", nargs="?", default="test_rig_bluesky.plans", help="Module to import"
+    )
+    importtime_parser.add_argument(
+        "--preload",
+        action="append",
+        default=[],
+        help="Module to import first without timing it, e.g. dodal.beamlines.b01_1",
+    )
+    importtime_parser.add_argument(
+        "--top", type=int, default=10, help="Number of packages and modules to list"
+    )
+    importtime_parser.add_argument(
+        "--budget",
+        type=float,
+        help="Exit with an error if the import takes longer, in seconds",
+    )
+    importtime_parser.set_defaults(func=_importtime)
+
+    run_parser = subparsers.add_parser(
+        "run", help="Run a plan in process and report its throughput"
+    )
+    run_parser.add_argument("plan", help="Name of the plan, e.g. spectroscopy")
+    run_parser.add_argument(
+        "--params",
+        type=json.loads,
+        default={},
+        help="Plan parameters as JSON, specs may be serialized",
+    )
+    run_parser.add_argument(
+        "--devices",
+        choices=["sim", "real"],
+        default="sim",
+        help="Run against simulated devices or the b01-1 IOCs",
+    )
+    run_parser.add_argument(
+        "--frame-rate",
+        type=float,
+        help="Frame rate of simulated detectors, by default set by the exposure",
+    )
+    run_parser.add_argument(
+        "--data-dir",
+        type=Path,
+        default=Path(tempfile.gettempdir()),
+        help="Directory for the detectors' files, on the IOC host for real devices",
+    )
+    run_parser.set_defaults(func=_run)
+
+    parsed = parser.parse_args(args)
+    if parsed.command is not None:
+        parsed.func(parsed)
+
+
+def _estimate(args: Namespace) -> None:
+    from .estimate import estimate_duration
+
+    try:
+        estimate = estimate_duration(args.plan, args.params, ca_latency=args.ca_latency)
+    except ValueError as e:
+        parser: ArgumentParser = args.parser
+        parser.error(str(e))
+    print(json.dumps({**asdict(estimate), "total": estimate.total}, indent=2))
+
+
+def _importtime(args: Namespace) -> None:
+    from .importtime import measure_import
+
+    report = measure_import(args.module, args.preload)
+    print(json.dumps(report.summary(args.top), indent=2))
+    if args.budget is not None and report.total > args.budget:
+        sys.exit(
+            f"Importing {args.module} took {report.total:.3f}s, "
+            f"over the budget of {args.budget:.3f}s"
+        )
+
+
+def _run(args: Namespace) -> None:
+    from bluesky import RunEngine
+    from ophyd_async.core import StaticPathProvider, UUIDFilenameProvider
+
+    from .run import make_devices, run_plan
+
+    run_engine = RunEngine(call_returns_result=True)
+    path_provider = StaticPathProvider(UUIDFilenameProvider(), args.data_dir)
+    devices = make_devices(args.devices, args.frame_rate, path_provider)
+    report = run_plan(run_engine, args.plan, args.params, devices)
+    print(json.dumps(report.summary(), indent=2))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+import heapq
+import itertools
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+Point = tuple[float, float]
+
+
+@dataclass(frozen=True)
+class Cell:
+    """A rectangle of the scan whose corners have been, or will be, measured."""
+
+    x0: float
+    x1: float
+    y0: float
+    y1: float
+    depth: int = 0
+
+    @property
+    def corners(self) -> list[Point]:
+        return [
+            (self.x0, self.y0),
+            (self.x1, self.y0),
+            (self.x0, self.y1),
+            (self.x1, self.y1),
+        ]
+
+    def split(self) -> tuple[list["Cell"], list[Point]]:
+        """Split into quarters, returning them and the points they add."""
+        xm = (self.x0 + self.x1) / 2
+        ym = (self.y0 + self.y1) / 2
+        depth = self.depth + 1
+        quarters = [
+            Cell(x0, x1, y0, y1, depth)
+            for y0, y1 in ((self.y0, ym), (ym, self.y1))
+            for x0, x1 in ((self.x0, xm), (xm, self.x1))
+        ]
+        new_points = [
+            (xm, self.y0),
+            (self.x0, ym),
+            (xm, ym),
+            (self.x1, ym),
+            (xm, self.y1),
+        ]
+        return quarters, new_points
+
+
+class AdaptiveGrid:
+    """Chooses where to measure next, refining cells whose values vary most.
+
+    Starts from a coarse grid. A cell's score is the spread of the values at its
+    corners, largest over all channels, relative to the spread of that channel
+    over the coarse grid. Cells scoring at least threshold are split into
+    quarters, most varied first, at most max_depth times.
+    """
+
+    def __init__(
+        self,
+        x_range: tuple[float, float],
+        y_range: tuple[float, float],
+        coarse_steps: int,
+        threshold: float = 0.1,
+        max_depth: int = 3,
+    ):
+        self.threshold = threshold
+        self.max_depth = max_depth
+        self.values: dict[Point, npt.NDArray[np.float64]] = {}
+        self._xs = np.linspace(*x_range, coarse_steps)
+        self._ys = np.linspace(*y_range, coarse_steps)
+        self._unscored = [
+            Cell(float(x0), float(x1), float(y0), float(y1))
+            for y0, y1 in itertools.pairwise(self._ys)
+            for x0, x1 in itertools.pairwise(self._xs)
+        ]
+        self._queue: list[tuple[float, int, Cell]] = []
+        self._order = itertools.count()
+        self._scale: npt.NDArray[np.float64] | None = None
+
+    def coarse_points(self) -> list[Point]:
+        """Points of the coarse grid, snaked so the stage never flies back."""
+        return [
+            (float(x), float(y))
+            for row, y in enumerate(self._ys)
+            for x in (self._xs if row % 2 == 0 else self._xs[::-1])
+        ]
+
+    def add(self, point: Point, values: Sequence[float]) -> None:
+        """Record the value of each channel measured at a point."""
+        self.values[point] = np.asarray(values, dtype=np.float64)
+
+    def refine(self) -> list[Point]:
+        """Split the most varied cell, returning the points still to measure.
+
+        Returns an empty list once no cell is varied enough to refine.
+        """
+        self._score_measured_cells()
+        while self._queue:
+            negative_score, _, cell = heapq.heappop(self._queue)
+            if -negative_score < self.threshold:
+                self._queue.clear()
+                break
+            if cell.depth >= self.max_depth:
+                continue
+            quarters, new_points = cell.split()
+            self._unscored.extend(quarters)
+            to_measure = [point for point in new_points if point not in self.values]
+            if to_measure:
+                return to_measure
+            self._score_measured_cells()
+        return []
+
+    def score(self, cell: Cell) -> float:
+        corner_values = np.array([self.values[corner] for corner in cell.corners])
+        spread = np.ptp(corner_values, axis=0)
+        return float(np.max(spread / self._coarse_scale()))
+
+    def _coarse_scale(self) -> npt.NDArray[np.float64]:
+        if self._scale is None:
+            coarse = np.array([self.values[point] for point in self.coarse_points()])
+            # Channels that did not change over the coarse grid never trigger
+            # refinement on their own
+            self._scale = np.where(
+                np.ptp(coarse, axis=0) > 0, np.ptp(coarse, axis=0), np.inf
+            )
+        return self._scale
+
+    def _score_measured_cells(self) -> None:
+        still_unscored = []
+        for cell in self._unscored:
+            if all(corner in self.values for corner in cell.corners):
+                heapq.heappush(
+                    self._queue, (-self.score(cell), next(self._order), cell)
+                )
+            else:
+                still_unscored.append(cell)
+        self._unscored = still_unscored
@@ -0,0 +1,383 @@
+import logging
+import math
+import threading
+from collections import Counter
+from collections.abc import Callable, Mapping, Sequence
+from pathlib import Path
+from typing import Any, Literal
+from urllib.parse import urlparse
+
+import numpy as np
+import numpy.typing as npt
+from bluesky.callbacks.core import CallbackBase
+
+LOGGER = logging.getLogger(__name__)
+
+# Reads frames [start, stop) of the dataset described by a stream resource
+ExternalReader = Callable[[Mapping[str, Any], int, int], npt.NDArray[np.float64]]
+
+
+class HDF5FrameReader:
+    """Reads frames of HDF5 datasets written by areaDetector file plugins.
+
+    Each file is opened once, in SWMR mode, and kept open until close, so frames
+    can be read as they are written. A file without all the frames asked for is
+    closed, to be opened afresh on the next read.
+    """
+
+    def __init__(self):
+        self._files: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def __call__(
+        self, stream_resource: Mapping[str, Any], start: int, stop: int
+    ) -> npt.NDArray[np.float64]:
+        import h5py
+
+        path = urlparse(stream_resource["uri"]).path
+        with self._lock:
+            file = self._files.get(path)
+            if file is None:
+                file = self._files[path] = h5py.File(path, "r", swmr=True)
+            try:
+                dataset = file[stream_resource["parameters"]["dataset"]]
+                if not isinstance(dataset, h5py.Dataset):
+                    raise KeyError(f"{dataset.name} is not a dataset")
+                if len(dataset) < stop:
+                    dataset.refresh()
+                if len(dataset) < stop:
+                    raise KeyError(
+                        f"{dataset.name} has {len(dataset)} of {stop} frames"
+                    )
+                return np.asarray(dataset[start:stop], dtype=np.float64)
+            except KeyError:
+                self._files.pop(path).close()
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            for file in self._files.values():
+                file.close()
+            self._files.clear()
+
+
+# Shared by MapReducers by default, each closes the files when its scan stops
+read_hdf5_frames = HDF5FrameReader()
+
+
+def grid_indices(
+    points: npt.NDArray[np.intp],
+    shape: Sequence[int],
+    snaking: Sequence[bool] | None = None,
+) -> npt.NDArray[np.intp]:
+    """Find where points, numbered in the order scanned, are in the scan's grid.
+
+    snaking is as in bluesky's start documents: a snaked dimension runs
+    backwards whenever the dimensions outside it have taken an odd number of
+    steps.
+    """
+    if not snaking or not any(snaking):
+        return points
+    scanned = np.unravel_index(points, tuple(shape))
+    indices = []
+    outer = np.zeros_like(points)
+    for index, size, snaked in zip(scanned, shape, snaking, strict=True):
+        indices.append(
+            np.where(outer % 2 == 1, size - 1 - index, index) if snaked else index
+        )
+        outer = outer * size + index
+    return np.asarray(np.ravel_multi_index(indices, tuple(shape)), dtype=np.intp)
+
+
+class _Map:
+    """A NaN filled buffer of each point's values, viewed with the shape of the scan."""
+
+    def __init__(self, grid: tuple[int, ...] | None, point_shape: tuple[int, ...]):
+        self.grid = grid
+        self.point_shape = point_shape
+        capacity = math.prod(grid) if grid else 1024
+        self.buffer = np.full((capacity, math.prod(point_shape)), np.nan)
+        self.num_points = 0
+
+    def write(self, points: npt.NDArray[np.intp], values: npt.ArrayLike) -> None:
+        if not len(points):
+            return
+        end = int(points.max()) + 1
+        if end > len(self.buffer):
+            if self.grid is not None:
+                raise IndexError(f"Point {end - 1} is not in a {self.grid} map")
+            grown = np.full(
+                (max(end, 2 * len(self.buffer)), self.buffer.shape[1]), np.nan
+            )
+            grown[: len(self.buffer)] = self.buffer
+            self.buffer = grown
+        self.buffer[points] = np.reshape(values, (len(points), -1))
+        self.num_points = max(self.num_points, end)
+
+    def view(self) -> npt.NDArray[np.float64]:
+        if self.grid is None:
+            return self.buffer[: self.num_points].reshape(
+                self.num_points, *self.point_shape
+            )
+        return self.buffer.reshape(*self.grid, *self.point_shape)
+
+
+class MapReducer(CallbackBase):
+    """Reduces a scan to one array per scalar data key, shaped like the scan.
+
+    Arrays are allocated from the shape in the start document, or grow if there
+    is none, and filled in place as events arrive, so memory does not grow with
+    the number of documents. Each point is placed by where it is in the grid, so
+    snaked scans, with snaking in the start document, are mapped as they lie.
+    Stage positions come from the events. Data written to file, like the ROI
+    totals, is read back with read_external as each stream_datum arrives. If
+    frames_per_point is more than 1, each point of the detector's maps has that
+    many values, or their sum or mean if reduce_frames is "sum" or "mean". A run
+    that resumes a checkpointed scan fills the maps from its first point.
+
+    The arrays are in `maps`, for live display, and are saved to save_to, or to
+    the path it returns for the start document, when the scan stops.
+    """
+
+    def __init__(
+        self,
+        stream_name: str = "primary",
+        read_external: ExternalReader | None = read_hdf5_frames,
+        save_to: Path | str | Callable[[Mapping[str, Any]], Path] | None = None,
+        reduce_frames: Literal["sum", "mean"] | None = None,
+    ):
+        super().__init__()
+        self.stream_name = stream_name
+        self.read_external = read_external
+        self.save_to = save_to
+        self.reduce_frames = reduce_frames
+        self._start: Mapping[str, Any] = {}
+        self._grid: tuple[int, ...] | None = None
+        self._snaking: list[bool] | None = None
+        self._first_point = 0
+        self._maps: dict[str, _Map] = {}
+        self._descriptors: set[str] = set()
+        self._event_repeats = 1
+        self._frames_per_point = 1
+        self._frames_per_event: dict[str, int] = {}
+        self._points_per_event: dict[str, int] = {}
+        self._stream_resources: dict[str, Mapping[str, Any]] = {}
+        self._pending: list[tuple[str, int, int]] = []
+
+    @property
+    def maps(self) -> dict[str, npt.NDArray[np.float64]]:
+        return {key: map_.view() for key, map_ in self._maps.items()}
+
+    def start(self, doc):
+        self._start = doc
+        shape = self._start.get("shape")
+        self._grid = tuple(int(n) for n in shape) if shape is not None else None
+        snaking = [bool(snaked) for snaked in self._start.get("snaking") or []]
+        self._snaking = (
+            snaking if self._grid and len(snaking) == len(self._grid) else None
+        )
+        self._first_point = int(doc.get("checkpoint", {}).get("first_point", 0))
+        self._maps.clear()
+        self._descriptors.clear()
+        self._frames_per_event.clear()
+        self._points_per_event.clear()
+        self._stream_resources.clear()
+        self._pending.clear()
+        return super().start(doc)
+
+    def descriptor(self, doc):
+        if doc.get("name") != self.stream_name:
+            return super().descriptor(doc)
+        self._descriptors.add(doc["uid"])
+        frames_per_point = int(
+            self._start.get("plan_args", {}).get("frames_per_point", 1)
+        )
+        self._frames_per_point = frames_per_point
+        point_shape = (
+            (frames_per_point,)
+            if frames_per_point > 1 and self.reduce_frames is None
+            else ()
+        )
+
+        data_keys = {
+            key: data_key
+            for key, data_key in doc["data_keys"].items()
+            if data_key["dtype"] in ("number", "integer", "array")
+        }
+        for key, data_key in data_keys.items():
+            if "external" in data_key and len(data_key["shape"]) <= 1:
+                frames = math.prod(n or 1 for n in data_key["shape"])
+                self._frames_per_event[key] = frames
+                self._points_per_event[key] = max(frames // frames_per_point, 1)
+                self._maps[key] = _Map(self._grid, point_shape)
+        # In a fly scan each event covers several points, so readings taken once
+        # per event are repeated for each of them, unless they have a value for
+        # each point, like the position of the flying motor
+        self._event_repeats = max(self._points_per_event.values(), default=1)
+        for key, data_key in data_keys.items():
+            if "external" not in data_key and data_key["shape"] in (
+                [],
+                [self._event_repeats],
+            ):
+                self._maps[key] = _Map(self._grid, ())
+        return super().descriptor(doc)
+
+    def event(self, doc):
+        if doc["descriptor"] in self._descriptors:
+            points = self._grid_points(
+                (doc["seq_num"] - 1) * self._event_repeats, self._event_repeats
+            )
+            for key, value in doc["data"].items():
+                if key in self._maps and key not in self._frames_per_event:
+                    self._maps[key].write(
+                        points, np.broadcast_to(value, (self._event_repeats,))
+                    )
+        return super().event(doc)
+
+    def stream_resource(self, doc):
+        if doc["data_key"] in self._frames_per_event:
+            self._stream_resources[doc["uid"]] = doc
+        return super().stream_resource(doc)
+
+    def stream_datum(self, doc):
+        if (
+            self.read_external is not None
+            and doc["stream_resource"] in self._stream_resources
+        ):
+            self._pending.append(
+                (
+                    doc["stream_resource"],
+                    doc["indices"]["start"],
+                    doc["indices"]["stop"],
+                )
+            )
+            self._read_pending()
+        return super().stream_datum(doc)
+
+    def stop(self, doc):
+        self._read_pending()
+        if self._pending:
+            LOGGER.warning(f"Could not read {len(self._pending)} stream datums")
+        close = getattr(self.read_external, "close", None)
+        if close is not None:
+            close()
+        if self.save_to is not None:
+            path = self.save_to(self._start) if callable(self.save_to) else self.save_to
+            self.save(path)
+        return super().stop(doc)
+
+    def save(self, path: Path | str) -> None:
+        """Save the maps to a compressed .npz file, or HDF5 for .h5/.hdf5/.nxs."""
+        path = Path(path)
+        if path.suffix in (".h5", ".hdf5", ".nxs"):
+            import h5py
+
+            with h5py.File(path, "w") as file:
+                for key, array in self.maps.items():
+                    file.create_dataset(key, data=array, compression="gzip")
+        else:
+            arrays: dict[str, Any] = self.maps
+            np.savez_compressed(path, **arrays)
+        LOGGER.info(f"Saved maps of {sorted(self._maps)} to {path}")
+
+    def _grid_points(self, first: int, count: int) -> npt.NDArray[np.intp]:
+        # Points of this run, numbered in the order scanned, placed in the grid
+        points = self._first_point + np.arange(first, first + count)
+        if self._grid is None:
+            return points
+        return grid_indices(points, self._grid, self._snaking)
+
+    def _reduce(self, values: npt.ArrayLike, num_points: int) -> npt.ArrayLike:
+        # Each point's frames, reduced to one value if asked to
+        if self.reduce_frames is None or self._frames_per_point == 1:
+            return values
+        frames = np.reshape(values, (num_points, -1))
+        if self.reduce_frames == "sum":
+            return frames.sum(axis=1)
+        return frames.mean(axis=1)
+
+    def _read_pending(self) -> None:
+        # Frames may not be readable yet, keep any that fail to retry later
+        if self.read_external is None:
+            return
+        still_pending = []
+        for resource_uid, start, stop in self._pending:
+            resource = self._stream_resources[resource_uid]
+            key = resource["data_key"]
+            frames = self._frames_per_event[key]
+            try:
+                values = self.read_external(resource, start * frames, stop * frames)
+            except (OSError, KeyError) as e:
+                LOGGER.debug(f"Cannot read {key} yet: {e}")
+                still_pending.append((resource_uid, start, stop))
+            else:
+                points = self._grid_points(
+                    start * self._points_per_event[key],
+                    (stop - start) * self._points_per_event[key],
+                )
+                self._maps[key].write(points, self._reduce(values, len(points)))
+        self._pending = still_pending
+
+
+class RunStatistics(CallbackBase):
+    """Counts the documents, events and detector frames of the runs it sees.
+
+    Frames are counted from the stream datums of each detector's own data key,
+    and its exposure is the acquire_time in the descriptor's configuration, so
+    the time spent exposing can be compared with the time the runs took.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.documents: Counter[str] = Counter()
+        self.events = 0
+        self.frames: Counter[str] = Counter()
+        self.exposure_time: dict[str, float] = {}
+        self._frames_per_event: dict[str, int] = {}
+        self._stream_resources: dict[str, str] = {}
+
+    def __call__(self, name, doc, *args, **kwargs):
+        self.documents[name] += 1
+        return super().__call__(name, doc, *args, **kwargs)
+
+    @property
+    def points(self) -> int:
+        """Frames of the busiest detector, or events if no detector wrote any."""
+        return max(self.frames.values(), default=0) or self.events
+
+    @property
+    def live_time(self) -> float:
+        """Time the busiest detector spent exposing, in seconds."""
+        return max(
+            (
+                frames * self.exposure_time.get(key, 0.0)
+                for key, frames in self.frames.items()
+            ),
+            default=0.0,
+        )
+
+    def descriptor(self, doc):
+        for device, configuration in doc.get("configuration", {}).items():
+            for key, value in configuration.get("data", {}).items():
+                if key == f"{device}-driver-acquire_time":
+                    self.exposure_time[device] = float(value)
+        for key, data_key in doc["data_keys"].items():
+            if key in self.exposure_time and data_key["shape"]:
+                self._frames_per_event[key] = int(data_key["shape"][0] or 1)
+        return super().descriptor(doc)
+
+    def event(self, doc):
+        self.events += 1
+        return super().event(doc)
+
+    def stream_resource(self, doc):
+        if doc["data_key"] in self.exposure_time:
+            self._stream_resources[doc["uid"]] = doc["data_key"]
+        return super().stream_resource(doc)
+
+    def stream_datum(self, doc):
+        key = self._stream_resources.get(doc["stream_resource"])
+        if key is not None:
+            events = doc["indices"]["stop"] - doc["indices"]["start"]
+            self.frames[key] += events * self._frames_per_event.get(key, 1)
+        return super().stream_datum(doc)
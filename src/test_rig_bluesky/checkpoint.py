@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from .state import state_directory
+
+LOGGER = logging.getLogger(__name__)
+
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+
+def checkpoint_directory() -> Path:
+    """Checkpoints are kept in the state directory, so they outlive the worker.
+
+    Not with the data, whose directory is only known once a run has started and
+    changes from run to run.
+    """
+    directory = state_directory() / "checkpoints"
+    directory.mkdir(exist_ok=True)
+    return directory
+
+
+def scan_fingerprint(*parts: Any) -> str:
+    """Identify a scan by what it does, so only the same scan is resumed.
+
+    parts may be strings, numbers or arrays, e.g. the positions of each axis.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(np.ascontiguousarray(part, dtype=np.float64).tobytes())
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+@dataclass
+class Checkpoint:
+    """Progress of a scan, saved after every point so an aborted scan can resume.
+
+    Points are done in order, so progress is the number of points completed. A
+    scan resumed from a checkpoint is a new run, linked to the others by the
+    metadata from `start_part`.
+    """
+
+    name: str
+    path: Path
+    scan: str
+    completed: int = 0
+    parts: int = 0
+
+    @classmethod
+    def load(
+        cls, name: str, scan: str, directory: Path | str | None = None
+    ) -> "Checkpoint":
+        """Load the checkpoint called name, or start one if there is none.
+
+        :raises ValueError: If the name is not a file name, or the checkpoint is
+            of a different scan.
+        """
+        if name in ("", ".", "..") or any(
+            separator in name for separator in ("/", os.sep, os.altsep) if separator
+        ):
+            raise ValueError(f"Checkpoint name {name!r} must be a file name")
+        path = Path(directory or checkpoint_directory()) / (name + CHECKPOINT_SUFFIX)
+        if not path.exists():
+            return cls(name, path, scan)
+        saved = json.loads(path.read_text())
+        if saved["scan"] != scan:
+            raise ValueError(
+                f"Checkpoint {name} is of a different scan, "
+                f"remove {path} to start it again"
+            )
+        LOGGER.info(f"Resuming {name} after {saved['completed']} points")
+        return cls(name, path, scan, saved["completed"], saved["parts"])
+
+    def start_part(self) -> dict[str, Any]:
+        """Start another run of the scan, returning metadata to link it to the rest."""
+        self.parts += 1
+        self._save()
+        return {
+            "name": self.name,
+            "scan": self.scan,
+            "part": self.parts,
+            "first_point": self.completed,
+        }
+
+    def complete(self, completed: int) -> None:
+        """Record that the first completed points of the scan are done."""
+        self.completed = completed
+        self._save()
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+    def _save(self) -> None:
+        # Replace the file in one step so an abort never leaves half of it
+        saved = {"scan": self.scan, "completed": self.completed, "parts": self.parts}
+        temporary = self.path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(saved))
+        temporary.replace(self.path)
@@ -0,0 +1,237 @@
+import inspect
+from collections.abc import Mapping
+from dataclasses import dataclass
+from itertools import pairwise
+from typing import Any
+
+import numpy as np
+from scanspec.specs import Line, Spec
+
+from . import trajectory
+from .scans import ARAVIS_DEADTIME, FlyRow, fly_rows, series_num_frames
+from .settings import read_settings
+from .trajectory import (
+    AxisKinematics,
+    axis_key,
+    demo_grid,
+    kinematics_from_settings,
+    travel_time,
+)
+
+# Round trips of Channel Access latency made by spectroscopy before the scan:
+# one read and one write to apply the settings of both devices and the exposure
+# together, and a read of all the ROI names, a read of the current NDAttributes
+# and, at worst, their write
+SETTINGS_ROUND_TRIPS = 2
+NDATTRIBUTE_ROUND_TRIPS = 3
+
+# Estimates take the same arguments as the plan, bar its devices, with the
+# plan's defaults filled in
+Arguments = Mapping[str, Any]
+
+# snapshot takes frames at whatever exposure the detectors are left at, assume
+# that of the other plans
+SNAPSHOT_EXPOSURE_TIME = 0.1
+
+
+@dataclass(frozen=True)
+class DurationEstimate:
+    """Predicted wall clock time of a plan, in seconds, split by phase."""
+
+    settings_load: float = 0.0
+    ndattribute_setup: float = 0.0
+    motion: float = 0.0
+    exposure: float = 0.0
+    deadtime: float = 0.0
+
+    @property
+    def total(self) -> float:
+        return (
+            self.settings_load
+            + self.ndattribute_setup
+            + self.motion
+            + self.exposure
+            + self.deadtime
+        )
+
+
+def estimate_duration(
+    plan_name: str,
+    params: Mapping[str, Any] | None = None,
+    ca_latency: float = 0.005,
+    kinematics: Mapping[str, AxisKinematics] | None = None,
+) -> DurationEstimate:
+    """Predict how long a plan from test_rig_bluesky.plans will take.
+
+    The plan's phases are modelled without touching hardware. Stage kinematics
+    come from sample_stage_baseline.yaml unless given. Parameters that are not
+    given take the plan's defaults.
+
+    :param plan_name: Name of the plan, e.g. "demo_spectroscopy".
+    :param params: The parameters the plan would be run with, as for blueapi,
+        specs may be serialized.
+    :param ca_latency: Time for one Channel Access round trip.
+    :param kinematics: Kinematics of each stage axis, keyed by axis name.
+    """
+    from .run import DEVICE_NAMES, find_plan
+
+    if plan_name not in _ESTIMATORS:
+        raise ValueError(
+            f"Cannot estimate {plan_name}, there is no model of it, "
+            f"choose one of {sorted(_ESTIMATORS)}"
+        )
+    plan_params = {
+        name: parameter
+        for name, parameter in inspect.signature(
+            find_plan(plan_name)
+        ).parameters.items()
+        if name not in DEVICE_NAMES
+    }
+    params = params or {}
+    unknown = params.keys() - plan_params.keys()
+    if unknown:
+        raise ValueError(
+            f"Cannot estimate {plan_name} with {sorted(unknown)}, "
+            f"its parameters are {list(plan_params)}"
+        )
+    arguments = {
+        name: params.get(name, parameter.default)
+        for name, parameter in plan_params.items()
+    }
+    missing = [
+        name for name, value in arguments.items() if value is inspect.Parameter.empty
+    ]
+    if missing:
+        raise ValueError(f"Cannot estimate {plan_name} without {missing}")
+    if kinematics is None:
+        kinematics = kinematics_from_settings(read_settings("sample_stage_baseline"))
+    return _ESTIMATORS[plan_name](kinematics, ca_latency, arguments)
+
+
+def _snapshot(
+    kinematics: Mapping[str, AxisKinematics], ca_latency: float, arguments: Arguments
+) -> DurationEstimate:
+    return DurationEstimate(exposure=SNAPSHOT_EXPOSURE_TIME, deadtime=ARAVIS_DEADTIME)
+
+
+def _snapshot_series(
+    kinematics: Mapping[str, AxisKinematics], ca_latency: float, arguments: Arguments
+) -> DurationEstimate:
+    frame_rate = arguments["frame_rate"]
+    num_frames = series_num_frames(
+        frame_rate, arguments["num_frames"], arguments["duration"]
+    )
+    period = 1 / frame_rate
+    exposure_time = arguments["exposure_time"]
+    exposure = period - ARAVIS_DEADTIME if exposure_time is None else exposure_time
+    return DurationEstimate(
+        exposure=num_frames * exposure, deadtime=num_frames * (period - exposure)
+    )
+
+
+def _spectroscopy(
+    kinematics: Mapping[str, AxisKinematics], ca_latency: float, arguments: Arguments
+) -> DurationEstimate:
+    spec = arguments["spec"]
+    if spec is None:
+        # The plan's default, in its body as it needs the stage
+        spec = Line("sample_stage.x", 0, 5, 5)
+    elif not isinstance(spec, Spec):
+        spec = Spec.deserialize(spec)
+    positions = None
+    if arguments["optimise_trajectory"]:
+        # As in the plan, the optimised order is only kept if it is quicker
+        optimised = trajectory.optimise_trajectory(spec, kinematics)
+        spec = optimised.spec or spec
+        positions = optimised.positions
+
+    frames_per_point = arguments["frames_per_point"]
+    num_points = int(np.prod(spec.shape()))
+    num_frames = num_points * frames_per_point
+    deadtime = num_frames * ARAVIS_DEADTIME
+    rows = None
+    if arguments["fly"] and positions is None and frames_per_point == 1:
+        # Spec axes are names here, rather than the stage's motors
+        rows = fly_rows(spec, is_motor=lambda axis: isinstance(axis, str))
+    if rows is not None:
+        motion = _fly_motion_time(rows, kinematics)
+    else:
+        if positions is None:
+            positions = spec.frames().midpoints
+        motion = travel_time(positions, kinematics)
+        if arguments["pipelined"] and num_points > 1:
+            # Each point's frames are read out while the stage moves to the next
+            per_point = frames_per_point * ARAVIS_DEADTIME
+            per_move = motion / (num_points - 1)
+            deadtime = per_point + (num_points - 1) * max(per_point - per_move, 0.0)
+    return DurationEstimate(
+        settings_load=SETTINGS_ROUND_TRIPS * ca_latency,
+        ndattribute_setup=NDATTRIBUTE_ROUND_TRIPS * ca_latency,
+        motion=motion,
+        exposure=num_frames * arguments["exposure_time"],
+        deadtime=deadtime,
+    )
+
+
+# The parameters demo_spectroscopy makes its grid from, rather than passing on
+_DEMO_GRID_PARAMETERS = (
+    "total_number_of_scan_points",
+    "grid_size",
+    "grid_origin_x",
+    "grid_origin_y",
+)
+
+
+def _demo_spectroscopy(
+    kinematics: Mapping[str, AxisKinematics], ca_latency: float, arguments: Arguments
+) -> DurationEstimate:
+    grid = demo_grid(
+        "sample_stage.x",
+        "sample_stage.y",
+        arguments["total_number_of_scan_points"],
+        arguments["grid_size"],
+        arguments["grid_origin_x"],
+        arguments["grid_origin_y"],
+    )
+    # demo_spectroscopy passes the rest of its arguments on to spectroscopy
+    spectroscopy_arguments = {
+        name: value
+        for name, value in arguments.items()
+        if name not in _DEMO_GRID_PARAMETERS
+    }
+    return _spectroscopy(
+        kinematics, ca_latency, {**spectroscopy_arguments, "spec": grid}
+    )
+
+
+def _fly_motion_time(
+    rows: list[FlyRow], kinematics: Mapping[str, AxisKinematics]
+) -> float:
+    # Frames are taken while the stage moves, so only the run-up and run-down of
+    # each row and the moves between rows add to the exposures
+    ramps = sum(
+        2 * kinematics[axis_key(row.motor)].acceleration_time
+        for row in rows
+        if axis_key(row.motor) in kinematics
+    )
+    between_rows = 0.0
+    for previous, row in pairwise(rows):
+        end = {**previous.fixed_positions, previous.motor: previous.stop}
+        start = {**row.fixed_positions, row.motor: row.start}
+        between_rows += max(
+            (
+                float(kinematics[axis_key(axis)].move_time(start[axis] - end[axis]))
+                for axis in start
+                if axis in end and axis_key(axis) in kinematics
+            ),
+            default=0.0,
+        )
+    return ramps + between_rows
+
+
+_ESTIMATORS = {
+    "snapshot": _snapshot,
+    "snapshot_series": _snapshot_series,
+    "spectroscopy": _spectroscopy,
+    "demo_spectroscopy": _demo_spectroscopy,
+}
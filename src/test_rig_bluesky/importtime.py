@@ -0,0 +1,97 @@
+import subprocess
+import sys
+from collections import defaultdict
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import Any
+
+# Written to stderr between importing the preloaded modules and the one measured
+_MARKER = "test_rig_bluesky.importtime: measuring"
+
+
+@dataclass(frozen=True)
+class ImportTiming:
+    """Time to import a module, in seconds, as reported by ``-X importtime``.
+
+    cumulative includes the modules it imported first, self_time does not.
+    """
+
+    module: str
+    self_time: float
+    cumulative: float
+    depth: int
+
+
+@dataclass(frozen=True)
+class ImportReport:
+    module: str
+    preloaded: list[str]
+    timings: list[ImportTiming]
+
+    @property
+    def total(self) -> float:
+        return sum(timing.self_time for timing in self.timings)
+
+    def by_package(self) -> dict[str, float]:
+        """Time spent importing each top level package, slowest first."""
+        totals: dict[str, float] = defaultdict(float)
+        for timing in self.timings:
+            totals[timing.module.split(".")[0]] += timing.self_time
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def slowest(self, top: int = 10) -> list[ImportTiming]:
+        return sorted(self.timings, key=lambda timing: timing.self_time)[::-1][:top]
+
+    def summary(self, top: int = 10) -> dict[str, Any]:
+        return {
+            "module": self.module,
+            "preloaded": self.preloaded,
+            "total": self.total,
+            "modules": len(self.timings),
+            "packages": dict(list(self.by_package().items())[:top]),
+            "slowest": {
+                timing.module: timing.self_time for timing in self.slowest(top)
+            },
+        }
+
+
+def parse_importtime(output: str) -> list[ImportTiming]:
+    """Parse the stderr of ``python -X importtime``, ignoring anything else."""
+    timings = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, name = line.removeprefix("import time:").split("|")
+        timings.append(
+            ImportTiming(
+                module=name.strip(),
+                self_time=int(self_time) / 1e6,
+                cumulative=int(cumulative) / 1e6,
+                depth=(len(name) - len(name.lstrip())) // 2,
+            )
+        )
+    return timings
+
+
+def measure_import(module: str, preload: Sequence[str] = ()) -> ImportReport:
+    """Import module in a fresh interpreter, timing each module it imports.
+
+    Modules in preload are imported first and not counted, e.g. the beamline
+    module blueapi has already loaded when it imports the plans.
+    """
+    code = "; ".join(
+        [
+            "import sys",
+            *(f"import {name}" for name in preload),
+            f"sys.stderr.write({_MARKER!r} + '\\n')",
+            f"import {module}",
+        ]
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    _, _, measured = result.stderr.partition(_MARKER)
+    return ImportReport(module, list(preload), parse_importtime(measured))
@@ -1,31 +1,83 @@
-import math
+import hashlib
+import logging
+import time
+from functools import cache
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 from bluesky import plan_stubs as bps
-from bluesky.plans import count
+from bluesky import preprocessors as bpp
 from bluesky.protocols import Movable
 from bluesky.utils import MsgGenerator
 from dodal.common import inject
 from dodal.devices.motors import XYZStage
 from dodal.plan_stubs.data_session import attach_data_session_metadata_decorator
-from dodal.plans import spec_scan
-from ophyd_async.core import Device, Settings, SettingsProvider, YamlSettingsProvider
+from ophyd_async.core import (
+    Device,
+    SettingsProvider,
+    YamlSettingsProvider,
+    walk_rw_signals,
+)
 from ophyd_async.epics.adaravis import AravisDetector
 from ophyd_async.epics.adcore import (
+    NDArrayBaseIO,
     NDAttributeDataType,
     NDAttributeParam,
-)
-from ophyd_async.epics.adcore._core_io import NDROIStatNIO
-from ophyd_async.plan_stubs import (
-    apply_settings,
-    apply_settings_if_different,
-    retrieve_settings,
-    setup_ndattributes,
-    store_settings,
+    ndattributes_to_xml,
 )
 from scanspec.specs import Line, Spec
 
+from .profiling import phase
+from .settings import (
+    CachedSettingsProvider,
+    SettingsReport,
+    apply_settings_concurrently,
+    apply_settings_in_bulk,
+    read_values,
+    retrieve_whitelisted_settings,
+)
+from .settings_store import SETTINGS_HISTORY, SettingsDiff, SettingsStore
+from .state import state_directory
+
+# blueapi imports this module at worker start and on every environment reload,
+# so modules that are only needed to run a plan are imported by the plans
+if TYPE_CHECKING:
+    from ophyd_async.epics.adcore._core_io import NDROIStatNIO
+
+    from . import adaptive, trajectory
+
+LOGGER = logging.getLogger(__name__)
+
+# Signals of the baseline designs that spectroscopy applies before each scan
+_SPECTROSCOPY_DETECTOR_WHITELIST = [
+    "fileio-nd_array_port",
+    "roistat-channels-array_counter",
+    "roistat-channels-1-min_x",
+    "roistat-channels-1-min_y",
+    "roistat-channels-1-name_",
+    "roistat-channels-1-size_x",
+    "roistat-channels-1-size_y",
+    "roistat-channels-1-use",
+    "roistat-channels-2-min_x",
+    "roistat-channels-2-min_y",
+    "roistat-channels-2-name_",
+    "roistat-channels-2-size_x",
+    "roistat-channels-2-size_y",
+    "roistat-channels-2-use",
+    "roistat-channels-3-min_x",
+    "roistat-channels-3-min_y",
+    "roistat-channels-3-name_",
+    "roistat-channels-3-size_x",
+    "roistat-channels-3-size_y",
+    "roistat-channels-3-use",
+]
+_SAMPLE_STAGE_WHITELIST = [
+    "x-acceleration_time",
+    "x-velocity",
+    "y-acceleration_time",
+    "y-velocity",
+]
+
 imaging_detector = inject("imaging_detector")
 spectroscopy_detector = inject("spectroscopy_detector")
 sample_stage = inject("sample_stage")
@@ -34,33 +86,81 @@ sample_stage = inject("sample_stage")
 def save_settings(
     device: Device,
     design_name: str,
-) -> MsgGenerator[None]:
+) -> MsgGenerator[int]:
+    """Save the device's settings as design_name and add them to the history.
+
+    Returns the version number of the design in the history.
+    """
+    signals = walk_rw_signals(device)
+    values = yield from read_values(list(signals.values()))
+    named_values = dict(zip(signals, values, strict=True))
     provider = _settings_provider()
-    yield from store_settings(provider, design_name, device)
+    yield from bps.wait_for([lambda: provider.store(design_name, named_values)])
+    return _settings_history().save(design_name, named_values, device.name)
 
 
 def load_settings(
     device: Device,
     design_name: str,
     whitelist_pvs: list[str] | None = None,
-) -> MsgGenerator[None]:
-    provider = _settings_provider()
-    settings = yield from retrieve_settings(provider, design_name, device)
-    if whitelist_pvs is None:
-        settings_to_set = settings
-    else:
-        signal_values = {
-            signal: value
-            for signal, value in settings.items()
-            if signal.name.replace(f"{device.name}-", "") in whitelist_pvs
-        }
-        settings_to_set = Settings(settings.device, signal_values)
-    yield from apply_settings_if_different(settings_to_set, apply_settings)
+    version: int | None = None,
+) -> MsgGenerator[SettingsReport]:
+    """Apply saved settings to the device, by default those in design_name.yaml.
+
+    If version is given that version of the design is restored from the history.
+    """
+    provider = (
+        _settings_provider()
+        if version is None
+        else _settings_history().at_version(version)
+    )
+    signal_values = yield from retrieve_whitelisted_settings(
+        provider, design_name, device, whitelist_pvs
+    )
+    return (yield from apply_settings_in_bulk(signal_values))
+
+
+def diff_settings(
+    device: Device,
+    design_name: str,
+    version: int | None = None,
+) -> MsgGenerator[SettingsDiff]:
+    """Compare the device with a version of a design, by default the latest."""
+    signals = walk_rw_signals(device)
+    values = yield from read_values(list(signals.values()))
+    diff = _settings_history().diff_values(
+        design_name, dict(zip(signals, values, strict=True)), version
+    )
+    LOGGER.info(
+        f"{device.name} differs from {design_name} in {sorted(diff.changed)}, "
+        f"has {sorted(diff.added)} and lacks {sorted(diff.removed)}"
+    )
+    return diff
 
 
 def _settings_provider() -> SettingsProvider:
     this_directory = Path(__file__).parent
-    return YamlSettingsProvider(this_directory)
+    return CachedSettingsProvider(YamlSettingsProvider(this_directory), this_directory)
+
+
+def _settings_history() -> SettingsStore:
+    return _settings_store(state_directory() / SETTINGS_HISTORY)
+
+
+@cache
+def _settings_store(path: Path) -> SettingsStore:
+    # One store per file, so each plan only scans what was saved since the last
+    return SettingsStore(path)
+
+
+def _stage_kinematics() -> MsgGenerator[dict[str, "trajectory.AxisKinematics"]]:
+    from . import trajectory
+
+    provider = _settings_provider()
+    (task,) = yield from bps.wait_for(
+        [lambda: provider.retrieve("sample_stage_baseline")]
+    )
+    return trajectory.kinematics_from_settings(task.result())
 
 
 @attach_data_session_metadata_decorator()
@@ -70,89 +170,234 @@ def snapshot(
     sample_stage: XYZStage = sample_stage,
 ) -> MsgGenerator[None]:
     """Capture a snapshot of the current state of the beamline."""
+    from bluesky.plans import count
+
     yield from count([imaging_detector, spectroscopy_detector, sample_stage])
 
 
+def snapshot_series(
+    imaging_detector: AravisDetector = imaging_detector,
+    spectroscopy_detector: AravisDetector = spectroscopy_detector,
+    sample_stage: XYZStage = sample_stage,
+    frame_rate: float = 10.0,
+    num_frames: int | None = None,
+    duration: float | None = None,
+    exposure_time: float | None = None,
+    metadata: dict[str, Any] | None = None,
+) -> MsgGenerator[None]:
+    """Capture a time series of snapshots at frame_rate, e.g. to monitor drift.
+
+    Takes num_frames frames, or as many as fit in duration seconds, or 10 if
+    neither is given. Both detectors are armed once to take all of their frames,
+    so the time between frames is only set by frame_rate. Exposures are as long
+    as the frame rate allows unless exposure_time is given. Stage positions are
+    read into the positions stream as frames are collected.
+    """
+    from .scans import series_num_frames, time_series
+
+    yield from time_series(
+        [imaging_detector, spectroscopy_detector],
+        [sample_stage],
+        series_num_frames(frame_rate, num_frames, duration),
+        1 / frame_rate,
+        exposure_time=exposure_time,
+        metadata=metadata,
+    )
+
+
 def spectroscopy(
     spectroscopy_detector: AravisDetector = spectroscopy_detector,
     sample_stage: XYZStage = sample_stage,
     spec: Spec[Movable] | None = None,
     exposure_time: float = 0.1,
     metadata: dict[str, Any] | None = None,
+    fly: bool = False,
+    optimise_trajectory: bool = False,
+    frames_per_point: int = 1,
+    checkpoint: str | None = None,
+    pipelined: bool = False,
 ) -> MsgGenerator[None]:
-    """Do a spectroscopy scan."""
-    yield from load_settings(
-        device=spectroscopy_detector,
-        design_name="spectroscopy_detector_baseline",
-        whitelist_pvs=[
-            "fileio-nd_array_port",
-            "roistat-channels-array_counter",
-            "roistat-channels-1-min_x",
-            "roistat-channels-1-min_y",
-            "roistat-channels-1-name_",
-            "roistat-channels-1-size_x",
-            "roistat-channels-1-size_y",
-            "roistat-channels-1-use",
-            "roistat-channels-2-min_x",
-            "roistat-channels-2-min_y",
-            "roistat-channels-2-name_",
-            "roistat-channels-2-size_x",
-            "roistat-channels-2-size_y",
-            "roistat-channels-2-use",
-            "roistat-channels-3-min_x",
-            "roistat-channels-3-min_y",
-            "roistat-channels-3-name_",
-            "roistat-channels-3-size_x",
-            "roistat-channels-3-size_y",
-            "roistat-channels-3-use",
-        ],
-    )
+    """Do a spectroscopy scan.
 
-    # We call mv instead of prepare because prepare cannot technically be used
-    # outside of a run.
-    # See: https://github.com/DiamondLightSource/blueapi/issues/1211
-    #
-    # Deadtime taken from
-    # https://github.com/bluesky/ophyd-async/blob/15fa34b6ea2a28e2f27265a5564c9ee36423f1b7/src/ophyd_async/epics/adaravis/_aravis_controller.py#L11
-    yield from bps.mv(
-        *(spectroscopy_detector.driver.acquire_time, exposure_time),
-        *(spectroscopy_detector.driver.acquire_period, exposure_time + 1961e-6),
-        wait=True,
-    )
+    Every point of spec is checked against the limits of the sample stage
+    before the detector or stage are touched. If the spec is flown, each row's
+    velocity and run up are checked once settings are applied, before it moves.
+
+    If fly is True the sample stage moves continuously along each row of the spec
+    while the detector takes frames, falling back to a step scan if the spec
+    cannot be flown.
 
-    params: list[NDAttributeParam] = []
-    for channel in list(spectroscopy_detector.roistat.channels.keys()):  # type: ignore
-        roistatn = spectroscopy_detector.roistat.channels[channel]  # type: ignore
-        assert isinstance(roistatn, NDROIStatNIO)
+    If optimise_trajectory is True grids are snaked and other specs have their
+    points reordered to reduce the time spent moving the stage, up to
+    `trajectory.MAX_REORDERED_POINTS` of them.
 
-        channel_name = yield from bps.rd(roistatn.name_)
+    If frames_per_point is more than 1 the detector takes that many frames in a
+    single acquisition at each point, each point's event holding all of them.
 
-        params.append(
-            NDAttributeParam(
-                name=f"{channel_name}Total",
-                param="ROISTAT_TOTAL",
-                datatype=NDAttributeDataType.DOUBLE,
-                addr=channel - 1,
-                description=f"Sum of {channel_name} channel",
+    If checkpoint is given the points completed are saved under that name, and
+    if the scan is aborted running it again with the same checkpoint resumes
+    after the last completed point, or row when flying, in a new linked run.
+
+    If pipelined is True each step starts as soon as the detector has taken its
+    frames, while they are still being written, see `scans.step_scan`.
+    """
+    from dodal.plans import spec_scan
+
+    from . import trajectory
+    from .scans import fly_rows, fly_scan, step_scan
+    from .validation import validate_fly, validate_spec
+
+    spec = spec or Line(sample_stage.x, 0, 5, 5)
+    with phase("validate spec"):
+        yield from validate_spec(spec)
+
+    yield from _prepare_spectroscopy(spectroscopy_detector, sample_stage, exposure_time)
+
+    positions = None
+
+    if optimise_trajectory:
+        with phase("read stage kinematics"):
+            kinematics = yield from _stage_kinematics()
+        optimised = trajectory.optimise_trajectory(spec, kinematics)
+        LOGGER.info(
+            f"Estimated stage travel time {optimised.original_travel_time:.2f}s, "
+            f"optimised to {optimised.travel_time:.2f}s, "
+            f"saving {optimised.time_saved:.2f}s"
+        )
+        metadata = {
+            **(metadata or {}),
+            "trajectory_optimisation": {
+                "original_travel_time": optimised.original_travel_time,
+                "travel_time": optimised.travel_time,
+            },
+        }
+        spec = optimised.spec or spec
+        positions = optimised.positions
+
+    if positions is None:
+        # Where each point lies in the grid, e.g. to map a snaked grid
+        metadata = {**(metadata or {}), "snaking": trajectory.snaking(spec)}
+
+    if fly:
+        rows = fly_rows(spec) if positions is None and frames_per_point == 1 else None
+        if rows is not None:
+            with phase("validate spec"):
+                yield from validate_fly(rows, exposure_time)
+            with phase("scan"):
+                yield from fly_scan(
+                    spectroscopy_detector,
+                    rows,
+                    exposure_time,
+                    metadata,
+                    checkpoint,
+                    shape=spec.shape(),
+                )
+            return
+        LOGGER.warning(f"Cannot fly {spec}, falling back to a step scan")
+
+    if (
+        positions is None
+        and frames_per_point == 1
+        and checkpoint is None
+        and not pipelined
+    ):
+        with phase("scan"):
+            yield from spec_scan(
+                {spectroscopy_detector, sample_stage}, spec, metadata=metadata
             )
+    else:
+        shape = None if positions else spec.shape()
+        if positions is None:
+            midpoints = spec.frames().midpoints
+            positions = dict(midpoints.items())
+        with phase("scan"):
+            yield from step_scan(
+                {spectroscopy_detector, sample_stage},
+                positions,
+                shape=shape,
+                frames_per_point=frames_per_point,
+                exposure_time=exposure_time,
+                metadata=metadata,
+                checkpoint=checkpoint,
+                pipelined=pipelined,
+            )
+
+
+def _prepare_spectroscopy(
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+    exposure_time: float,
+) -> MsgGenerator[None]:
+    from .scans import ARAVIS_DEADTIME
+
+    # Both devices and the exposure are set with one grouped wait. The exposure
+    # is not set by prepare, which cannot be used outside of a run, see
+    # https://github.com/DiamondLightSource/blueapi/issues/1211
+    with phase("load settings"):
+        yield from apply_settings_concurrently(
+            _settings_provider(),
+            [
+                (
+                    spectroscopy_detector,
+                    "spectroscopy_detector_baseline",
+                    _SPECTROSCOPY_DETECTOR_WHITELIST,
+                ),
+                (sample_stage, "sample_stage_baseline", _SAMPLE_STAGE_WHITELIST),
+            ],
+            overrides={
+                spectroscopy_detector.driver.acquire_time: exposure_time,
+                spectroscopy_detector.driver.acquire_period: (
+                    exposure_time + ARAVIS_DEADTIME
+                ),
+            },
         )
 
-    yield from setup_ndattributes(spectroscopy_detector.roistat, params)  # type: ignore
-
-    yield from load_settings(
-        device=sample_stage,
-        design_name="sample_stage_baseline",
-        whitelist_pvs=[
-            "x-acceleration_time",
-            "x-velocity",
-            "y-acceleration_time",
-            "y-velocity",
-        ],
-    )
+    # The ROI names are only right once the detector's settings are applied
+    with phase("read ROI names"):
+        params = yield from _roi_ndattribute_params(spectroscopy_detector)
+
+    with phase("setup ndattributes"):
+        yield from _setup_ndattributes_if_changed(
+            spectroscopy_detector.roistat,  # type: ignore
+            params,
+        )
 
-    spec = spec or Line(sample_stage.x, 0, 5, 5)
 
-    yield from spec_scan({spectroscopy_detector, sample_stage}, spec, metadata=metadata)
+def _roi_ndattribute_params(
+    detector: AravisDetector,
+) -> MsgGenerator[list[NDAttributeParam]]:
+    # Read the names of all channels at once rather than one round trip each
+    channels: dict[int, NDROIStatNIO] = dict(detector.roistat.channels)  # type: ignore
+    names = yield from read_values([roistatn.name_ for roistatn in channels.values()])
+    return [
+        NDAttributeParam(
+            name=f"{channel_name}Total",
+            param="ROISTAT_TOTAL",
+            datatype=NDAttributeDataType.DOUBLE,
+            addr=channel - 1,
+            description=f"Sum of {channel_name} channel",
+        )
+        for channel, channel_name in zip(channels, names, strict=True)
+    ]
+
+
+def _setup_ndattributes_if_changed(
+    device: NDArrayBaseIO, params: list[NDAttributeParam]
+) -> MsgGenerator[None]:
+    from ophyd_async.plan_stubs import setup_ndattributes
+
+    # Writing the XML makes the plugin reconfigure, skip it if the IOC already
+    # has the same attributes
+    current_xml = yield from bps.rd(device.nd_attributes_file)
+    required_xml = ndattributes_to_xml(params)
+    if _xml_hash(current_xml) == _xml_hash(required_xml):
+        LOGGER.info(f"NDAttributes of {device.name} unchanged, not rewriting them")
+        return
+    yield from setup_ndattributes(device, params)
+
+
+def _xml_hash(xml: str) -> str:
+    return hashlib.sha256(xml.strip().encode()).hexdigest()
 
 
 def demo_spectroscopy(
@@ -164,18 +409,25 @@ def demo_spectroscopy(
     grid_origin_y: float = 0.0,
     exposure_time: float = 0.1,
     metadata: dict[str, Any] | None = None,
+    fly: bool = False,
+    optimise_trajectory: bool = False,
+    frames_per_point: int = 1,
+    checkpoint: str | None = None,
+    pipelined: bool = False,
 ) -> MsgGenerator[None]:
     """Spectroscopy plan intended for use in Visr demonstrations to visitors.
     The time taken to scan is approximately linear in total_numbers_of_grid_points.
     All other parameters can be left at their defaults.
     """
-    xsteps = ysteps = int(round(math.sqrt(max(total_number_of_scan_points, 1))))
-    xmin = grid_origin_x
-    xmax = grid_origin_x + grid_size
-    ymin = grid_origin_y
-    ymax = grid_origin_y + grid_size
-    grid = Line(sample_stage.y, ymin, ymax, ysteps) * Line(
-        sample_stage.x, xmin, xmax, xsteps
+    from . import trajectory
+
+    grid = trajectory.demo_grid(
+        sample_stage.x,
+        sample_stage.y,
+        total_number_of_scan_points,
+        grid_size,
+        grid_origin_x,
+        grid_origin_y,
     )
     yield from spectroscopy(
         spectroscopy_detector=spectroscopy_detector,
@@ -183,4 +435,114 @@ def demo_spectroscopy(
         spec=grid,
         exposure_time=exposure_time,
         metadata=metadata,
+        fly=fly,
+        optimise_trajectory=optimise_trajectory,
+        frames_per_point=frames_per_point,
+        checkpoint=checkpoint,
+        pipelined=pipelined,
     )
+
+
+def adaptive_spectroscopy(
+    spectroscopy_detector: AravisDetector = spectroscopy_detector,
+    sample_stage: XYZStage = sample_stage,
+    grid_size: float = 5.0,
+    grid_origin_x: float = 0.0,
+    grid_origin_y: float = 0.0,
+    coarse_steps: int = 5,
+    max_points: int = 100,
+    time_budget: float | None = None,
+    threshold: float = 0.1,
+    max_depth: int = 3,
+    exposure_time: float = 0.1,
+    metadata: dict[str, Any] | None = None,
+) -> MsgGenerator[None]:
+    """Spectroscopy scan that starts coarse and adds points where the sample varies.
+
+    After a coarse_steps x coarse_steps grid, the grid cell whose ROI totals vary
+    the most is split into quarters, repeatedly, until no cell varies by more
+    than threshold of the range seen over the coarse grid, or max_points have
+    been taken, or time_budget seconds have passed since the scan started.
+    """
+    from . import adaptive
+
+    yield from _prepare_spectroscopy(spectroscopy_detector, sample_stage, exposure_time)
+    yield from _adaptive_scan(
+        spectroscopy_detector,
+        sample_stage,
+        adaptive.AdaptiveGrid(
+            (grid_origin_x, grid_origin_x + grid_size),
+            (grid_origin_y, grid_origin_y + grid_size),
+            coarse_steps,
+            threshold=threshold,
+            max_depth=max_depth,
+        ),
+        max_points,
+        time_budget,
+        {
+            "plan_args": {
+                "grid_size": grid_size,
+                "grid_origin_x": grid_origin_x,
+                "grid_origin_y": grid_origin_y,
+                "coarse_steps": coarse_steps,
+                "max_points": max_points,
+                "time_budget": time_budget,
+                "threshold": threshold,
+                "max_depth": max_depth,
+                "exposure_time": exposure_time,
+            },
+            **(metadata or {}),
+        },
+    )
+
+
+@attach_data_session_metadata_decorator()
+def _adaptive_scan(
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+    grid: "adaptive.AdaptiveGrid",
+    max_points: int,
+    time_budget: float | None,
+    metadata: dict[str, Any],
+) -> MsgGenerator[None]:
+    totals = [
+        channel.total
+        for channel in spectroscopy_detector.roistat.channels.values()  # type: ignore
+    ]
+    _md = {
+        "detectors": [spectroscopy_detector.name],
+        "motors": [sample_stage.x.name, sample_stage.y.name],
+        "plan_name": "adaptive_spectroscopy",
+        "hints": {
+            "dimensions": [
+                ([sample_stage.x.name], "primary"),
+                ([sample_stage.y.name], "primary"),
+            ]
+        },
+        **metadata,
+    }
+
+    @bpp.stage_decorator([spectroscopy_detector, sample_stage])
+    @bpp.run_decorator(md=_md)
+    def inner_adaptive_scan() -> MsgGenerator[None]:
+        start = time.monotonic()
+        num_points = 0
+        to_measure = grid.coarse_points()
+        while to_measure:
+            for x, y in to_measure:
+                out_of_time = (
+                    time_budget is not None and time.monotonic() - start > time_budget
+                )
+                if num_points >= max_points or out_of_time:
+                    LOGGER.info(f"Stopping adaptive scan after {num_points} points")
+                    return
+                yield from bps.mv(sample_stage.x, x, sample_stage.y, y)
+                yield from bps.trigger_and_read([spectroscopy_detector, sample_stage])
+                # The ROI totals of the frame just taken, to decide where to go next
+                values = yield from read_values(totals)
+                grid.add((x, y), values)
+                num_points += 1
+            to_measure = grid.refine()
+        LOGGER.info(f"Adaptive scan converged after {num_points} points")
+
+    yield from inner_adaptive_scan()
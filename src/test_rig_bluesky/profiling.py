@@ -0,0 +1,180 @@
+import json
+import time
+from collections import defaultdict
+from collections.abc import Generator, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, TypeVar
+
+from bluesky.utils import Msg, MsgGenerator
+
+T = TypeVar("T")
+
+# Profilers of the plans currently running, innermost last
+_active: list["PlanProfiler"] = []
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Mark part of a plan as a phase, timed if the plan is being profiled.
+
+    Use around the ``yield from`` statements of a plan, e.g.::
+
+        with phase("load settings"):
+            yield from load_settings(...)
+    """
+    if not _active:
+        yield
+        return
+    with _active[-1].phase(name):
+        yield
+
+
+@dataclass(frozen=True)
+class PhaseTiming:
+    path: tuple[str, ...]
+    duration: float
+
+
+@dataclass
+class MessageStats:
+    """Count and time spent by the RunEngine processing one type of message."""
+
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def add(self, latency: float) -> None:
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+
+@dataclass(frozen=True)
+class ProfileReport:
+    """Wall time of a plan, split by phase and by message type, in seconds."""
+
+    name: str
+    total: float
+    phases: list[PhaseTiming]
+    messages: dict[str, MessageStats]
+    message_time_by_phase: dict[tuple[str, ...], dict[str, float]] = field(repr=False)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "total": self.total,
+            "phases": [
+                {"phase": "/".join(timing.path), "duration": timing.duration}
+                for timing in self.phases
+            ],
+            "messages": {
+                command: asdict(stats) for command, stats in self.messages.items()
+            },
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_folded(self) -> str:
+        """Render as folded stacks in microseconds, for flamegraph.pl or speedscope.
+
+        Time spent processing each message type is a leaf of the phase it was
+        sent from. Time not spent on messages, e.g. in the plan's own Python, is
+        left with the phase itself.
+        """
+        durations: dict[tuple[str, ...], float] = defaultdict(float)
+        for timing in self.phases:
+            durations[timing.path] += timing.duration
+        durations[()] = self.total
+
+        self_times = dict(durations)
+        for path, duration in durations.items():
+            if path:
+                self_times[path[:-1]] -= duration
+        lines = []
+        for path, self_time in self_times.items():
+            for command, latency in self.message_time_by_phase.get(path, {}).items():
+                lines.append(_folded_line((self.name, *path, command), latency))
+                self_time -= latency
+            lines.append(_folded_line((self.name, *path), self_time))
+        return "\n".join(line for line in lines if line) + "\n"
+
+
+def _folded_line(stack: tuple[str, ...], seconds: float) -> str:
+    microseconds = round(seconds * 1e6)
+    return f"{';'.join(stack)} {microseconds}" if microseconds > 0 else ""
+
+
+class PlanProfiler:
+    """Records how long each phase of a plan and each of its messages take.
+
+    Wrap the plan with `profile` before giving it to the RunEngine, then get the
+    timings with `report`.
+    """
+
+    def __init__(self, name: str = "plan"):
+        self.name = name
+        self._stack: list[str] = []
+        self._phases: list[PhaseTiming] = []
+        self._messages: dict[str, MessageStats] = defaultdict(MessageStats)
+        self._message_time_by_phase: dict[tuple[str, ...], dict[str, float]] = (
+            defaultdict(lambda: defaultdict(float))
+        )
+        self._total = 0.0
+
+    def profile(self, plan: MsgGenerator[T]) -> MsgGenerator[T]:
+        """Pass through every message of plan, timing how long each takes."""
+        _active.append(self)
+        start = time.perf_counter()
+        try:
+            return (yield from self._timed(plan))
+        finally:
+            self._total = time.perf_counter() - start
+            _active.remove(self)
+
+    def _timed(self, plan: MsgGenerator[T]) -> Generator[Msg, Any, T]:
+        response: Any = None
+        error: BaseException | None = None
+        while True:
+            try:
+                msg = plan.send(response) if error is None else plan.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            path = tuple(self._stack)
+            response, error = None, None
+            sent = time.perf_counter()
+            try:
+                response = yield msg
+            except GeneratorExit:
+                plan.close()
+                raise
+            except BaseException as e:
+                error = e
+            latency = time.perf_counter() - sent
+            self._messages[msg.command].add(latency)
+            self._message_time_by_phase[path][msg.command] += latency
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time a phase of the plan being profiled, nested in the current one."""
+        self._stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phases.append(
+                PhaseTiming(tuple(self._stack), time.perf_counter() - start)
+            )
+            self._stack.pop()
+
+    def report(self) -> ProfileReport:
+        return ProfileReport(
+            name=self.name,
+            total=self._total,
+            phases=list(self._phases),
+            messages=dict(self._messages),
+            message_time_by_phase={
+                path: dict(times) for path, times in self._message_time_by_phase.items()
+            },
+        )
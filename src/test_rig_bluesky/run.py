@@ -0,0 +1,190 @@
+import inspect
+import time
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass
+from typing import Any, Literal, get_args, get_origin, get_type_hints
+
+from bluesky import RunEngine
+from bluesky.utils import MsgGenerator
+from ophyd_async.core import Device, PathProvider
+from scanspec.specs import Spec
+
+from .callbacks import RunStatistics
+
+# The b01-1 devices the plans take, by the name of their parameters
+DEVICE_NAMES = ("imaging_detector", "spectroscopy_detector", "sample_stage")
+
+
+@dataclass(frozen=True)
+class RunReport:
+    """Throughput of a plan run in process, times in seconds.
+
+    live_time is the time the busiest detector spent exposing, the rest of the
+    wall time is dead time: moves, readout, settings and the RunEngine itself.
+    """
+
+    plan: str
+    wall_time: float
+    points: int
+    live_time: float
+    documents: dict[str, int]
+
+    @property
+    def points_per_second(self) -> float:
+        return self.points / self.wall_time if self.wall_time else 0.0
+
+    @property
+    def dead_time_fraction(self) -> float:
+        if not self.wall_time:
+            return 0.0
+        return max(0.0, 1 - self.live_time / self.wall_time)
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "plan": self.plan,
+            "wall_time": self.wall_time,
+            "points": self.points,
+            "points_per_second": self.points_per_second,
+            "live_time": self.live_time,
+            "dead_time_fraction": self.dead_time_fraction,
+            "documents": sum(self.documents.values()),
+            "documents_by_type": self.documents,
+        }
+
+
+def make_devices(
+    kind: Literal["sim", "real"] = "sim",
+    frame_rate: float | None = None,
+    path_provider: PathProvider | None = None,
+) -> dict[str, Device]:
+    """Make the devices the plans use, simulated or from dodal.beamlines.b01_1.
+
+    Create the RunEngine first, the devices are connected in its event loop.
+    Real devices write to path_provider on the detector IOC's host, and it
+    replaces the beamline's path provider. frame_rate is only used by simulated
+    detectors, see `test_rig_bluesky.testing.SimulatedAravis`.
+    """
+    if kind == "sim":
+        from .testing import (
+            SimulatedSample,
+            simulated_imaging_detector,
+            simulated_sample_stage,
+            simulated_spectroscopy_detector,
+        )
+
+        sample = SimulatedSample()
+        sample_stage = simulated_sample_stage()
+        return {
+            "imaging_detector": simulated_imaging_detector(
+                sample_stage, sample, frame_rate, path_provider
+            ),
+            "spectroscopy_detector": simulated_spectroscopy_detector(
+                sample_stage, sample, frame_rate, path_provider
+            ),
+            "sample_stage": sample_stage,
+        }
+
+    from dodal.beamlines import b01_1
+    from dodal.common.beamlines.beamline_utils import set_path_provider
+
+    if path_provider is not None:
+        set_path_provider(path_provider)
+    return {
+        name: getattr(b01_1, name)(connect_immediately=True) for name in DEVICE_NAMES
+    }
+
+
+def find_plan(plan_name: str) -> Callable[..., MsgGenerator]:
+    """Look up a public plan of test_rig_bluesky.plans by name."""
+    from . import plans
+
+    available = {
+        name: function
+        for name, function in inspect.getmembers(plans, inspect.isfunction)
+        if function.__module__ == plans.__name__ and not name.startswith("_")
+    }
+    if plan_name not in available:
+        raise ValueError(f"No plan {plan_name}, choose one of {sorted(available)}")
+    return available[plan_name]
+
+
+def plan_arguments(
+    plan: Callable[..., MsgGenerator],
+    params: Mapping[str, Any],
+    devices: Mapping[str, Device],
+) -> dict[str, Any]:
+    """Turn parameters given as JSON, as for blueapi, into arguments of plan.
+
+    Strings naming a device or one of its children, e.g. "sample_stage.x", are
+    replaced by it, so serialized specs get their axes back before they are
+    deserialized. Device parameters that are not given default to the device of
+    the same name.
+    """
+    hints = get_type_hints(plan)
+    parameters = inspect.signature(plan).parameters
+    unknown = set(params) - set(parameters)
+    if unknown:
+        raise ValueError(f"{plan.__name__} has no parameters {sorted(unknown)}")
+
+    arguments: dict[str, Any] = {}
+    for name in parameters:
+        if name in params:
+            value = _resolve_devices(params[name], devices)
+            if isinstance(value, Mapping) and _is_spec(hints.get(name)):
+                value = Spec.deserialize(value)
+            arguments[name] = value
+        elif name in devices:
+            arguments[name] = devices[name]
+    return arguments
+
+
+def run_plan(
+    run_engine: RunEngine,
+    plan_name: str,
+    params: Mapping[str, Any] | None = None,
+    devices: Mapping[str, Device] | None = None,
+) -> RunReport:
+    """Run a plan of test_rig_bluesky.plans in run_engine, measuring throughput.
+
+    :param run_engine: The RunEngine the devices were connected in.
+    :param plan_name: Name of the plan, e.g. "spectroscopy".
+    :param params: The plan's parameters as JSON, as for blueapi.
+    :param devices: Devices by name, e.g. from `make_devices`.
+    """
+    plan = find_plan(plan_name)
+    arguments = plan_arguments(plan, params or {}, devices or {})
+    statistics = RunStatistics()
+    token = run_engine.subscribe(statistics)
+    start = time.perf_counter()
+    try:
+        run_engine(plan(**arguments))
+    finally:
+        wall_time = time.perf_counter() - start
+        run_engine.unsubscribe(token)
+    return RunReport(
+        plan=plan_name,
+        wall_time=wall_time,
+        points=statistics.points,
+        live_time=statistics.live_time,
+        documents=dict(statistics.documents),
+    )
+
+
+def _resolve_devices(value: Any, devices: Mapping[str, Device]) -> Any:
+    if isinstance(value, str):
+        name, *path = value.split(".")
+        device: Any = devices.get(name)
+        for child in path:
+            device = getattr(device, child, None)
+        return value if device is None else device
+    if isinstance(value, Mapping):
+        return {key: _resolve_devices(item, devices) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_resolve_devices(item, devices) for item in value]
+    return value
+
+
+def _is_spec(annotation: Any) -> bool:
+    if get_origin(annotation) is Spec or annotation is Spec:
+        return True
+    return any(_is_spec(arg) for arg in get_args(annotation))
@@ -0,0 +1,530 @@
+import asyncio
+import logging
+import math
+from collections.abc import Callable, Collection, Mapping, Sequence
+from dataclasses import dataclass
+from itertools import pairwise
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from bluesky import plan_stubs as bps
+from bluesky import preprocessors as bpp
+from bluesky.protocols import Movable, Readable, Triggerable
+from bluesky.utils import MsgGenerator, separate_devices, short_uid
+from dodal.plan_stubs.data_session import attach_data_session_metadata_decorator
+from ophyd_async.core import (
+    DEFAULT_TIMEOUT,
+    Array1D,
+    DetectorTrigger,
+    FlyMotorInfo,
+    SignalR,
+    StandardDetector,
+    TriggerInfo,
+    soft_signal_r_and_setter,
+    wait_for_value,
+)
+from ophyd_async.epics.adaravis import AravisDetector
+from ophyd_async.epics.adcore import ADBaseIO
+from ophyd_async.epics.motor import Motor
+from ophyd_async.plan_stubs import ensure_connected
+from scanspec.specs import Spec
+
+from .checkpoint import Checkpoint, scan_fingerprint
+
+LOGGER = logging.getLogger(__name__)
+
+# Deadtime taken from
+# https://github.com/bluesky/ophyd-async/blob/15fa34b6ea2a28e2f27265a5564c9ee36423f1b7/src/ophyd_async/epics/adaravis/_aravis_controller.py#L11
+ARAVIS_DEADTIME = 1961e-6
+
+
+@dataclass(frozen=True)
+class FlyRow:
+    """A contiguous run of frames that can be covered by one continuous move."""
+
+    motor: Motor
+    start: float
+    stop: float
+    num_frames: int
+    fixed_positions: dict[Motor, float]
+
+    @property
+    def positions(self) -> npt.NDArray[np.float64]:
+        """Position of the moving motor in the middle of each frame."""
+        width = (self.stop - self.start) / self.num_frames
+        frames = np.arange(self.num_frames, dtype=np.float64)
+        return self.start + width * (frames + 0.5)
+
+
+def _is_motor(axis: Any) -> bool:
+    return isinstance(axis, Motor)
+
+
+def fly_rows(
+    spec: Spec[Any], is_motor: Callable[[Any], bool] = _is_motor
+) -> list[FlyRow] | None:
+    """Split a spec into rows that can each be flown by a single motor.
+
+    Returns None if the spec cannot be flown, e.g. if more than one axis moves
+    within a row, frames are unevenly sized or rows have different lengths.
+    is_motor picks the axes that are motors, e.g. to split a spec of axis names
+    without the devices, in which case the rows hold the names.
+    """
+    frames = spec.frames(bounds=True)
+    axes: list[Any] = [axis for axis in frames.axes() if is_motor(axis)]
+    if not axes or len(axes) != len(frames.axes()):
+        return None
+
+    gap = np.array(frames.gap, dtype=bool)
+    gap[0] = True
+    row_edges = [*np.flatnonzero(gap), len(frames)]
+
+    rows: list[FlyRow] = []
+    for begin, end in pairwise(row_edges):
+        lower = {axis: frames.lower[axis][begin:end] for axis in axes}
+        upper = {axis: frames.upper[axis][begin:end] for axis in axes}
+        moving = [axis for axis in axes if not np.allclose(lower[axis], upper[axis])]
+        if len(moving) != 1:
+            return None
+        (motor,) = moving
+        widths = upper[motor] - lower[motor]
+        if not np.allclose(widths, widths[0]):
+            return None
+        fixed_positions: dict[Motor, float] = {}
+        for axis in axes:
+            if axis is motor:
+                continue
+            if not np.allclose(lower[axis], lower[axis][0]):
+                return None
+            fixed_positions[axis] = float(lower[axis][0])
+        rows.append(
+            FlyRow(
+                motor=motor,
+                start=float(lower[motor][0]),
+                stop=float(upper[motor][-1]),
+                num_frames=int(end - begin),
+                fixed_positions=fixed_positions,
+            )
+        )
+
+    if len({row.num_frames for row in rows}) != 1:
+        return None
+    return rows
+
+
+@attach_data_session_metadata_decorator()
+def fly_scan(
+    detector: AravisDetector,
+    rows: list[FlyRow],
+    exposure_time: float,
+    metadata: dict[str, Any] | None = None,
+    checkpoint: str | None = None,
+    shape: Sequence[int] | None = None,
+) -> MsgGenerator[None]:
+    """Move continuously along each row, taking frames on an internal time trigger.
+
+    Each row is recorded as one event in which the detector has taken one frame
+    per point of the row, so the ROI totals keep the shape of the spec. Frames
+    start once the moving motor has run up to the start of the row, and the
+    event holds its position in the middle of each frame. shape is that of the
+    spec, by default rows by frames.
+
+    If checkpoint is given the rows completed are saved under that name, and
+    running the same scan again resumes after the last completed row.
+    """
+    num_frames = rows[0].num_frames
+    period = exposure_time + ARAVIS_DEADTIME
+    motors = list(dict.fromkeys(row.motor for row in rows))
+
+    _md = {
+        "plan_name": "fly_scan",
+        "shape": list(shape or (len(rows), num_frames)),
+        "hints": {"dimensions": [([motor.name], "primary") for motor in motors]},
+        **(metadata or {}),
+    }
+    progress = None
+    if checkpoint is not None:
+        progress = Checkpoint.load(
+            checkpoint,
+            scan_fingerprint(
+                "fly_scan",
+                exposure_time,
+                *(
+                    (row.motor.name, row.start, row.stop, row.num_frames)
+                    + tuple((m.name, p) for m, p in row.fixed_positions.items())
+                    for row in rows
+                ),
+            ),
+        )
+        if progress.completed >= len(rows) * num_frames:
+            LOGGER.info(f"All rows of {checkpoint} are done")
+            progress.remove()
+            return
+        _md["checkpoint"] = progress.start_part()
+    first_row = progress.completed // num_frames if progress else 0
+
+    # Preparing a motor to fly changes its velocity, so put it back afterwards
+    original_velocities = []
+    for motor in motors:
+        velocity = yield from bps.rd(motor.velocity)
+        original_velocities.extend([motor.velocity, velocity])
+
+    def restore_velocities() -> MsgGenerator[None]:
+        yield from bps.mv(*original_velocities, wait=True)
+
+    # Read in place of each moving motor, which is not at one position per event
+    frame_positions = {
+        motor: soft_signal_r_and_setter(Array1D[np.float64], name=motor.name)
+        for motor in motors
+    }
+    yield from ensure_connected(*(signal for signal, _ in frame_positions.values()))
+
+    @bpp.finalize_decorator(restore_velocities)
+    @bpp.stage_decorator([detector])
+    @bpp.run_decorator(md=_md)
+    def inner_fly_scan() -> MsgGenerator[None]:
+        # Prepare must happen after staging, which clears any previous TriggerInfo
+        yield from bps.prepare(
+            detector,
+            TriggerInfo(
+                number_of_events=1,
+                exposures_per_event=num_frames,
+                trigger=DetectorTrigger.INTERNAL,
+                livetime=exposure_time,
+                deadtime=ARAVIS_DEADTIME,
+            ),
+            wait=True,
+        )
+        for index, row in enumerate(rows[first_row:], start=first_row):
+            signal, set_positions = frame_positions[row.motor]
+            set_positions(row.positions)
+            yield from _fly_row(detector, row, period, signal)
+            if progress is not None:
+                progress.complete((index + 1) * num_frames)
+
+    yield from inner_fly_scan()
+    if progress is not None:
+        progress.remove()
+
+
+def _fly_row(
+    detector: AravisDetector,
+    row: FlyRow,
+    period: float,
+    frame_positions: SignalR[Array1D[np.float64]],
+) -> MsgGenerator:
+    if row.fixed_positions:
+        yield from bps.mv(
+            *(arg for item in row.fixed_positions.items() for arg in item)
+        )
+    yield from bps.prepare(
+        row.motor,
+        FlyMotorInfo(
+            start_position=row.start,
+            end_position=row.stop,
+            time_for_move=row.num_frames * period,
+        ),
+        wait=True,
+    )
+    acceleration_time = yield from bps.rd(row.motor.acceleration_time)
+    yield from bps.kickoff(row.motor, wait=True)
+    # The motor is at constant velocity once it has run up to the start of the row
+    yield from bps.wait_for(
+        [
+            lambda: _passed(
+                row.motor,
+                row.start,
+                row.stop > row.start,
+                DEFAULT_TIMEOUT + acceleration_time,
+            )
+        ]
+    )
+    yield from bps.trigger_and_read([detector, frame_positions, *row.fixed_positions])
+    yield from bps.complete(row.motor, wait=True)
+
+
+async def _passed(
+    motor: Motor, position: float, increasing: bool, timeout: float
+) -> None:
+    def passed(value: float) -> bool:
+        return value >= position if increasing else value <= position
+
+    await wait_for_value(motor.user_readback, passed, timeout)
+
+
+@attach_data_session_metadata_decorator()
+def step_scan(
+    detectors: Collection[Readable],
+    positions: Mapping[Movable, npt.NDArray[np.float64]],
+    shape: Sequence[int] | None = None,
+    frames_per_point: int = 1,
+    exposure_time: float | None = None,
+    metadata: dict[str, Any] | None = None,
+    checkpoint: str | None = None,
+    pipelined: bool = False,
+) -> MsgGenerator[None]:
+    """Step scan through explicit positions, in the order given.
+
+    With more than one frame per point each detector is armed once per point to
+    take all of its frames, which are grouped into that point's event.
+
+    If checkpoint is given the points completed are saved under that name, and
+    running the same scan again resumes after the last completed point.
+
+    If pipelined is True the move to the next point starts as soon as the
+    detectors have acquired this point's frames, while they are still being
+    written. Each point's event holds the positions read back before the move.
+    """
+    motors = list(positions)
+    readable_motors = [motor for motor in motors if isinstance(motor, Readable)]
+    num_points = len(positions[motors[0]])
+    _md = {
+        "detectors": [det.name for det in detectors],
+        "motors": [motor.name for motor in readable_motors],
+        "num_points": num_points,
+        "num_intervals": num_points - 1,
+        "plan_args": {
+            "detectors": {det.name for det in detectors},
+            "frames_per_point": frames_per_point,
+        },
+        "plan_name": "step_scan",
+        "shape": list(shape or (num_points,)),
+        "hints": {
+            "dimensions": [([motor.name], "primary") for motor in readable_motors]
+        },
+        **(metadata or {}),
+    }
+    progress = None
+    if checkpoint is not None:
+        progress = Checkpoint.load(
+            checkpoint,
+            scan_fingerprint(
+                "step_scan",
+                frames_per_point,
+                exposure_time,
+                *(
+                    part
+                    for motor in motors
+                    for part in (getattr(motor, "name", motor), positions[motor])
+                ),
+            ),
+        )
+        if progress.completed >= num_points:
+            LOGGER.info(f"All points of {checkpoint} are done")
+            progress.remove()
+            return
+        _md["checkpoint"] = progress.start_part()
+    first_point = progress.completed if progress else 0
+
+    @bpp.stage_decorator([*detectors, *motors])
+    @bpp.run_decorator(md=_md)
+    def inner_step_scan() -> MsgGenerator[None]:
+        # Prepare must happen after staging, which clears any previous TriggerInfo
+        if frames_per_point > 1:
+            group = short_uid("prepare")
+            for detector in detectors:
+                if isinstance(detector, StandardDetector):
+                    yield from bps.prepare(
+                        detector,
+                        TriggerInfo(
+                            number_of_events=1,
+                            exposures_per_event=frames_per_point,
+                            trigger=DetectorTrigger.INTERNAL,
+                            livetime=exposure_time,
+                            deadtime=ARAVIS_DEADTIME,
+                        ),
+                        group=group,
+                    )
+            yield from bps.wait(group=group)
+        if pipelined:
+            yield from _pipelined_points(
+                detectors,
+                positions,
+                range(first_point, num_points),
+                frames_per_point,
+                exposure_time,
+                progress,
+            )
+            return
+        for index in range(first_point, num_points):
+            yield from bps.mv(
+                *(arg for motor in motors for arg in (motor, positions[motor][index]))
+            )
+            yield from bps.trigger_and_read([*detectors, *readable_motors])
+            if progress is not None:
+                progress.complete(index + 1)
+
+    yield from inner_step_scan()
+    if progress is not None:
+        progress.remove()
+
+
+def _pipelined_points(
+    detectors: Collection[Readable],
+    positions: Mapping[Movable, npt.NDArray[np.float64]],
+    indices: range,
+    frames_per_point: int,
+    exposure_time: float | None,
+    progress: Checkpoint | None,
+) -> MsgGenerator[None]:
+    motors = list(positions)
+    triggered = [
+        detector for detector in detectors if isinstance(detector, Triggerable)
+    ]
+    # Read with the motors, before they move on, e.g. the sample stage itself.
+    # As in trigger_and_read, a device's children are not read again
+    positioners = separate_devices(
+        [
+            *(detector for detector in detectors if detector not in triggered),
+            *(motor for motor in motors if isinstance(motor, Readable)),
+        ]
+    )
+    # A detector has acquired its frames once its array counter reaches them,
+    # others only once they have triggered and written them
+    counters = [
+        counter
+        for detector in triggered
+        if (counter := _array_counter(detector)) is not None
+    ]
+    uncounted = [detector for detector in triggered if _array_counter(detector) is None]
+    timeout = DEFAULT_TIMEOUT + frames_per_point * (exposure_time or 0)
+    (task,) = yield from bps.wait_for(
+        [lambda: asyncio.gather(*(counter.get_value() for counter in counters))]
+    )
+    acquired: list[int] = task.result()
+
+    yield from bps.mv(
+        *(arg for motor in motors for arg in (motor, positions[motor][indices[0]]))
+    )
+    for index in indices:
+        counted_group, uncounted_group = short_uid("trigger"), short_uid("trigger")
+        for detector in triggered:
+            group = uncounted_group if detector in uncounted else counted_group
+            yield from bps.trigger(detector, group=group)
+        acquired = [frames + frames_per_point for frames in acquired]
+        yield from bps.wait_for(
+            [lambda acquired=acquired: _acquired(counters, acquired, timeout)]
+        )
+        yield from bps.wait(group=uncounted_group)
+
+        # The stage is read back where it was while the frames were taken
+        yield from bps.create()
+        for positioner in positioners:
+            yield from bps.read(positioner)
+        move_group = short_uid("move")
+        if index + 1 < indices.stop:
+            for motor in motors:
+                yield from bps.abs_set(
+                    motor, positions[motor][index + 1], group=move_group
+                )
+        yield from bps.wait(group=counted_group)
+        for detector in triggered:
+            yield from bps.read(detector)
+        yield from bps.save()
+        if progress is not None:
+            progress.complete(index + 1)
+        yield from bps.wait(group=move_group)
+
+
+def _array_counter(detector: Readable) -> SignalR[int] | None:
+    driver = getattr(detector, "driver", None)
+    if isinstance(detector, StandardDetector) and isinstance(driver, ADBaseIO):
+        return driver.array_counter
+    return None
+
+
+async def _acquired(
+    counters: Sequence[SignalR[int]], acquired: Sequence[int], timeout: float
+) -> None:
+    await asyncio.gather(
+        *(
+            wait_for_value(
+                counter, lambda value, frames=frames: value >= frames, timeout
+            )
+            for counter, frames in zip(counters, acquired, strict=True)
+        )
+    )
+
+
+def series_num_frames(
+    frame_rate: float, num_frames: int | None = None, duration: float | None = None
+) -> int:
+    """Frames in a time series, num_frames or enough to last duration seconds."""
+    if num_frames is not None and duration is not None:
+        raise ValueError("Give num_frames or duration, not both")
+    if duration is not None:
+        return max(1, math.ceil(duration * frame_rate))
+    return num_frames if num_frames is not None else 10
+
+
+@attach_data_session_metadata_decorator()
+def time_series(
+    detectors: Sequence[AravisDetector],
+    monitors: Sequence[Readable],
+    num_frames: int,
+    period: float,
+    exposure_time: float | None = None,
+    metadata: dict[str, Any] | None = None,
+    flush_period: float = 0.5,
+) -> MsgGenerator[None]:
+    """Take num_frames frames with every detector, one each period seconds.
+
+    The detectors are armed once for all of their frames, on their internal
+    trigger, and frames are collected into the primary stream as they are
+    written, so frame i of each detector is at index i. The monitors are read
+    into the positions stream before the detectors start and each time frames
+    are collected, the first frame being taken just after the first reading.
+    """
+    livetime = period - ARAVIS_DEADTIME if exposure_time is None else exposure_time
+    if livetime <= 0 or livetime + ARAVIS_DEADTIME > period:
+        raise ValueError(
+            f"Cannot take {livetime}s exposures every {period}s, "
+            f"the detector needs {ARAVIS_DEADTIME}s between them"
+        )
+    _md = {
+        "detectors": [detector.name for detector in detectors],
+        "monitors": [monitor.name for monitor in monitors],
+        "num_points": num_frames,
+        "period": period,
+        "plan_name": "time_series",
+        "shape": [num_frames],
+        "hints": {"dimensions": [(["time"], "primary")]},
+        **(metadata or {}),
+    }
+
+    @bpp.stage_decorator(detectors)
+    @bpp.run_decorator(md=_md)
+    def inner_time_series() -> MsgGenerator[None]:
+        # Prepare must happen after staging, which clears any previous TriggerInfo.
+        # It does not set the acquire period, which sets the rate on an internal
+        # trigger
+        group = short_uid("prepare")
+        for detector in detectors:
+            yield from bps.prepare(
+                detector,
+                TriggerInfo(
+                    number_of_events=num_frames,
+                    trigger=DetectorTrigger.INTERNAL,
+                    livetime=livetime,
+                    deadtime=period - livetime,
+                ),
+                group=group,
+            )
+            yield from bps.abs_set(detector.driver.acquire_period, period, group=group)
+        yield from bps.wait(group=group)
+
+        yield from bps.declare_stream(*detectors, name="primary", collect=True)
+        yield from bps.trigger_and_read(monitors, name="positions")
+        yield from bps.kickoff_all(*detectors, wait=True)
+        group = short_uid("complete")
+        yield from bps.complete_all(*detectors, group=group, wait=False)
+        done = False
+        while not done:
+            done = yield from bps.wait(
+                group=group, timeout=flush_period, error_on_timeout=False
+            )
+            yield from bps.collect(*detectors, name="primary")
+            yield from bps.trigger_and_read(monitors, name="positions")
+
+    yield from inner_time_series()
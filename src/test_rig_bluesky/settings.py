@@ -0,0 +1,286 @@
+import asyncio
+import copy
+import logging
+from collections.abc import Awaitable, Collection, Coroutine, Iterable, Mapping
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from typing import Any, NamedTuple, TypeVar
+
+import numpy as np
+from bluesky import plan_stubs as bps
+from bluesky.utils import MsgGenerator, short_uid
+from ophyd_async.core import (
+    Device,
+    SettingsProvider,
+    SignalDatatypeT,
+    SignalR,
+    SignalRW,
+    Table,
+    YamlSettingsProvider,
+    walk_rw_signals,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+SETTINGS_DIRECTORY = Path(__file__).parent
+
+
+@dataclass(frozen=True)
+class SettingsCacheInfo:
+    hits: int
+    misses: int
+    currsize: int
+
+
+@dataclass(frozen=True)
+class _CacheEntry:
+    stamp: tuple[int, int]
+    data: dict[str, Any]
+
+
+# Shared by every provider in the process so that back to back plans in the same
+# blueapi worker only parse each settings file once
+_cache: dict[Path, _CacheEntry] = {}
+_hits = 0
+_misses = 0
+
+
+class CachedSettingsProvider(SettingsProvider):
+    """Wraps a file based provider, only re-reading a file once it has changed.
+
+    Entries are keyed by file path and invalidated by modification time and size.
+    Each retrieve returns a copy, so callers cannot change the cached settings.
+    """
+
+    def __init__(
+        self, provider: SettingsProvider, directory: Path | str, suffix: str = ".yaml"
+    ):
+        self._provider = provider
+        self._directory = Path(directory)
+        self._suffix = suffix
+
+    def _file_path(self, name: str) -> Path:
+        return self._directory / (name + self._suffix)
+
+    async def store(self, name: str, data: dict[str, Any]):
+        _cache.pop(self._file_path(name), None)
+        await self._provider.store(name, data)
+
+    async def retrieve(self, name: str) -> dict[str, Any]:
+        path = self._file_path(name)
+        stamp = _stamp(path)
+        data = _cached(path, stamp)
+        if data is None:
+            data = _cache_entry(path, stamp, await self._provider.retrieve(name))
+        return copy.deepcopy(data)
+
+
+def read_settings(
+    design_name: str, directory: Path | str = SETTINGS_DIRECTORY
+) -> dict[str, Any]:
+    """Read saved settings through the shared cache, for use outside of plans.
+
+    The settings are retrieved as by the plans' provider, without an event loop,
+    so this can be called from anywhere, including from a coroutine or a plan
+    running in blueapi.
+    """
+    provider = CachedSettingsProvider(YamlSettingsProvider(directory), directory)
+    return _run_synchronously(provider.retrieve(design_name))
+
+
+def _run_synchronously(coroutine: Coroutine[Any, Any, T]) -> T:
+    # YamlSettingsProvider reads files without awaiting anything, so retrieving
+    # from it finishes the first time the coroutine is resumed
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("Settings could not be retrieved without an event loop")
+
+
+def _stamp(path: Path) -> tuple[int, int]:
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _cached(path: Path, stamp: tuple[int, int]) -> dict[str, Any] | None:
+    global _hits, _misses
+    entry = _cache.get(path)
+    if entry is not None and entry.stamp == stamp:
+        _hits += 1
+        return entry.data
+    _misses += 1
+    return None
+
+
+def _cache_entry(
+    path: Path, stamp: tuple[int, int], data: dict[str, Any]
+) -> dict[str, Any]:
+    _cache[path] = _CacheEntry(stamp, data)
+    return data
+
+
+def settings_cache_info() -> SettingsCacheInfo:
+    """Report hits and misses of the settings cache since it was last cleared."""
+    return SettingsCacheInfo(hits=_hits, misses=_misses, currsize=len(_cache))
+
+
+def clear_settings_cache() -> None:
+    """Drop all cached settings and reset the counters."""
+    global _hits, _misses
+    _cache.clear()
+    _hits = _misses = 0
+
+
+@dataclass(frozen=True)
+class SettingsReport:
+    """How many signals were read, left alone and written when applying settings."""
+
+    read: int
+    skipped: int
+    written: int
+
+
+@cache
+def _whitelist_index(whitelist_pvs: tuple[str, ...]) -> frozenset[str]:
+    # Whitelists use signal names relative to the device, e.g. "x-velocity", the
+    # settings files use dotted attribute paths, e.g. "x.velocity"
+    return frozenset(pv.replace("-", ".") for pv in whitelist_pvs)
+
+
+def _wait_for_awaitable(awaitable: Awaitable[T]) -> MsgGenerator[T]:
+    (task,) = yield from bps.wait_for([lambda: awaitable])
+    return task.result()
+
+
+def read_values(
+    signals: Collection[SignalR[SignalDatatypeT]],
+) -> MsgGenerator[list[SignalDatatypeT]]:
+    """Get the values of several signals concurrently, in a single round trip."""
+    return (yield from _wait_for_awaitable(_get_values(signals)))
+
+
+def retrieve_whitelisted_settings(
+    provider: SettingsProvider,
+    design_name: str,
+    device: Device,
+    whitelist_pvs: Collection[str] | None = None,
+) -> MsgGenerator[dict[SignalRW, Any]]:
+    """Retrieve the saved value of each whitelisted signal of a device.
+
+    If whitelist_pvs is None every saved signal is returned.
+    """
+    named_values = yield from _wait_for_awaitable(provider.retrieve(design_name))
+    return _whitelisted_signal_values(named_values, device, whitelist_pvs)
+
+
+class SettingsDesign(NamedTuple):
+    """A design to apply to a device, restricted to whitelist_pvs if given."""
+
+    device: Device
+    design_name: str
+    whitelist_pvs: Collection[str] | None = None
+
+
+def apply_settings_concurrently(
+    provider: SettingsProvider,
+    designs: Iterable[SettingsDesign | tuple[Device, str, Collection[str] | None]],
+    overrides: Mapping[SignalRW, Any] | None = None,
+) -> MsgGenerator[SettingsReport]:
+    """Apply designs to several devices, plus overrides, all at the same time.
+
+    The designs are retrieved together, then applied with `apply_settings_in_bulk`
+    in one read and one grouped write, so setting up the devices takes as long
+    as the slowest of them rather than the sum. Overrides take precedence over
+    the designs.
+    """
+    designs = [SettingsDesign(*design) for design in designs]
+    all_named_values = yield from _wait_for_awaitable(
+        asyncio.gather(*(provider.retrieve(design.design_name) for design in designs))
+    )
+    signal_values: dict[SignalRW, Any] = {}
+    for design, named_values in zip(designs, all_named_values, strict=True):
+        signal_values.update(
+            _whitelisted_signal_values(
+                named_values, design.device, design.whitelist_pvs
+            )
+        )
+    signal_values.update(overrides or {})
+    return (yield from apply_settings_in_bulk(signal_values))
+
+
+def apply_settings_in_bulk(
+    signal_values: Mapping[SignalRW, Any],
+) -> MsgGenerator[SettingsReport]:
+    """Set every signal that differs from its required value.
+
+    All signals are read together, then only the changed ones are written in a
+    single group, so the whole operation costs one round trip for the reads and
+    one for the writes. Values of None are ignored.
+    """
+    candidates = {
+        signal: value for signal, value in signal_values.items() if value is not None
+    }
+    current_values = yield from read_values(candidates)
+    changed = {
+        signal: value
+        for (signal, value), current in zip(
+            candidates.items(), current_values, strict=True
+        )
+        if _is_different(current, value)
+    }
+
+    group = short_uid("apply_settings")
+    for signal, value in changed.items():
+        yield from bps.abs_set(signal, value, group=group)
+    if changed:
+        yield from bps.wait(group=group)
+
+    report = SettingsReport(
+        read=len(candidates),
+        skipped=len(signal_values) - len(changed),
+        written=len(changed),
+    )
+    LOGGER.info(f"Applied settings: {report}")
+    return report
+
+
+def _whitelisted_signal_values(
+    named_values: Mapping[str, Any],
+    device: Device,
+    whitelist_pvs: Collection[str] | None,
+) -> dict[SignalRW, Any]:
+    if whitelist_pvs is not None:
+        index = _whitelist_index(tuple(whitelist_pvs))
+        named_values = {
+            name: value for name, value in named_values.items() if name in index
+        }
+    signals = walk_rw_signals(device)
+    unknown_names = named_values.keys() - signals.keys()
+    if unknown_names:
+        raise NameError(f"Unknown signal names {sorted(unknown_names)}")
+    return {signals[name]: value for name, value in named_values.items()}
+
+
+async def _get_values(
+    signals: Collection[SignalR[SignalDatatypeT]],
+) -> list[SignalDatatypeT]:
+    return await asyncio.gather(*(signal.get_value() for signal in signals))
+
+
+def _is_different(current: Any, required: Any) -> bool:
+    if isinstance(current, Table):
+        current = current.model_dump()
+        if isinstance(required, Table):
+            required = required.model_dump()
+        return current.keys() != required.keys() or any(
+            _is_different(current[k], required[k]) for k in current
+        )
+    elif isinstance(current, np.ndarray):
+        return not np.array_equal(current, required)
+    else:
+        return current != required
@@ -0,0 +1,405 @@
+import fcntl
+import hashlib
+import logging
+import struct
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Any, BinaryIO
+
+import numpy as np
+from ophyd_async.core import SettingsProvider, Table
+
+LOGGER = logging.getLogger(__name__)
+
+# File name of the history of every design saved by the plans
+SETTINGS_HISTORY = "settings_history.bin"
+
+# Each record is the magic and the length of its body, then the body: version,
+# time, design and device names, the number of signals, the hash of the list of
+# signal names then of each signal's value in the same order, and the hash,
+# offset and length of each value not already in the file, followed by those
+# values. The list of names is stored like any other value, so a version costs
+# 8 bytes per signal plus the values that changed.
+_MAGIC = b"TRS1"
+_RECORD = struct.Struct("<4sI")
+_VERSION = struct.Struct("<Id")
+_LOCATION = struct.Struct("<8sQI")
+_DIGEST_SIZE = 8
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+
+
+@dataclass(frozen=True)
+class _Entry:
+    digest: bytes
+    offset: int
+    length: int
+
+
+@dataclass(frozen=True)
+class SettingsVersion:
+    """A saved version of a design, without its values."""
+
+    design_name: str
+    version: int
+    device: str
+    timestamp: float
+    entries: Mapping[str, _Entry]
+
+
+@dataclass(frozen=True)
+class SettingsDiff:
+    """Signals only in the new settings, only in the old, and in both but changed.
+
+    changed maps each name to its (old, new) values.
+    """
+
+    added: dict[str, Any]
+    removed: dict[str, Any]
+    changed: dict[str, tuple[Any, Any]]
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+
+class SettingsStore(SettingsProvider):
+    """Append-only history of every version of every design saved to it.
+
+    Versions are indexed by design and device name as the file is scanned, only
+    reading the table of names and value hashes of each, so listing and diffing
+    versions only decodes the values that differ. The file is rescanned from
+    where it was last read whenever it has grown.
+    """
+
+    def __init__(self, path: Path | str):
+        self._path = Path(path)
+        self._scanned = 0
+        self._versions: dict[str, list[SettingsVersion]] = {}
+        self._locations: dict[bytes, tuple[int, int]] = {}
+        self._names: dict[bytes, list[str]] = {}
+
+    async def store(self, name: str, data: dict[str, Any]):
+        self.save(name, data)
+
+    async def retrieve(self, name: str) -> dict[str, Any]:
+        return self.load(name)
+
+    def at_version(self, version: int) -> SettingsProvider:
+        """A provider that retrieves this version of any design."""
+        return _PinnedVersion(self, version)
+
+    def save(self, design_name: str, data: Mapping[str, Any], device: str = "") -> int:
+        """Append a new version of a design, returning its number.
+
+        The file is locked while it is written, so several processes, e.g.
+        blueapi workers, can save to the same history.
+        """
+        names = sorted(data)
+        encoded = [_encode(names), *(_encode(data[name]) for name in names)]
+        digests = [_digest(value) for value in encoded]
+        with open(self._path, "ab") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            self._scan()
+            new_values = {
+                digest: value
+                for digest, value in zip(digests, encoded, strict=True)
+                if digest not in self._locations
+            }
+            previous = self._versions.get(design_name, [])
+            version = previous[-1].version + 1 if previous else 1
+
+            head = _VERSION.pack(version, time.time())
+            head += _pack_str(design_name) + _pack_str(device) + _U32.pack(len(names))
+            head += b"".join(digests) + _U32.pack(len(new_values))
+            start = self._scanned
+            # Drop what is left of a save that was interrupted, no other save
+            # can be writing while the file is locked
+            file.truncate(start)
+
+            locations = bytearray()
+            values = bytearray()
+            values_offset = (
+                start + _RECORD.size + len(head) + _LOCATION.size * len(new_values)
+            )
+            for digest, value in new_values.items():
+                locations += _LOCATION.pack(
+                    digest, values_offset + len(values), len(value)
+                )
+                values += value
+
+            body = head + locations + values
+            file.write(_RECORD.pack(_MAGIC, len(body)) + body)
+        LOGGER.info(
+            f"Saved version {version} of {design_name}, "
+            f"{len(values)} bytes of {len(new_values)} new values"
+        )
+        return version
+
+    def designs(self, device: str | None = None) -> list[str]:
+        """Names of the designs saved, optionally only those of one device."""
+        self._scan()
+        return sorted(
+            name
+            for name, versions in self._versions.items()
+            if device is None or any(v.device == device for v in versions)
+        )
+
+    def versions(self, design_name: str) -> list[SettingsVersion]:
+        self._scan()
+        return list(self._versions.get(design_name, []))
+
+    def load(self, design_name: str, version: int | None = None) -> dict[str, Any]:
+        """Values of a version of a design, by default the latest."""
+        entries = self._version(design_name, version).entries
+        with open(self._path, "rb") as file:
+            return {name: _read_value(file, entry) for name, entry in entries.items()}
+
+    def diff(
+        self, design_name: str, old: int | None = None, new: int | None = None
+    ) -> SettingsDiff:
+        """Compare two versions of a design, by default the last two."""
+        versions = self.versions(design_name)
+        if new is None:
+            new = versions[-1].version if versions else 0
+        if old is None:
+            old = new - 1
+        return self._diff(
+            self._version(design_name, old).entries,
+            self._version(design_name, new).entries,
+        )
+
+    def diff_values(
+        self,
+        design_name: str,
+        values: Mapping[str, Any],
+        version: int | None = None,
+    ) -> SettingsDiff:
+        """Compare a version of a design with values, e.g. read from the device."""
+        encoded = {name: _encode(value) for name, value in values.items()}
+        entries = {
+            name: _Entry(_digest(value), -1, len(value))
+            for name, value in encoded.items()
+        }
+        with_values = self._diff(self._version(design_name, version).entries, entries)
+        # The values were never written so take them from what was given
+        return SettingsDiff(
+            added={name: values[name] for name in with_values.added},
+            removed=with_values.removed,
+            changed={
+                name: (old, values[name])
+                for name, (old, _) in with_values.changed.items()
+            },
+        )
+
+    def _diff(
+        self, old: Mapping[str, _Entry], new: Mapping[str, _Entry]
+    ) -> SettingsDiff:
+        changed = [
+            name
+            for name in old.keys() & new.keys()
+            if old[name].digest != new[name].digest
+        ]
+        with open(self._path, "rb") as file:
+
+            def read(entry: _Entry) -> Any:
+                return None if entry.offset < 0 else _read_value(file, entry)
+
+            return SettingsDiff(
+                added={name: read(new[name]) for name in sorted(new.keys() - old)},
+                removed={name: read(old[name]) for name in sorted(old.keys() - new)},
+                changed={
+                    name: (read(old[name]), read(new[name])) for name in sorted(changed)
+                },
+            )
+
+    def _version(self, design_name: str, version: int | None) -> SettingsVersion:
+        versions = self.versions(design_name)
+        if not versions:
+            raise KeyError(f"No versions of {design_name} in {self._path}")
+        if version is None:
+            return versions[-1]
+        for saved in versions:
+            if saved.version == version:
+                return saved
+        raise KeyError(
+            f"No version {version} of {design_name}, "
+            f"choose one of {[saved.version for saved in versions]}"
+        )
+
+    def _entry(self, digest: bytes) -> _Entry:
+        return _Entry(digest, *self._locations[digest])
+
+    def _scan(self) -> None:
+        if not self._path.exists():
+            return
+        size = self._path.stat().st_size
+        with open(self._path, "rb") as file:
+            file.seek(self._scanned)
+            while self._scanned + _RECORD.size <= size:
+                magic, length = _RECORD.unpack(file.read(_RECORD.size))
+                if magic != _MAGIC:
+                    raise ValueError(f"{self._path} is corrupt at {self._scanned}")
+                end = self._scanned + _RECORD.size + length
+                if end > size:
+                    LOGGER.warning(f"Ignoring incomplete record at end of {self._path}")
+                    return
+                version, timestamp = _VERSION.unpack(file.read(_VERSION.size))
+                design_name = _read_str(file)
+                device = _read_str(file)
+                (count,) = _U32.unpack(file.read(_U32.size))
+                hashes = file.read(_DIGEST_SIZE * (count + 1))
+                (new_count,) = _U32.unpack(file.read(_U32.size))
+                for _ in range(new_count):
+                    digest, *location = _LOCATION.unpack(file.read(_LOCATION.size))
+                    self._locations.setdefault(digest, tuple(location))
+                digests = [
+                    hashes[i : i + _DIGEST_SIZE]
+                    for i in range(0, len(hashes), _DIGEST_SIZE)
+                ]
+                if digests[0] not in self._names:
+                    self._names[digests[0]] = _read_value(file, self._entry(digests[0]))
+                names = self._names[digests[0]]
+                entries = {
+                    name: self._entry(digest)
+                    for name, digest in zip(names, digests[1:], strict=True)
+                }
+                self._versions.setdefault(design_name, []).append(
+                    SettingsVersion(design_name, version, device, timestamp, entries)
+                )
+                # Skip the values, they are only read when needed
+                self._scanned = end
+                file.seek(end)
+
+
+class _PinnedVersion(SettingsProvider):
+    def __init__(self, store: SettingsStore, version: int):
+        self._store = store
+        self._version = version
+
+    async def store(self, name: str, data: dict[str, Any]):
+        raise TypeError(f"Cannot store over version {self._version} of {name}")
+
+    async def retrieve(self, name: str) -> dict[str, Any]:
+        return self._store.load(name, self._version)
+
+
+def _digest(encoded: bytes) -> bytes:
+    return hashlib.blake2b(encoded, digest_size=_DIGEST_SIZE).digest()
+
+
+def _pack_str(value: str) -> bytes:
+    encoded = value.encode()
+    return _U32.pack(len(encoded)) + encoded
+
+
+def _read_str(file: BinaryIO) -> str:
+    (length,) = _U32.unpack(file.read(_U32.size))
+    return file.read(length).decode()
+
+
+def _read_value(file: BinaryIO, entry: _Entry) -> Any:
+    file.seek(entry.offset)
+    value, _ = _decode(memoryview(file.read(entry.length)), 0)
+    return value
+
+
+def _encode(value: Any) -> bytes:
+    # Enums are saved by value and tables as dicts of columns, like in YAML
+    if isinstance(value, Enum):
+        value = value.value
+    if isinstance(value, Table):
+        value = value.model_dump()
+    if isinstance(value, np.generic):
+        value = value.item()
+
+    if value is None:
+        return b"N"
+    if isinstance(value, bool):
+        return b"?" + bytes([value])
+    if isinstance(value, int):
+        return b"i" + _I64.pack(value)
+    if isinstance(value, float):
+        return b"f" + _F64.pack(value)
+    if isinstance(value, str):
+        return b"s" + _pack_str(value)
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        array = np.ascontiguousarray(value)
+        shape = b"".join(_U32.pack(n) for n in array.shape)
+        return (
+            b"a" + _pack_str(array.dtype.str) + bytes([array.ndim]) + shape
+        ) + array.tobytes()
+    if isinstance(value, list | tuple | np.ndarray):
+        return b"l" + _U32.pack(len(value)) + b"".join(_sized(item) for item in value)
+    if isinstance(value, Mapping):
+        return (
+            b"d"
+            + _U32.pack(len(value))
+            + b"".join(_pack_str(str(k)) + _sized(v) for k, v in value.items())
+        )
+    raise TypeError(f"Cannot save {value!r} of type {type(value).__name__}")
+
+
+def _sized(value: Any) -> bytes:
+    encoded = _encode(value)
+    return _U32.pack(len(encoded)) + encoded
+
+
+def _decode(data: memoryview, offset: int) -> tuple[Any, int]:
+    tag = bytes(data[offset : offset + 1])
+    offset += 1
+    if tag == b"N":
+        return None, offset
+    if tag == b"?":
+        return bool(data[offset]), offset + 1
+    if tag == b"i":
+        return _I64.unpack_from(data, offset)[0], offset + _I64.size
+    if tag == b"f":
+        return _F64.unpack_from(data, offset)[0], offset + _F64.size
+    if tag == b"s":
+        return _unpack_str(data, offset)
+    if tag == b"a":
+        dtype, offset = _unpack_str(data, offset)
+        ndim = data[offset]
+        offset += 1
+        shape = tuple(
+            _U32.unpack_from(data, offset + _U32.size * i)[0] for i in range(ndim)
+        )
+        offset += _U32.size * ndim
+        array = np.frombuffer(
+            data, dtype=dtype, offset=offset, count=int(np.prod(shape))
+        )
+        return array.reshape(shape).copy(), offset + array.nbytes
+    if tag == b"l":
+        (count,) = _U32.unpack_from(data, offset)
+        offset += _U32.size
+        items = []
+        for _ in range(count):
+            item, offset = _unpack_sized(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == b"d":
+        (count,) = _U32.unpack_from(data, offset)
+        offset += _U32.size
+        mapping = {}
+        for _ in range(count):
+            key, offset = _unpack_str(data, offset)
+            mapping[key], offset = _unpack_sized(data, offset)
+        return mapping, offset
+    raise ValueError(f"Unknown value tag {tag!r}")
+
+
+def _unpack_str(data: memoryview, offset: int) -> tuple[str, int]:
+    (length,) = _U32.unpack_from(data, offset)
+    offset += _U32.size
+    return bytes(data[offset : offset + length]).decode(), offset + length
+
+
+def _unpack_sized(data: memoryview, offset: int) -> tuple[Any, int]:
+    (length,) = _U32.unpack_from(data, offset)
+    offset += _U32.size
+    value, _ = _decode(data, offset)
+    return value, offset + length
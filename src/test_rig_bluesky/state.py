@@ -0,0 +1,20 @@
+import os
+from pathlib import Path
+
+# Directory of the state the plans keep between runs, e.g. the settings history
+STATE_DIRECTORY_ENV = "TEST_RIG_BLUESKY_STATE_DIR"
+
+
+def state_directory() -> Path:
+    """Where the plans keep state that outlives the blueapi worker.
+
+    This is $TEST_RIG_BLUESKY_STATE_DIR, or test_rig_bluesky in the user's state
+    directory, $XDG_STATE_HOME or ~/.local/state. It is made if it is missing.
+    """
+    if STATE_DIRECTORY_ENV in os.environ:
+        directory = Path(os.environ[STATE_DIRECTORY_ENV])
+    else:
+        state_home = os.environ.get("XDG_STATE_HOME") or Path.home() / ".local/state"
+        directory = Path(state_home) / "test_rig_bluesky"
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
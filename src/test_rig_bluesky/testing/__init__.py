@@ -1 +1,48 @@
-from ._util import BlueskyPlanRunner as BlueskyPlanRunner
+import importlib
+from typing import TYPE_CHECKING, Any
+
+from ._message_log import ScanMessageLog as ScanMessageLog
+from ._scaling import ScalingResult as ScalingResult
+from ._scaling import find_regressions as find_regressions
+from ._scaling import measure_plan_scaling as measure_plan_scaling
+from ._scaling import save_scaling_results as save_scaling_results
+from ._sim import SimulatedAravis as SimulatedAravis
+from ._sim import SimulatedMotor as SimulatedMotor
+from ._sim import SimulatedSample as SimulatedSample
+from ._sim import simulated_imaging_detector as simulated_imaging_detector
+from ._sim import simulated_sample_stage as simulated_sample_stage
+from ._sim import simulated_spectroscopy_detector as simulated_spectroscopy_detector
+from ._verify import FileVerification as FileVerification
+from ._verify import NexusVerifier as NexusVerifier
+from ._verify import verify_nexus_file as verify_nexus_file
+
+if TYPE_CHECKING:
+    from ._async import AsyncBlueskyPlanRunner as AsyncBlueskyPlanRunner
+    from ._async import AsyncScanMessages as AsyncScanMessages
+    from ._benchmark import TaskTiming as TaskTiming
+    from ._benchmark import ThroughputReport as ThroughputReport
+    from ._benchmark import benchmark_throughput as benchmark_throughput
+    from ._benchmark import task_mix as task_mix
+    from ._scan_messages import ScanMessageRouter as ScanMessageRouter
+    from ._scan_messages import ScanMessages as ScanMessages
+    from ._util import BlueskyPlanRunner as BlueskyPlanRunner
+
+# These need blueapi, which is only installed for development, so they are
+# imported when first used rather than with the simulated devices
+_BLUEAPI_MODULES = {
+    "AsyncBlueskyPlanRunner": "._async",
+    "AsyncScanMessages": "._async",
+    "TaskTiming": "._benchmark",
+    "ThroughputReport": "._benchmark",
+    "benchmark_throughput": "._benchmark",
+    "task_mix": "._benchmark",
+    "ScanMessageRouter": "._scan_messages",
+    "ScanMessages": "._scan_messages",
+    "BlueskyPlanRunner": "._util",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name in _BLUEAPI_MODULES:
+        return getattr(importlib.import_module(_BLUEAPI_MODULES[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,194 @@
+import asyncio
+import contextlib
+import logging
+from collections.abc import AsyncIterator
+from typing import Any
+
+from blueapi.client.client import BlueapiClient
+from blueapi.service.model import TaskRequest, WorkerTask
+from blueapi.worker.event import WorkerState
+from bluesky_stomp.messaging import StompClient
+
+from ._message_log import ScanMessageLog
+from ._scan_messages import ScanMessageRouter, ScanMessages
+from ._verify import NexusVerifier
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AsyncScanMessages(ScanMessages):
+    """The scan messages of one run, to be awaited in an event loop.
+
+    Messages arrive on the STOMP client's thread and are handed to the loop the
+    messages were made in. The first message of each status is kept for
+    `wait_for`, and if stream is True every message is queued to be iterated
+    over with ``async for``, which ends after the FINISHED message.
+    """
+
+    def __init__(
+        self,
+        max_per_status: int | None = 1,
+        stream: bool = False,
+        log: ScanMessageLog | None = None,
+    ):
+        super().__init__(max_per_status=max_per_status, log=log)
+        self._loop = asyncio.get_running_loop()
+        self._first: dict[str, dict[str, Any]] = {}
+        self._waiters: dict[str, asyncio.Future[dict[str, Any]]] = {}
+        self._received: asyncio.Queue[dict[str, Any]] | None = (
+            asyncio.Queue() if stream else None
+        )
+
+    def add(self, message: dict[str, Any]) -> None:
+        super().add(message)
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._receive, message)
+
+    async def __aiter__(self) -> AsyncIterator[dict[str, Any]]:
+        if self._received is None:
+            raise RuntimeError("Messages are not being streamed, use stream=True")
+        while True:
+            message = await self._received.get()
+            yield message
+            if message["status"] == "FINISHED":
+                return
+
+    async def wait_for(
+        self, status: str, timeout: float | None = None
+    ) -> dict[str, Any]:
+        """Wait for the first message of status, which may have arrived already.
+
+        Raises TimeoutError if it does not arrive within timeout.
+        """
+        if status in self._first:
+            return self._first[status]
+        waiter = self._waiters.get(status)
+        if waiter is None:
+            waiter = self._waiters[status] = self._loop.create_future()
+        async with asyncio.timeout(timeout):
+            # Shielded so one waiter timing out does not cancel it for the others
+            return await asyncio.shield(waiter)
+
+    def _receive(self, message: dict[str, Any]) -> None:
+        status = message["status"]
+        if status not in self._first:
+            self._first[status] = message
+            waiter = self._waiters.pop(status, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(message)
+        if self._received is not None:
+            self._received.put_nowait(message)
+
+
+class AsyncBlueskyPlanRunner:
+    """Runs tasks in blueapi from an event loop, without blocking it.
+
+    Tasks may be run concurrently: each is created at once, but started when
+    the ones before it are complete, as blueapi runs one task at a time. Runners
+    for different instruments can share one event loop. A run that times out or
+    is cancelled aborts its task if it has started.
+    """
+
+    def __init__(
+        self,
+        client: BlueapiClient,
+        stomp_client: StompClient,
+        verifier: NexusVerifier | None = None,
+        poll_interval: float = 0.05,
+    ):
+        self.client = client
+        self.stomp_client = stomp_client
+        self.verifier = verifier
+        self.router = ScanMessageRouter(stomp_client)
+        self._poll_interval = poll_interval
+        self._worker = asyncio.Lock()
+
+    def close(self) -> None:
+        """Unsubscribe from scan messages."""
+        self.router.close()
+
+    async def run(
+        self,
+        task_request: TaskRequest,
+        timeout: float,
+        messages: AsyncScanMessages | None = None,
+    ) -> AsyncScanMessages:
+        """Run a task and wait for the NeXus file of its scan to be finished.
+
+        Pass messages made with stream=True to iterate over them while the task
+        runs, e.g. from another asyncio task.
+        """
+        if messages is None:
+            messages = AsyncScanMessages()
+        try:
+            async with asyncio.timeout(timeout):
+                task_id = await self._create_task(task_request)
+                try:
+                    await self._worker.acquire()
+                except asyncio.CancelledError:
+                    # Never started, so it would be left on the server
+                    await self._clear(task_id)
+                    raise
+                try:
+                    self.router.register(messages)
+                    await self._run_task(task_id)
+                finally:
+                    self._worker.release()
+                # The next task may start while this one's file is finished
+                finished = await messages.wait_for("FINISHED")
+        finally:
+            self.router.unregister(messages)
+
+        if self.verifier is not None:
+            self.verifier.submit_scan(finished)
+        return messages
+
+    async def _create_task(self, task_request: TaskRequest) -> str:
+        # A request that has been sent creates a task even if the run is
+        # cancelled, so wait for it and clear it
+        create = asyncio.ensure_future(
+            asyncio.to_thread(self.client.create_task, task_request)
+        )
+        try:
+            return (await asyncio.shield(create)).task_id
+        except asyncio.CancelledError:
+            with contextlib.suppress(Exception):
+                await self._clear((await create).task_id)
+            raise
+
+    async def _run_task(self, task_id: str) -> None:
+        # Likewise a start that has been sent runs the task, so wait for it and
+        # abort the task rather than leave it running
+        start = asyncio.ensure_future(
+            asyncio.to_thread(self.client.start_task, WorkerTask(task_id=task_id))
+        )
+        try:
+            await asyncio.shield(start)
+            while True:
+                task = await asyncio.to_thread(self.client.get_task, task_id)
+                if task.is_complete:
+                    state = await asyncio.to_thread(self.client.get_state)
+                    if state is WorkerState.IDLE:
+                        break
+                await asyncio.sleep(self._poll_interval)
+        except asyncio.CancelledError:
+            try:
+                await start
+            except Exception:
+                await self._clear(task_id)
+            else:
+                await self._abort(task_id)
+            raise
+        assert len(task.errors) == 0, task.errors
+
+    async def _clear(self, task_id: str) -> None:
+        try:
+            await asyncio.to_thread(self.client.clear_task, task_id)
+        except Exception as e:
+            LOGGER.warning(f"Could not clear unstarted task {task_id}: {e!r}")
+
+    async def _abort(self, task_id: str) -> None:
+        try:
+            await asyncio.to_thread(self.client.abort, "Run cancelled")
+        except Exception as e:
+            LOGGER.warning(f"Could not abort task {task_id}: {e!r}")
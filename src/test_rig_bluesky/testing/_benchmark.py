@@ -0,0 +1,195 @@
+import logging
+import statistics
+import time
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+from blueapi.service.model import TaskRequest, WorkerTask
+from blueapi.worker.event import WorkerState
+from scanspec.specs import Line
+
+from ._scan_messages import ScanMessages
+from ._util import BlueskyPlanRunner
+
+LOGGER = logging.getLogger(__name__)
+
+# Parameters of each plan in the default mix, sized like a visitor demo
+DEMO_TASK_PARAMS: dict[str, dict[str, Any]] = {
+    "snapshot": {},
+    "spectroscopy": {},
+    "demo_spectroscopy": {"exposure_time": 0.05, "grid_size": 2.5},
+    "count": {"detectors": ["imaging_detector", "spectroscopy_detector"], "num": 5},
+    "spec_scan": {
+        "detectors": ["imaging_detector", "spectroscopy_detector"],
+        "spec": (
+            Line("sample_stage.x", 0.0, 5.0, 2) * Line("sample_stage.y", 2.0, 5.0, 2)
+        ).serialize(),
+    },
+}
+
+
+def task_mix(
+    instrument_session: str,
+    repeats: int = 1,
+    params: Mapping[str, dict[str, Any]] = DEMO_TASK_PARAMS,
+) -> list[TaskRequest]:
+    """Make a list of task requests that runs each plan in turn, repeats times."""
+    return [
+        TaskRequest(
+            name=name, params=plan_params, instrument_session=instrument_session
+        )
+        for _ in range(repeats)
+        for name, plan_params in params.items()
+    ]
+
+
+@dataclass(frozen=True)
+class TaskTiming:
+    """How long one task took, in seconds.
+
+    Times to the first scan message and to the NeXus file being finished are
+    measured from when the task was started, and are None if never received.
+    """
+
+    name: str
+    submission_latency: float
+    run_time: float
+    time_to_first_event: float | None
+    time_to_finished: float | None
+
+
+@dataclass(frozen=True)
+class ThroughputReport:
+    timings: list[TaskTiming]
+    wall_time: float
+
+    @property
+    def tasks_per_hour(self) -> float:
+        return len(self.timings) / self.wall_time * 3600
+
+    def summary(self) -> dict[str, Any]:
+        """Median of each timing, per plan, plus the overall throughput."""
+        names = dict.fromkeys(timing.name for timing in self.timings)
+        return {
+            "tasks": len(self.timings),
+            "wall_time": self.wall_time,
+            "tasks_per_hour": self.tasks_per_hour,
+            "plans": {name: _median_timings(self._of(name)) for name in names},
+        }
+
+    def _of(self, name: str) -> list[TaskTiming]:
+        return [timing for timing in self.timings if timing.name == name]
+
+
+def _median_timings(timings: Sequence[TaskTiming]) -> dict[str, float | None]:
+    def median(values: list[float | None]) -> float | None:
+        received = [value for value in values if value is not None]
+        return statistics.median(received) if received else None
+
+    return {
+        "submission_latency": median([t.submission_latency for t in timings]),
+        "run_time": median([t.run_time for t in timings]),
+        "time_to_first_event": median([t.time_to_first_event for t in timings]),
+        "time_to_finished": median([t.time_to_finished for t in timings]),
+    }
+
+
+@dataclass(frozen=True)
+class _RanTask:
+    request: TaskRequest
+    submission_latency: float
+    started: float
+    completed: float
+    messages: ScanMessages
+
+    def timing(self) -> TaskTiming:
+        return TaskTiming(
+            name=self.request.name,
+            submission_latency=self.submission_latency,
+            run_time=self.completed - self.started,
+            time_to_first_event=self._since("STARTED"),
+            time_to_finished=self._since("FINISHED"),
+        )
+
+    def _since(self, status: str) -> float | None:
+        received = self.messages.first_received.get(status)
+        return None if received is None else received - self.started
+
+
+def benchmark_throughput(
+    runner: BlueskyPlanRunner,
+    task_requests: Sequence[TaskRequest],
+    timeout: float,
+    poll_interval: float = 0.05,
+) -> ThroughputReport:
+    """Run tasks back to back, as fast as the worker allows, and time them.
+
+    Each task is created while the one before it is running and started as soon
+    as the worker is idle, without waiting for its NeXus file to be finished.
+    All NeXus files must be finished within timeout of the last task completing.
+    """
+    client = runner.client
+    ran: list[_RanTask] = []
+
+    def create(task_request: TaskRequest) -> tuple[str, float]:
+        submitted = time.monotonic()
+        task_id = client.create_task(task_request).task_id
+        return task_id, time.monotonic() - submitted
+
+    begin = time.monotonic()
+    # The task created ahead of the one running, cleared if it is never started
+    next_task = create(task_requests[0]) if task_requests else None
+    registered: list[ScanMessages] = []
+    try:
+        for index, task_request in enumerate(task_requests):
+            assert next_task is not None
+            task_id, submission_latency = next_task
+            messages = ScanMessages()
+            runner.router.register(messages)
+            registered.append(messages)
+            started = time.monotonic()
+            client.start_task(WorkerTask(task_id=task_id))
+            next_task = None
+            if index + 1 < len(task_requests):
+                next_task = create(task_requests[index + 1])
+            _wait_until_complete(runner, task_id, started + timeout, poll_interval)
+            completed = time.monotonic()
+            ran.append(
+                _RanTask(task_request, submission_latency, started, completed, messages)
+            )
+            LOGGER.info(f"{task_request.name} ran in {completed - started:.2f}s")
+
+        deadline = time.monotonic() + timeout
+        for task in ran:
+            task.messages.finished.result(timeout=max(deadline - time.monotonic(), 0))
+        end = time.monotonic()
+    finally:
+        for messages in registered:
+            runner.router.unregister(messages)
+        if next_task is not None:
+            _clear_task(runner, next_task[0])
+
+    return ThroughputReport(
+        timings=[task.timing() for task in ran], wall_time=end - begin
+    )
+
+
+def _clear_task(runner: BlueskyPlanRunner, task_id: str) -> None:
+    try:
+        runner.client.clear_task(task_id)
+    except Exception as e:
+        LOGGER.warning(f"Could not clear task {task_id} that was not started: {e}")
+
+
+def _wait_until_complete(
+    runner: BlueskyPlanRunner, task_id: str, deadline: float, poll_interval: float
+) -> None:
+    while True:
+        task = runner.client.get_task(task_id)
+        if task.is_complete and runner.client.get_state() is WorkerState.IDLE:
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Task {task_id} did not complete in time")
+        time.sleep(poll_interval)
+    assert len(task.errors) == 0, task.errors
@@ -0,0 +1,131 @@
+import json
+import mmap
+import threading
+from collections import Counter
+from collections.abc import Generator
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+
+import numpy as np
+
+INDEX_SUFFIX = ".index"
+
+# One record per message, where it is in the log and what to find it by
+INDEX_DTYPE = np.dtype(
+    [("offset", "<u8"), ("length", "<u4"), ("status", "S12"), ("scan", "<i8")]
+)
+
+# Messages without a scan number are indexed as scan NO_SCAN
+NO_SCAN = -1
+
+
+class ScanMessageLog:
+    """Scan messages appended to a JSON lines file as they arrive.
+
+    Each message is indexed by status and scan number in a file next to the
+    log, so queries read the index and then only the messages they return, both
+    memory mapped. Nothing is kept in memory however long the scan, e.g. pass it
+    to `BlueskyPlanRunner.run` with ``max_per_status=0``. An existing log is
+    appended to.
+    """
+
+    def __init__(self, path: Path | str, scan_key: str = "scanNumber"):
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + INDEX_SUFFIX)
+        self._scan_key = scan_key
+        self._lock = threading.Lock()
+        self._log = self.path.open("ab")
+        self._index = self.index_path.open("ab")
+        # Drop a record torn by a crash, so every record is whole
+        self._index.truncate(len(self) * INDEX_DTYPE.itemsize)
+
+    def __len__(self) -> int:
+        return self.index_path.stat().st_size // INDEX_DTYPE.itemsize
+
+    def __enter__(self) -> "ScanMessageLog":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._log.close()
+            self._index.close()
+
+    def append(self, message: dict[str, Any]) -> None:
+        line = json.dumps(message).encode() + b"\n"
+        scan = message.get(self._scan_key)
+        record = np.array(
+            [
+                (
+                    0,
+                    len(line),
+                    message["status"].encode(),
+                    NO_SCAN if scan is None else scan,
+                )
+            ],
+            dtype=INDEX_DTYPE,
+        )
+        with self._lock:
+            record["offset"] = self._log.tell()
+            self._log.write(line)
+            self._log.flush()
+            # The index is written last, so it never points past the end of the log
+            self._index.write(record.tobytes())
+            self._index.flush()
+
+    def counts(self, scan: int | None = None) -> Counter[str]:
+        """Count the messages of each status, of one scan or all of them."""
+        records = self._records()
+        if scan is not None:
+            records = records[records["scan"] == scan]
+        statuses, counts = np.unique(records["status"], return_counts=True)
+        return Counter(
+            {
+                status.decode(): int(count)
+                for status, count in zip(statuses, counts, strict=True)
+            }
+        )
+
+    def find(
+        self, status: str | None = None, scan: int | None = None
+    ) -> Generator[dict[str, Any]]:
+        """Yield the messages of status and/or scan, in the order they arrived."""
+        records = self._records()
+        selected = np.ones(len(records), dtype=bool)
+        if status is not None:
+            selected &= records["status"] == status.encode()
+        if scan is not None:
+            selected &= records["scan"] == scan
+        locations = records[selected][["offset", "length"]]
+        if not len(locations):
+            return
+        with self.path.open("rb") as file:
+            log = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        with log:
+            for offset, length in locations.tolist():
+                yield json.loads(log[offset : offset + length])
+
+    def first(
+        self, status: str | None = None, scan: int | None = None
+    ) -> dict[str, Any] | None:
+        """The first message of status and/or scan, or None if there is none."""
+        messages = self.find(status, scan)
+        try:
+            return next(messages, None)
+        finally:
+            messages.close()
+
+    def _records(self) -> np.ndarray:
+        count = len(self)
+        if count == 0:
+            # An empty file cannot be memory mapped
+            return np.empty(0, dtype=INDEX_DTYPE)
+        return np.memmap(self.index_path, INDEX_DTYPE, mode="r", shape=(count,))
@@ -0,0 +1,143 @@
+import json
+import time
+import tracemalloc
+from collections import Counter
+from collections.abc import Callable, Mapping, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from bluesky import RunEngine
+from bluesky.utils import MsgGenerator
+
+from ..profiling import PlanProfiler
+
+# Metrics that are counts, which should not grow at all between runs
+COUNTED_METRICS = ("messages_per_point", "documents_per_point")
+
+
+@dataclass(frozen=True)
+class ScalingResult:
+    """What it cost to run a plan over a number of points, times in seconds.
+
+    plan_time is spent in the plan's own Python, generating messages, and
+    run_engine_time is everything else, i.e. the RunEngine processing them.
+    peak_memory is the most Python memory allocated during the run in bytes, or
+    None if it was not traced.
+    """
+
+    plan: str
+    points: int
+    total_time: float
+    plan_time: float
+    run_engine_time: float
+    messages: int
+    documents: dict[str, int]
+    peak_memory: int | None
+
+    def metrics(self) -> dict[str, float]:
+        """Per point metrics, to compare runs of different sizes or versions."""
+        metrics = {
+            "plan_time_per_point": self.plan_time / self.points,
+            "run_engine_time_per_point": self.run_engine_time / self.points,
+            "messages_per_point": self.messages / self.points,
+            "documents_per_point": sum(self.documents.values()) / self.points,
+        }
+        if self.peak_memory is not None:
+            metrics["peak_memory_per_point"] = self.peak_memory / self.points
+        return metrics
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "plan": self.plan,
+            "points": self.points,
+            "total_time": self.total_time,
+            "plan_time": self.plan_time,
+            "run_engine_time": self.run_engine_time,
+            "messages": self.messages,
+            "documents": self.documents,
+            "peak_memory": self.peak_memory,
+            "metrics": self.metrics(),
+        }
+
+
+def measure_plan_scaling(
+    run_engine: RunEngine,
+    plan: Callable[[], MsgGenerator],
+    points: int,
+    name: str = "plan",
+    trace_memory: bool = True,
+) -> ScalingResult:
+    """Run a plan of points points, timing it and counting what it emits.
+
+    Tracing memory slows Python down, so if trace_memory is True the plan is run
+    a second time to measure peak memory, and plan must make a new plan each
+    time it is called.
+    """
+    documents: Counter[str] = Counter()
+    token = run_engine.subscribe(lambda kind, doc: documents.update([kind]))
+    profiler = PlanProfiler(name)
+    start = time.perf_counter()
+    try:
+        run_engine(profiler.profile(plan()))
+    finally:
+        total_time = time.perf_counter() - start
+        run_engine.unsubscribe(token)
+    report = profiler.report()
+    plan_time = report.total - sum(stats.total for stats in report.messages.values())
+
+    peak_memory = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            run_engine(plan())
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return ScalingResult(
+        plan=name,
+        points=points,
+        total_time=total_time,
+        plan_time=plan_time,
+        run_engine_time=total_time - plan_time,
+        messages=sum(stats.count for stats in report.messages.values()),
+        documents=dict(documents),
+        peak_memory=peak_memory,
+    )
+
+
+def save_scaling_results(results: Sequence[ScalingResult], path: Path | str) -> None:
+    entries = [result.to_dict() for result in results]
+    Path(path).write_text(json.dumps(entries, indent=2))
+
+
+def find_regressions(
+    results: Sequence[ScalingResult],
+    baseline: Sequence[Mapping[str, Any]],
+    tolerance: float = 0.5,
+) -> list[str]:
+    """Compare results with a baseline saved by `save_scaling_results`.
+
+    Counts may not grow at all, times and memory per point may grow by up to
+    tolerance, as a fraction of the baseline. Results of a plan and size not in
+    the baseline are not compared.
+    """
+    previous = {
+        (entry["plan"], entry["points"]): entry["metrics"] for entry in baseline
+    }
+    regressions = []
+    for result in results:
+        before = previous.get((result.plan, result.points), {})
+        for metric, value in result.metrics().items():
+            if metric not in before:
+                continue
+            allowed = before[metric] * (
+                1 if metric in COUNTED_METRICS else 1 + tolerance
+            )
+            if value > allowed:
+                regressions.append(
+                    f"{result.plan} of {result.points} points: {metric} rose from "
+                    f"{before[metric]:.3g} to {value:.3g}"
+                )
+    return regressions
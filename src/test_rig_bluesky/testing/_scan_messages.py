@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import Counter, deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future
+from queue import Empty, SimpleQueue
+from types import TracebackType
+from typing import Any
+
+from bluesky_stomp.messaging import MessageContext, StompClient
+from bluesky_stomp.models import MessageTopic
+
+from ._message_log import ScanMessageLog
+
+SCAN_TOPIC = MessageTopic(name="gda.messages.scan")
+
+ScanKey = Callable[[dict[str, Any]], Any]
+
+
+def file_path_key(message: dict[str, Any]) -> Any:
+    """Identify the scan a message belongs to by the file it writes."""
+    return message.get("filePath")
+
+
+class ScanMessages:
+    """The scan messages of one run, as a stream and/or a bounded summary.
+
+    Only the last max_per_status messages of each status are kept, with a count
+    of all of them. If stream is True every message is also queued to be
+    iterated over, which ends after the FINISHED message. The time.monotonic()
+    time the first message of each status arrived is kept in first_received.
+    Every message is also appended to log, if given, to be queried later.
+    """
+
+    def __init__(
+        self,
+        max_per_status: int | None = 1,
+        stream: bool = False,
+        log: ScanMessageLog | None = None,
+    ):
+        self.counts: Counter[str] = Counter()
+        self.first_received: dict[str, float] = {}
+        self.finished: Future[dict[str, Any]] = Future()
+        self._max_per_status = max_per_status
+        self._log = log
+        self._messages: dict[str, deque[dict[str, Any]]] = {}
+        self._queue: SimpleQueue[dict[str, Any]] | None = (
+            SimpleQueue() if stream else None
+        )
+
+    def __getitem__(self, status: str) -> list[dict[str, Any]]:
+        return list(self._messages.get(status, ()))
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        return self.stream()
+
+    def stream(self, timeout: float | None = None) -> Iterator[dict[str, Any]]:
+        """Yield messages as they arrive, until the scan has finished.
+
+        Raises TimeoutError if no message arrives within timeout.
+        """
+        if self._queue is None:
+            raise RuntimeError("Messages are not being streamed, use stream=True")
+        while True:
+            try:
+                message = self._queue.get(timeout=timeout)
+            except Empty as e:
+                raise TimeoutError(f"No scan message in {timeout}s") from e
+            yield message
+            if message["status"] == "FINISHED":
+                return
+
+    def add(self, message: dict[str, Any]) -> None:
+        status = message["status"]
+        self.first_received.setdefault(status, time.monotonic())
+        self.counts[status] += 1
+        if status not in self._messages:
+            self._messages[status] = deque(maxlen=self._max_per_status)
+        self._messages[status].append(message)
+        if self._log is not None:
+            self._log.append(message)
+        if self._queue is not None:
+            self._queue.put(message)
+        if status == "FINISHED" and not self.finished.done():
+            self.finished.set_result(message)
+
+
+class ScanMessageRouter:
+    """A single subscription to scan messages, shared by every run.
+
+    Scans do not carry the id of the task that started them, so each new scan,
+    seen by its STARTED message, is given to the longest waiting consumer. All
+    later messages with the same key go to the same consumer until it closes.
+    Messages from scans nobody is waiting for are dropped.
+    """
+
+    def __init__(
+        self,
+        stomp_client: StompClient,
+        topic: MessageTopic = SCAN_TOPIC,
+        key: ScanKey = file_path_key,
+    ):
+        self._stomp_client = stomp_client
+        self._topic = topic
+        self._key = key
+        self._lock = threading.Lock()
+        self._waiting: deque[ScanMessages] = deque()
+        self._routes: dict[Any, ScanMessages] = {}
+        self._subscription: str | None = None
+
+    def open(self) -> None:
+        if self._subscription is None:
+            self._subscription = self._stomp_client.subscribe(
+                self._topic, self._on_message
+            )
+
+    def close(self) -> None:
+        if self._subscription is not None:
+            subscription, self._subscription = self._subscription, None
+            self._stomp_client.unsubscribe(subscription)
+        with self._lock:
+            self._waiting.clear()
+            self._routes.clear()
+
+    def __enter__(self) -> "ScanMessageRouter":
+        self.open()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def register(self, consumer: ScanMessages) -> None:
+        """Give the next new scan to consumer."""
+        self.open()
+        with self._lock:
+            self._waiting.append(consumer)
+
+    def unregister(self, consumer: ScanMessages) -> None:
+        """Stop routing messages to consumer, whether or not it got a scan."""
+        with self._lock:
+            if consumer in self._waiting:
+                self._waiting.remove(consumer)
+            for key in [k for k, v in self._routes.items() if v is consumer]:
+                del self._routes[key]
+
+    def _on_message(self, message: dict[str, Any], _: MessageContext) -> None:
+        key = self._key(message)
+        with self._lock:
+            consumer = self._routes.get(key)
+            if consumer is None and message["status"] == "STARTED" and self._waiting:
+                consumer = self._routes[key] = self._waiting.popleft()
+        if consumer is not None:
+            consumer.add(message)
@@ -0,0 +1,533 @@
+import asyncio
+import itertools
+import logging
+from collections.abc import Callable, Iterator, Mapping
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, TypeVar
+from xml.etree import ElementTree as ET
+
+import numpy as np
+import numpy.typing as npt
+from dodal.beamlines import b01_1
+from dodal.common.beamlines.beamline_utils import (
+    clear_path_provider,
+    get_path_provider,
+    set_path_provider,
+)
+from dodal.devices.motors import XYZStage
+from dodal.utils import DeviceInitializationController
+from ophyd_async.core import (
+    Device,
+    PathProvider,
+    SignalR,
+    callback_on_mock_put,
+    set_mock_value,
+)
+from ophyd_async.epics.adaravis import AravisDetector
+from ophyd_async.epics.adcore import (
+    ADBaseDataType,
+    ADImageMode,
+    NDPluginBaseIO,
+    NDROIStatIO,
+)
+from ophyd_async.epics.motor import Motor
+
+from ..trajectory import AxisKinematics
+
+LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T", bound=Device)
+
+# Renders the frame seen with the stage at (x, y)
+Renderer = Callable[[float, float], npt.NDArray[np.uint8]]
+
+SPECTROSCOPY_SENSOR_SHAPE = (1216, 1936)
+IMAGING_SENSOR_SHAPE = (1024, 1280)
+
+# Where the diffraction grating spreads red, green and blue light across the
+# spectroscopy sensor, as fractions of its width, to fall in the ROIs of
+# spectroscopy_detector_baseline.yaml
+_BAND_CENTRES = (0.088, 0.493, 0.899)
+
+_NDATTRIBUTE_DTYPES = {
+    "INT": np.int32,
+    "DOUBLE": np.float64,
+    "DBR_SHORT": np.int16,
+    "DBR_LONG": np.int32,
+    "DBR_FLOAT": np.float32,
+    "DBR_DOUBLE": np.float64,
+}
+
+
+class SimulatedSample:
+    """Coloured spots on a clear slide, with transmission sampled on a grid.
+
+    The grid covers +/- extent in x and y, with pixels_per_unit points per unit
+    of stage travel. Each point has a transmission of red, green and blue light.
+    """
+
+    def __init__(
+        self,
+        extent: float = 15.0,
+        pixels_per_unit: int = 20,
+        num_spots: int = 20,
+        seed: int = 0,
+    ):
+        self.extent = extent
+        self.pixels_per_unit = pixels_per_unit
+        size = int(2 * extent * pixels_per_unit) + 1
+        coords = np.linspace(-extent, extent, size)
+        ys, xs = np.meshgrid(coords, coords, indexing="ij")
+        self.transmission_map = np.ones((size, size, 3), dtype=np.float32)
+        rng = np.random.default_rng(seed)
+        for _ in range(num_spots):
+            cx, cy = rng.uniform(-extent, extent, 2)
+            radius = rng.uniform(0.5, 3.0)
+            inside = (xs - cx) ** 2 + (ys - cy) ** 2 < radius**2
+            self.transmission_map[inside] *= rng.uniform(0.1, 1.0, 3)
+
+    def index(self, position: float) -> int:
+        """Index into the grid nearest to a stage position."""
+        index = round((position + self.extent) * self.pixels_per_unit)
+        return int(np.clip(index, 0, len(self.transmission_map) - 1))
+
+    def transmission(self, x: float, y: float) -> npt.NDArray[np.float32]:
+        return self.transmission_map[self.index(y), self.index(x)]
+
+    def spectrum_renderer(
+        self, shape: tuple[int, int] = SPECTROSCOPY_SENSOR_SHAPE, seed: int = 0
+    ) -> Renderer:
+        """Render light passed by the sample, split into colours by a grating.
+
+        Red, green and blue fall left to right across a horizontal stripe, with
+        a little noise on top.
+        """
+        height, width = shape
+        columns = np.arange(width, dtype=np.float32)
+        bands = np.array(
+            [
+                np.exp(-(((columns - centre * width) / (width / 24)) ** 2) / 2)
+                for centre in _BAND_CENTRES
+            ]
+        )
+        rows = np.arange(height, dtype=np.float32)
+        stripe = 240 * np.exp(-(((rows - 0.56 * height) / (height / 10)) ** 2) / 2)
+        noise = np.random.default_rng(seed).integers(
+            0, 8, size=(4, height, width), dtype=np.uint8
+        )
+        frame_numbers = itertools.count()
+
+        def render(x: float, y: float) -> npt.NDArray[np.uint8]:
+            profile = self.transmission(x, y) @ bands
+            frame = np.outer(stripe, profile).astype(np.uint8)
+            frame += noise[next(frame_numbers) % len(noise)]
+            return frame
+
+        return render
+
+    def image_renderer(
+        self, shape: tuple[int, int] = IMAGING_SENSOR_SHAPE, field_of_view: float = 4.0
+    ) -> Renderer:
+        """Render the sample around the stage position, field_of_view units wide."""
+        height, width = shape
+        grey = (200 * self.transmission_map.mean(axis=2)).astype(np.uint8)
+        scale = field_of_view / width * self.pixels_per_unit
+        row_offsets = np.round((np.arange(height) - height / 2) * scale).astype(int)
+        column_offsets = np.round((np.arange(width) - width / 2) * scale).astype(int)
+
+        def render(x: float, y: float) -> npt.NDArray[np.uint8]:
+            rows = np.clip(self.index(y) + row_offsets, 0, len(grey) - 1)
+            columns = np.clip(self.index(x) + column_offsets, 0, len(grey) - 1)
+            return grey[np.ix_(rows, columns)]
+
+        return render
+
+
+class SimulatedMotor:
+    """Moves a mock motor to its setpoint at its velocity and acceleration_time.
+
+    The readback follows the trapezoidal velocity profile of the move, updated
+    every update_period, and the motor is done moving when it arrives. A new
+    setpoint or a stop interrupts the move.
+    """
+
+    def __init__(
+        self,
+        motor: Motor,
+        velocity: float = 1.0,
+        acceleration_time: float = 0.1,
+        max_velocity: float = 10.0,
+        limits: tuple[float, float] = (-14.5, 14.5),
+        update_period: float = 0.02,
+    ):
+        self.motor = motor
+        self.update_period = update_period
+        self._moves = 0
+        set_mock_value(motor.velocity, velocity)
+        set_mock_value(motor.max_velocity, max_velocity)
+        set_mock_value(motor.acceleration_time, acceleration_time)
+        set_mock_value(motor.low_limit_travel, limits[0])
+        set_mock_value(motor.high_limit_travel, limits[1])
+        set_mock_value(motor.motor_done_move, 1)
+        callback_on_mock_put(motor.user_setpoint, self._move)
+        callback_on_mock_put(motor.motor_stop, self._stop)
+
+    async def _move(self, setpoint: float, wait: bool) -> None:
+        self._moves += 1
+        move = self._moves
+        start, velocity, acceleration_time = await asyncio.gather(
+            self.motor.user_readback.get_value(),
+            self.motor.velocity.get_value(),
+            self.motor.acceleration_time.get_value(),
+        )
+        kinematics = AxisKinematics(velocity, acceleration_time)
+        distance = setpoint - start
+        duration = float(kinematics.move_time(distance))
+        set_mock_value(self.motor.motor_done_move, 0)
+        loop = asyncio.get_running_loop()
+        began = loop.time()
+        while (elapsed := loop.time() - began) < duration:
+            if self._moves != move:
+                return
+            moved = kinematics.distance_moved(distance, elapsed)
+            set_mock_value(self.motor.user_readback, start + moved)
+            await asyncio.sleep(min(self.update_period, duration - elapsed))
+        if self._moves == move:
+            set_mock_value(self.motor.user_readback, setpoint)
+            set_mock_value(self.motor.motor_done_move, 1)
+
+    def _stop(self, value: int, wait: bool) -> None:
+        self._moves += 1
+        set_mock_value(self.motor.motor_done_move, 1)
+
+
+class _HDF5Capture:
+    """A SWMR HDF5 file laid out like those of the areaDetector HDF5 plugin."""
+
+    def __init__(
+        self,
+        path: Path,
+        frame_shape: tuple[int, ...],
+        dtype: np.dtype,
+        attributes: Mapping[str, type[np.generic]],
+    ):
+        import h5py
+
+        self.file = h5py.File(path, "w", libver="latest")
+        self.data = self.file.create_dataset(
+            "/entry/data/data",
+            shape=(0, *frame_shape),
+            maxshape=(None, *frame_shape),
+            chunks=(1, *frame_shape),
+            dtype=dtype,
+        )
+        self.attributes = {
+            name: self.file.create_dataset(
+                f"/entry/instrument/NDAttributes/{name}",
+                shape=(0,),
+                maxshape=(None,),
+                chunks=(16384,),
+                dtype=attribute_dtype,
+            )
+            for name, attribute_dtype in attributes.items()
+        }
+        self.file.swmr_mode = True
+        self.num_frames = 0
+
+    def write(self, frame: npt.NDArray, attribute_values: Mapping[str, float]) -> None:
+        num_frames = self.num_frames + 1
+        self.data.resize(num_frames, axis=0)
+        self.data[-1] = frame
+        for name, dataset in self.attributes.items():
+            dataset.resize(num_frames, axis=0)
+            dataset[-1] = attribute_values.get(name, 0)
+        self.file.flush()
+        self.num_frames = num_frames
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class SimulatedAravis:
+    """Acquires frames rendered for the stage position, like an ADAravis IOC.
+
+    On acquire, frames are produced at frame_rate, or if None at the rate set by
+    acquire_time and acquire_period. The total of each ROI in use is updated for
+    every frame and, while the HDF5 plugin is capturing, each frame and its
+    NDAttributes are written to a SWMR HDF5 file, off the event loop.
+    """
+
+    def __init__(
+        self,
+        detector: AravisDetector,
+        render: Renderer,
+        sample_stage: XYZStage | None = None,
+        frame_rate: float | None = None,
+    ):
+        self.detector = detector
+        self.render = render
+        self.sample_stage = sample_stage
+        self.frame_rate = frame_rate
+        self._plugins = [
+            child
+            for _, child in detector.children()
+            if isinstance(child, NDPluginBaseIO) and child is not detector.fileio
+        ]
+        self._acquisition: asyncio.Task | None = None
+        self._capture: _HDF5Capture | None = None
+        self._capture_lock = asyncio.Lock()
+        self._attribute_sources: dict[str, SignalR[float]] = {}
+
+        frame = render(0.0, 0.0)
+        self.frame_shape = frame.shape
+        self.dtype = frame.dtype
+        set_mock_value(detector.driver.array_size_y, frame.shape[0])
+        set_mock_value(detector.driver.array_size_x, frame.shape[1])
+        set_mock_value(detector.driver.data_type, ADBaseDataType.UINT8)
+        set_mock_value(detector.fileio.file_path_exists, True)
+        callback_on_mock_put(detector.driver.acquire, self._on_acquire)
+        callback_on_mock_put(detector.fileio.capture, self._on_capture)
+
+    def _on_acquire(self, acquire: bool, wait: bool) -> None:
+        if acquire and (self._acquisition is None or self._acquisition.done()):
+            self._acquisition = asyncio.create_task(self._acquire())
+        elif not acquire and self._acquisition is not None:
+            self._acquisition.cancel()
+
+    async def _on_capture(self, capture: bool, wait: bool) -> None:
+        async with self._capture_lock:
+            if self._capture is not None:
+                self._capture.close()
+                self._capture = None
+            if capture:
+                self._capture = await self._open_capture()
+
+    async def _acquire(self) -> None:
+        driver = self.detector.driver
+        (
+            num_images,
+            image_mode,
+            acquire_time,
+            acquire_period,
+            counter,
+        ) = await asyncio.gather(
+            driver.num_images.get_value(),
+            driver.image_mode.get_value(),
+            driver.acquire_time.get_value(),
+            driver.acquire_period.get_value(),
+            driver.array_counter.get_value(),
+        )
+        if image_mode is ADImageMode.SINGLE:
+            num_images = 1
+        if self.frame_rate:
+            period = 1 / self.frame_rate
+        else:
+            period = max(acquire_time, acquire_period)
+        rois = await self._roi_slices()
+        loop = asyncio.get_running_loop()
+        next_frame = loop.time()
+        try:
+            for acquired in itertools.count():
+                if image_mode is not ADImageMode.CONTINUOUS and acquired >= num_images:
+                    break
+                next_frame += period
+                await asyncio.sleep(next_frame - loop.time())
+                x, y = await self._position()
+                frame = await asyncio.to_thread(self.render, x, y)
+                totals = {
+                    total: float(frame[region].sum()) for total, region in rois.items()
+                }
+                for total, value in totals.items():
+                    set_mock_value(total, value)
+                counter += 1
+                set_mock_value(driver.array_counter, counter)
+                await self._write(frame, totals)
+        except Exception:
+            LOGGER.exception(f"Simulated acquisition of {self.detector.name} failed")
+            raise
+        finally:
+            set_mock_value(driver.acquire, False)
+
+    async def _position(self) -> tuple[float, float]:
+        if self.sample_stage is None:
+            return 0.0, 0.0
+        x, y = await asyncio.gather(
+            self.sample_stage.x.user_readback.get_value(),
+            self.sample_stage.y.user_readback.get_value(),
+        )
+        return x, y
+
+    async def _roi_slices(self) -> dict[SignalR[float], tuple[slice, slice]]:
+        rois = {}
+        for plugin in self._plugins:
+            if not isinstance(plugin, NDROIStatIO):
+                continue
+            for channel in plugin.channels.values():
+                use, min_x, min_y, size_x, size_y = await asyncio.gather(
+                    channel.use.get_value(),
+                    channel.min_x.get_value(),
+                    channel.min_y.get_value(),
+                    channel.size_x.get_value(),
+                    channel.size_y.get_value(),
+                )
+                if use:
+                    rois[channel.total] = (
+                        slice(min_y, min_y + size_y),
+                        slice(min_x, min_x + size_x),
+                    )
+        return rois
+
+    async def _write(
+        self, frame: npt.NDArray, totals: Mapping[SignalR[float], float]
+    ) -> None:
+        async with self._capture_lock:
+            if self._capture is None:
+                return
+            attribute_values = {
+                name: totals.get(source, 0.0)
+                for name, source in self._attribute_sources.items()
+            }
+            await asyncio.to_thread(self._capture.write, frame, attribute_values)
+            set_mock_value(self.detector.fileio.num_captured, self._capture.num_frames)
+
+    async def _open_capture(self) -> _HDF5Capture:
+        fileio = self.detector.fileio
+        file_path, file_name, file_template, file_number = await asyncio.gather(
+            fileio.file_path.get_value(),
+            fileio.file_name.get_value(),
+            fileio.file_template.get_value(),
+            fileio.file_number.get_value(),
+        )
+        arguments = (file_path, file_name, file_number)
+        full_file_name = file_template % arguments[: file_template.count("%")]
+
+        attributes: dict[str, type[np.generic]] = {}
+        self._attribute_sources.clear()
+        for plugin in self._plugins:
+            xml = await plugin.nd_attributes_file.get_value()
+            if "<Attributes>" not in xml:
+                continue
+            for attribute in ET.fromstring(xml):
+                name = attribute.attrib["name"]
+                datatype = attribute.attrib.get(
+                    "datatype", attribute.attrib.get("dbrtype", "DOUBLE")
+                )
+                attributes[name] = _NDATTRIBUTE_DTYPES.get(datatype, np.float64)
+                source = _attribute_source(plugin, attribute.attrib)
+                if source is None:
+                    LOGGER.warning(f"Cannot simulate NDAttribute {name}, writing 0")
+                else:
+                    self._attribute_sources[name] = source
+
+        capture = await asyncio.to_thread(
+            _HDF5Capture,
+            Path(full_file_name),
+            self.frame_shape,
+            self.dtype,
+            attributes,
+        )
+        set_mock_value(fileio.full_file_name, full_file_name)
+        set_mock_value(fileio.num_captured, 0)
+        return capture
+
+
+def _attribute_source(
+    plugin: NDPluginBaseIO, attrib: Mapping[str, Any]
+) -> SignalR[float] | None:
+    if (
+        isinstance(plugin, NDROIStatIO)
+        and attrib.get("type") == "PARAM"
+        and attrib.get("source") == "ROISTAT_TOTAL"
+    ):
+        return plugin.channels[int(attrib.get("addr", 0)) + 1].total
+    return None
+
+
+def _mock_device(
+    factory: DeviceInitializationController[T],
+    name: str,
+    path_provider: PathProvider | None = None,
+) -> T:
+    # A new device from the b01_1 factory each time, so simulated devices are
+    # never shared, and never left cached for others to be given
+    factory.cache_clear()
+    try:
+        with _beamline_path_provider(path_provider):
+            return factory(connect_immediately=True, mock=True, name=name)
+    finally:
+        factory.cache_clear()
+
+
+@contextmanager
+def _beamline_path_provider(path_provider: PathProvider | None) -> Iterator[None]:
+    # The b01_1 factories take the beamline's path provider, so swap it in while
+    # the device is made
+    if path_provider is None:
+        yield
+        return
+    try:
+        previous: PathProvider | None = get_path_provider()
+    except NameError:
+        previous = None
+    set_path_provider(path_provider)
+    try:
+        yield
+    finally:
+        if previous is None:
+            clear_path_provider()
+        else:
+            set_path_provider(previous)
+
+
+def simulated_sample_stage(
+    velocity: float = 1.0,
+    acceleration_time: float = 0.1,
+    name: str = "sample_stage",
+) -> XYZStage:
+    """A sample_stage whose motors move like real ones, without an IOC.
+
+    Create the RunEngine first, the stage is connected in its event loop.
+    """
+    stage = _mock_device(b01_1.sample_stage, name)
+    for motor in (stage.x, stage.y, stage.z):
+        SimulatedMotor(motor, velocity, acceleration_time)
+    return stage
+
+
+def simulated_spectroscopy_detector(
+    sample_stage: XYZStage | None = None,
+    sample: SimulatedSample | None = None,
+    frame_rate: float | None = None,
+    path_provider: PathProvider | None = None,
+    name: str = "spectroscopy_detector",
+) -> AravisDetector:
+    """A spectroscopy_detector that sees the spectrum of the sample under the stage.
+
+    Frames are written to real HDF5 files from path_provider, by default the one
+    set for the beamline. Create the RunEngine first, the detector is connected
+    in its event loop.
+    """
+    detector = _mock_device(b01_1.spectroscopy_detector, name, path_provider)
+    sample = sample or SimulatedSample()
+    SimulatedAravis(detector, sample.spectrum_renderer(), sample_stage, frame_rate)
+    return detector
+
+
+def simulated_imaging_detector(
+    sample_stage: XYZStage | None = None,
+    sample: SimulatedSample | None = None,
+    frame_rate: float | None = None,
+    path_provider: PathProvider | None = None,
+    name: str = "imaging_detector",
+) -> AravisDetector:
+    """An imaging_detector that sees the sample around the stage position.
+
+    Frames are written to real HDF5 files from path_provider, by default the one
+    set for the beamline. Create the RunEngine first, the detector is connected
+    in its event loop.
+    """
+    detector = _mock_device(b01_1.imaging_detector, name, path_provider)
+    sample = sample or SimulatedSample()
+    SimulatedAravis(detector, sample.image_renderer(), sample_stage, frame_rate)
+    return detector
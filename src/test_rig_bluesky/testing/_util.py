@@ -1,54 +1,63 @@
-from collections import defaultdict
-from concurrent.futures import Future
-from typing import Any
-
 from blueapi.client.client import BlueapiClient
 from blueapi.service.model import TaskRequest
-from bluesky_stomp.messaging import MessageContext, StompClient
-from bluesky_stomp.models import MessageTopic
+from bluesky_stomp.messaging import StompClient
+
+from ._message_log import ScanMessageLog
+from ._scan_messages import ScanMessageRouter, ScanMessages
+from ._verify import NexusVerifier
 
 
 class BlueskyPlanRunner:
-    def __init__(self, client: BlueapiClient, stomp_client: StompClient):
+    def __init__(
+        self,
+        client: BlueapiClient,
+        stomp_client: StompClient,
+        verifier: NexusVerifier | None = None,
+    ):
         self.client = client
         self.stomp_client = stomp_client
+        self.verifier = verifier
+        self.router = ScanMessageRouter(stomp_client)
 
-    def run(
-        self, task_request: TaskRequest, timeout: float
-    ) -> dict[str, list[dict[str, Any]]]:
-        # Listen for NeXus file events, see below
-        nexus_finished_message = Future()
-
-        def on_nexus_message(message: dict[str, Any], _: MessageContext) -> None:
-            if message["status"] == "FINISHED":
-                nexus_finished_message.set_result(message)
-
-        self.stomp_client.subscribe(
-            MessageTopic(name="gda.messages.scan"), on_nexus_message
-        )
-
-        # Collect all events for the caller
-        events = defaultdict(list)
+    def close(self) -> None:
+        """Unsubscribe from scan messages."""
+        self.router.close()
 
-        def collect(message: dict[str, Any], _: MessageContext):
-            events[message["status"]].append(message)
-
-        self.stomp_client.subscribe(MessageTopic(name="gda.messages.scan"), collect)
-
-        # Run plan
-        end_event = self.client.run_task(task_request, timeout=timeout)
-        assert end_event.task_status is not None
-        task_id = end_event.task_status.task_id
-
-        # Check task ran and did not error
-        task = self.client.get_task(task_id)
-        assert task.is_complete
-        assert len(task.errors) == 0
-
-        # Search for a new NeXus file event, with numtracker
-        # we will be able to programmatically correlate the
-        # file with the plan, see
-        # https://jira.diamond.ac.uk/browse/DCS-194
-        nexus_finished_message.result(timeout=timeout)
-
-        return events
+    def run(
+        self,
+        task_request: TaskRequest,
+        timeout: float,
+        max_per_status: int | None = 1,
+        log: ScanMessageLog | None = None,
+    ) -> ScanMessages:
+        """Run a task and wait for the NeXus file of its scan to be finished.
+
+        Returns the scan's messages, keeping the last max_per_status of each
+        status, e.g. ``run(...)["FINISHED"][0]``. To keep every message of a long
+        scan without holding them in memory, record them to a log. If the runner
+        has a verifier, the NeXus file is then verified in the background.
+        """
+        messages = ScanMessages(max_per_status=max_per_status, log=log)
+        self.router.register(messages)
+        try:
+            # Run plan
+            end_event = self.client.run_task(task_request, timeout=timeout)
+            assert end_event.task_status is not None
+            task_id = end_event.task_status.task_id
+
+            # Check task ran and did not error
+            task = self.client.get_task(task_id)
+            assert task.is_complete
+            assert len(task.errors) == 0
+
+            # Wait for the NeXus file of the scan to be finished. Until numtracker
+            # can correlate the file with the plan, the scan is assumed to be the
+            # first one started after the task was submitted, see
+            # https://jira.diamond.ac.uk/browse/DCS-194
+            finished = messages.finished.result(timeout=timeout)
+        finally:
+            self.router.unregister(messages)
+
+        if self.verifier is not None:
+            self.verifier.submit_scan(finished)
+        return messages
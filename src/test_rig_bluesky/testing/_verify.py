@@ -0,0 +1,206 @@
+import hashlib
+import logging
+import math
+from collections.abc import Iterator, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+
+import numpy as np
+
+LOGGER = logging.getLogger(__name__)
+
+# Bytes read at a time from a dataset that cannot be memory mapped
+BLOCK_BYTES = 16 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class DatasetCheck:
+    """A dataset of one value per scan point, e.g. frames or ROI totals.
+
+    checksum is of its values in C order, however they are stored, and
+    nan_values counts values never written, for floating point datasets.
+    """
+
+    name: str
+    shape: tuple[int, ...]
+    checksum: str
+    nan_values: int
+
+
+@dataclass(frozen=True)
+class FileVerification:
+    path: Path
+    scan_dimensions: tuple[int, ...]
+    datasets: list[DatasetCheck]
+    problems: list[str]
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+
+def verify_nexus_file(
+    path: Path | str, scan_dimensions: Sequence[int]
+) -> FileVerification:
+    """Check a finished NeXus file has every point of its scan.
+
+    The datasets of NXdata and NDAttributes groups, following links into the
+    detectors' HDF5 files, must start with the scan's dimensions, or with the
+    number of points if not reshaped, and floating point ones must have no NaN
+    gaps. Contiguous datasets are memory mapped, others read a block at a time.
+    """
+    import h5py
+
+    path = Path(path)
+    expected = tuple(scan_dimensions)
+    datasets = []
+    problems = []
+    with h5py.File(path, "r") as file:
+        for dataset in _scan_datasets(file):
+            check = _check_dataset(dataset)
+            datasets.append(check)
+            if not _has_scan_shape(check.shape, expected):
+                problems.append(
+                    f"{check.name} has shape {check.shape}, "
+                    f"expected a scan of {expected}"
+                )
+            if check.nan_values:
+                problems.append(f"{check.name} has {check.nan_values} NaN values")
+    if not datasets:
+        problems.append(f"{path} has no scan datasets")
+    return FileVerification(path, expected, datasets, problems)
+
+
+class NexusVerifier:
+    """Verifies NeXus files in a worker pool, so the next task need not wait.
+
+    Submit each file as its FINISHED message arrives and collect the problems
+    when the tasks are done. Relative paths are found in directory.
+    """
+
+    def __init__(self, directory: Path | str | None = None, max_workers: int = 2):
+        self.directory = Path(directory) if directory is not None else None
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="verify")
+        self._verifications: list[Future[FileVerification]] = []
+
+    def __enter__(self) -> "NexusVerifier":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def submit(
+        self, path: Path | str, scan_dimensions: Sequence[int]
+    ) -> Future[FileVerification]:
+        if self.directory is not None:
+            path = self.directory / path
+        verification = self._pool.submit(verify_nexus_file, path, scan_dimensions)
+        self._verifications.append(verification)
+        return verification
+
+    def submit_scan(self, finished: dict[str, Any]) -> Future[FileVerification]:
+        """Verify the file of a scan, given its FINISHED scan message."""
+        return self.submit(finished["filePath"], finished["scanDimensions"])
+
+    def problems(self, timeout: float | None = None) -> list[str]:
+        """Wait for every file submitted to be verified, returning any problems.
+
+        A file that could not be read at all is a problem too.
+        """
+        done, not_done = wait(self._verifications, timeout=timeout)
+        problems = [f"Verification did not finish in {timeout}s"] if not_done else []
+        for verification in done:
+            try:
+                result = verification.result()
+            except Exception as e:
+                problems.append(f"Could not verify a file: {e!r}")
+            else:
+                problems.extend(f"{result.path}: {p}" for p in result.problems)
+        return problems
+
+
+def _scan_datasets(file: Any) -> Iterator[Any]:
+    import h5py
+
+    # Links are followed, so the same object may be reached more than once
+    seen: set[tuple[str, str | None]] = set()
+
+    def visit(group: h5py.Group, in_scan_group: bool) -> Iterator[h5py.Dataset]:
+        for key in group:
+            item = group.get(key)
+            if not isinstance(item, h5py.Group | h5py.Dataset):
+                LOGGER.warning(f"{group.name}/{key} is a broken link")
+                continue
+            identity = (item.file.filename, item.name)
+            if identity in seen:
+                continue
+            seen.add(identity)
+            if isinstance(item, h5py.Group):
+                yield from visit(item, _is_scan_group(item))
+            elif in_scan_group and item.ndim:
+                yield item
+
+    yield from visit(file, False)
+
+
+def _is_scan_group(group: Any) -> bool:
+    nx_class = group.attrs.get("NX_class", b"")
+    if isinstance(nx_class, bytes):
+        nx_class = nx_class.decode()
+    return nx_class == "NXdata" or group.name.endswith("/NDAttributes")
+
+
+def _has_scan_shape(shape: tuple[int, ...], expected: tuple[int, ...]) -> bool:
+    return shape[: len(expected)] == expected or shape[:1] == (math.prod(expected),)
+
+
+def _check_dataset(dataset: Any) -> DatasetCheck:
+    checksum = hashlib.blake2b(digest_size=16)
+    nan_values = 0
+    for block in _blocks(dataset):
+        checksum.update(np.ascontiguousarray(block).tobytes())
+        if block.dtype.kind == "f":
+            nan_values += int(np.count_nonzero(np.isnan(block)))
+    return DatasetCheck(
+        name=dataset.name,
+        shape=dataset.shape,
+        checksum=checksum.hexdigest(),
+        nan_values=nan_values,
+    )
+
+
+def _blocks(dataset: Any) -> Iterator[np.ndarray]:
+    """Read a dataset a block of its first dimension at a time."""
+    offset = dataset.id.get_offset()
+    # An empty dataset has nothing to map, even if space was allocated for it
+    if (
+        dataset.size
+        and offset is not None
+        and dataset.chunks is None
+        and not dataset.external
+        and dataset.dtype.kind in "biufc"
+    ):
+        values = np.memmap(
+            dataset.file.filename,
+            dtype=dataset.dtype,
+            mode="r",
+            offset=offset,
+            shape=dataset.shape,
+        )
+    else:
+        values = dataset
+    row_bytes = max(dataset.dtype.itemsize * math.prod(dataset.shape[1:]), 1)
+    rows = max(BLOCK_BYTES // row_bytes, 1)
+    for start in range(0, dataset.shape[0], rows):
+        yield np.asarray(values[start : start + rows])
@@ -0,0 +1,223 @@
+import math
+import re
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Any, Generic
+
+import numpy as np
+import numpy.typing as npt
+from scanspec.core import Axis, SnakedDimension
+from scanspec.specs import Line, Product, Snake, Spec
+
+# Beyond this many points nearest_neighbour_order takes seconds, and the stage
+# time it could save is small next to the time to scan them
+MAX_REORDERED_POINTS = 5000
+
+
+@dataclass(frozen=True)
+class AxisKinematics:
+    """Trapezoidal velocity profile of a motor record axis.
+
+    acceleration_time is the time taken to reach velocity from rest, as in the
+    ACCL field of the motor record.
+    """
+
+    velocity: float
+    acceleration_time: float
+
+    def move_time(self, distance: npt.ArrayLike) -> npt.NDArray[np.float64]:
+        """Time to move each distance, starting and finishing at rest."""
+        distance = np.abs(np.asarray(distance, dtype=np.float64))
+        ramp_distance = self.velocity * self.acceleration_time
+        cruising = distance / self.velocity + self.acceleration_time
+        ramping = 2 * np.sqrt(distance * self.acceleration_time / self.velocity)
+        return np.where(distance >= ramp_distance, cruising, ramping)
+
+    def distance_moved(self, distance: float, time: float) -> float:
+        """How far a move of distance has gone after time, signed like distance."""
+        total = abs(distance)
+        if time >= float(self.move_time(total)):
+            return distance
+        if self.acceleration_time <= 0:
+            return math.copysign(self.velocity * time, distance)
+        acceleration = self.velocity / self.acceleration_time
+        # Time spent accelerating, shorter than acceleration_time for short moves
+        ramp = min(self.acceleration_time, math.sqrt(total / acceleration))
+        peak_velocity = acceleration * ramp
+        end = float(self.move_time(total))
+        if time < ramp:
+            moved = acceleration * time**2 / 2
+        elif time < end - ramp:
+            moved = acceleration * ramp**2 / 2 + peak_velocity * (time - ramp)
+        else:
+            moved = total - acceleration * (end - time) ** 2 / 2
+        return math.copysign(moved, distance)
+
+
+def kinematics_from_settings(
+    named_values: Mapping[str, Any],
+) -> dict[str, AxisKinematics]:
+    """Make the kinematics of each axis of a stage from its saved settings.
+
+    E.g. ``x.velocity`` and ``x.acceleration_time`` from sample_stage_baseline.
+    """
+    axes = {
+        name.rpartition(".")[0]
+        for name in named_values
+        if name.endswith((".velocity", ".acceleration_time"))
+    }
+    return {
+        axis: AxisKinematics(
+            velocity=float(named_values[f"{axis}.velocity"]),
+            acceleration_time=float(named_values[f"{axis}.acceleration_time"]),
+        )
+        for axis in sorted(axes)
+        if f"{axis}.velocity" in named_values
+        and f"{axis}.acceleration_time" in named_values
+    }
+
+
+def axis_key(axis: Any) -> str:
+    """Get the short name of a spec axis, e.g. "x" for sample_stage.x.
+
+    Works for devices, whose names look like "sample_stage-x", and for the
+    strings used in serialized specs, like "sample_stage.x".
+    """
+    name = axis if isinstance(axis, str) else axis.name
+    return re.split(r"[.-]", name)[-1]
+
+
+def travel_time(
+    positions: Mapping[Axis, npt.NDArray[np.float64]],
+    kinematics: Mapping[str, AxisKinematics],
+) -> float:
+    """Total time spent moving between consecutive positions.
+
+    Axes move simultaneously so each move takes as long as its slowest axis.
+    Axes without known kinematics are assumed to move instantly.
+    """
+    move_times = [
+        kinematics[axis_key(axis)].move_time(np.diff(points))
+        for axis, points in positions.items()
+        if axis_key(axis) in kinematics
+    ]
+    if not move_times:
+        return 0.0
+    return float(np.max(move_times, axis=0).sum())
+
+
+def demo_grid(
+    x_axis: Axis,
+    y_axis: Axis,
+    total_number_of_scan_points: int,
+    grid_size: float,
+    grid_origin_x: float,
+    grid_origin_y: float,
+) -> Spec[Axis]:
+    """Make the square grid scanned by demo_spectroscopy."""
+    xsteps = ysteps = int(round(math.sqrt(max(total_number_of_scan_points, 1))))
+    xmin = grid_origin_x
+    xmax = grid_origin_x + grid_size
+    ymin = grid_origin_y
+    ymax = grid_origin_y + grid_size
+    return Line(y_axis, ymin, ymax, ysteps) * Line(x_axis, xmin, xmax, xsteps)
+
+
+def snake(spec: Spec[Axis]) -> Spec[Axis]:
+    """Snake every inner dimension of a grid, so no row has a fly back."""
+    if isinstance(spec, Product) and isinstance(spec.inner, Spec):
+        outer = snake(spec.outer) if isinstance(spec.outer, Spec) else spec.outer
+        inner = spec.inner if isinstance(spec.inner, Snake) else Snake(spec.inner)
+        return Product(outer, inner, gap=spec.gap)
+    return spec
+
+
+def snaking(spec: Spec[Axis]) -> list[bool]:
+    """Whether each dimension of a spec is snaked, for bluesky's start documents."""
+    return [isinstance(dimension, SnakedDimension) for dimension in spec.calculate()]
+
+
+def nearest_neighbour_order(
+    positions: Mapping[Axis, npt.NDArray[np.float64]],
+    kinematics: Mapping[str, AxisKinematics],
+) -> npt.NDArray[np.intp]:
+    """Order points by always moving next to the one that is quickest to reach.
+
+    Starts from the first point. Each step compares the move times to every
+    point left, so the time taken grows with the square of the number of points,
+    and more than MAX_REORDERED_POINTS are left in their original order.
+    """
+    axes = [axis for axis in positions if axis_key(axis) in kinematics]
+    num_points = len(next(iter(positions.values())))
+    if not axes or num_points > MAX_REORDERED_POINTS:
+        return np.arange(num_points, dtype=np.intp)
+    order = np.empty(num_points, dtype=np.intp)
+    # The points not yet visited, with their positions, are kept at the front of
+    # these arrays so each step only looks at those
+    remaining = np.arange(num_points, dtype=np.intp)
+    points = np.array([positions[axis] for axis in axes], dtype=np.float64)
+    axis_kinematics = [kinematics[axis_key(axis)] for axis in axes]
+    current = 0
+    for i in range(num_points):
+        left = num_points - i
+        order[i] = remaining[current]
+        here = points[:, current].copy()
+        # Swap the visited point out past the end of those left
+        last = left - 1
+        remaining[[current, last]] = remaining[[last, current]]
+        points[:, [current, last]] = points[:, [last, current]]
+        if last == 0:
+            break
+        times = np.max(
+            [
+                axis.move_time(points[index, :last] - here[index])
+                for index, axis in enumerate(axis_kinematics)
+            ],
+            axis=0,
+        )
+        current = int(np.argmin(times))
+    return order
+
+
+@dataclass(frozen=True)
+class OptimisedTrajectory(Generic[Axis]):
+    """The result of optimising the order of a spec's points.
+
+    Grids stay as a spec, snaked, other point sets are reordered and given as
+    positions. If nothing could be improved spec is the original spec.
+    """
+
+    original_travel_time: float
+    travel_time: float
+    spec: Spec[Axis] | None = None
+    positions: dict[Axis, npt.NDArray[np.float64]] | None = None
+
+    @property
+    def time_saved(self) -> float:
+        return self.original_travel_time - self.travel_time
+
+
+def optimise_trajectory(
+    spec: Spec[Axis], kinematics: Mapping[str, AxisKinematics]
+) -> OptimisedTrajectory[Axis]:
+    """Reduce the time the stage spends travelling between the points of a spec.
+
+    Grids are snaked. Any other spec has its points reordered by
+    `nearest_neighbour_order`.
+    """
+    positions = spec.frames().midpoints
+    original_time = travel_time(positions, kinematics)
+    if isinstance(spec, Product):
+        snaked = snake(spec)
+        snaked_time = travel_time(snaked.frames().midpoints, kinematics)
+        if snaked_time < original_time:
+            return OptimisedTrajectory(original_time, snaked_time, spec=snaked)
+    else:
+        order = nearest_neighbour_order(positions, kinematics)
+        reordered = {axis: points[order] for axis, points in positions.items()}
+        reordered_time = travel_time(reordered, kinematics)
+        if reordered_time < original_time:
+            return OptimisedTrajectory(
+                original_time, reordered_time, positions=reordered
+            )
+    return OptimisedTrajectory(original_time, original_time, spec=spec)
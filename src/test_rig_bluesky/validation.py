@@ -0,0 +1,171 @@
+import asyncio
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from bluesky import plan_stubs as bps
+from bluesky.protocols import Movable
+from bluesky.utils import MsgGenerator
+from ophyd_async.epics.motor import Motor
+from scanspec.specs import Spec
+
+from .scans import ARAVIS_DEADTIME, FlyRow, fly_rows
+
+
+@dataclass(frozen=True)
+class AxisLimits:
+    """Soft limits and maximum speed of a motor record axis.
+
+    As in the motor record, limits are not enforced if both dial limits are 0.
+    """
+
+    low: float
+    high: float
+    max_velocity: float
+    acceleration_time: float
+    enforced: bool = True
+
+
+async def read_axis_limits(motor: Motor) -> AxisLimits:
+    (
+        low,
+        high,
+        dial_low,
+        dial_high,
+        max_velocity,
+        acceleration_time,
+    ) = await asyncio.gather(
+        motor.low_limit_travel.get_value(),
+        motor.high_limit_travel.get_value(),
+        motor.dial_low_limit_travel.get_value(),
+        motor.dial_high_limit_travel.get_value(),
+        motor.max_velocity.get_value(),
+        motor.acceleration_time.get_value(),
+    )
+    return AxisLimits(
+        low=low,
+        high=high,
+        max_velocity=max_velocity,
+        acceleration_time=acceleration_time,
+        enforced=not (dial_low == 0 and dial_high == 0),
+    )
+
+
+def position_problems(
+    positions: Mapping[Any, npt.NDArray[np.float64]],
+    limits: Mapping[Any, AxisLimits],
+) -> list[str]:
+    """Find the axes with positions outside their limits.
+
+    Axes without limits are not checked.
+    """
+    problems = []
+    for axis, values in positions.items():
+        axis_limits = limits.get(axis)
+        if axis_limits is None or not axis_limits.enforced or not len(values):
+            continue
+        outside = np.count_nonzero(
+            (values < axis_limits.low) | (values > axis_limits.high)
+        )
+        if outside:
+            problems.append(
+                f"{_name(axis)} goes from {values.min():g} to {values.max():g}, "
+                f"{outside} of {len(values)} positions are outside its limits "
+                f"{axis_limits.low:g} to {axis_limits.high:g}"
+            )
+    return problems
+
+
+def fly_problems(
+    rows: Sequence[FlyRow], exposure_time: float, limits: Mapping[Any, AxisLimits]
+) -> list[str]:
+    """Find the motors too slow to fly their rows, or that run up past a limit.
+
+    The checks are those done by `Motor.prepare`, for every row at once.
+    """
+    period = exposure_time + ARAVIS_DEADTIME
+    problems = []
+    for motor in dict.fromkeys(row.motor for row in rows):
+        axis_limits = limits.get(motor)
+        if axis_limits is None:
+            continue
+        start, stop, num_frames = np.array(
+            [
+                (row.start, row.stop, row.num_frames)
+                for row in rows
+                if row.motor is motor
+            ]
+        ).T
+        velocity = (stop - start) / (num_frames * period)
+        fastest = np.abs(velocity).max()
+        if fastest > axis_limits.max_velocity:
+            problems.append(
+                f"{_name(motor)} must fly at {fastest:g}/s, faster than its "
+                f"maximum velocity {axis_limits.max_velocity:g}/s"
+            )
+        run_up = axis_limits.acceleration_time * velocity / 2
+        problems.extend(
+            position_problems(
+                {motor: np.concatenate([start - run_up, stop + run_up])},
+                {motor: axis_limits},
+            )
+        )
+    return problems
+
+
+def spec_problems(
+    spec: Spec[Any],
+    limits: Mapping[Any, AxisLimits],
+    fly_exposure_time: float | None = None,
+) -> list[str]:
+    """Check every point of spec, as it will be scanned, against limits.
+
+    If fly_exposure_time is given and the spec can be flown, the velocity and
+    run up of each row are checked too.
+    """
+    midpoints = spec.frames().midpoints
+    problems = position_problems(dict(midpoints.items()), limits)
+    if fly_exposure_time is not None:
+        rows = fly_rows(spec)
+        if rows is not None:
+            problems.extend(fly_problems(rows, fly_exposure_time, limits))
+    return problems
+
+
+def validate_spec(
+    spec: Spec[Movable], fly_exposure_time: float | None = None
+) -> MsgGenerator[None]:
+    """Check spec is within the limits of its motors before anything moves.
+
+    :raises ValueError: Describing every axis that is out of its limits.
+    """
+    motors = [axis for axis in spec.axes() if isinstance(axis, Motor)]
+    limits = yield from _read_limits(motors)
+    problems = spec_problems(spec, limits, fly_exposure_time)
+    if problems:
+        raise ValueError(f"Cannot scan {spec}: " + "; ".join(problems))
+
+
+def validate_fly(rows: Sequence[FlyRow], exposure_time: float) -> MsgGenerator[None]:
+    """Check the motors can fly rows, once it is known that they will be flown.
+
+    :raises ValueError: Describing every motor too slow or that runs up too far.
+    """
+    motors = list(dict.fromkeys(row.motor for row in rows))
+    limits = yield from _read_limits(motors)
+    problems = fly_problems(rows, exposure_time, limits)
+    if problems:
+        raise ValueError("Cannot fly: " + "; ".join(problems))
+
+
+def _read_limits(motors: Sequence[Motor]) -> MsgGenerator[dict[Motor, AxisLimits]]:
+    (task,) = yield from bps.wait_for(
+        [lambda: asyncio.gather(*(read_axis_limits(motor) for motor in motors))]
+    )
+    return dict(zip(motors, task.result(), strict=True))
+
+
+def _name(axis: Any) -> str:
+    return getattr(axis, "name", str(axis))
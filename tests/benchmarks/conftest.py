@@ -0,0 +1,43 @@
+import json
+import logging
+import os
+from collections.abc import Generator
+from pathlib import Path
+
+import pytest
+
+from test_rig_bluesky.testing import (
+    ScalingResult,
+    find_regressions,
+    save_scaling_results,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+@pytest.fixture(scope="session")
+def scaling_results() -> Generator[list[ScalingResult]]:
+    """Results of the session, saved to SCALING_RESULTS if it is set."""
+    results: list[ScalingResult] = []
+    yield results
+    if "SCALING_RESULTS" in os.environ:
+        save_scaling_results(results, os.environ["SCALING_RESULTS"])
+
+
+@pytest.fixture
+def record_scaling(scaling_results: list[ScalingResult]):
+    """Record a result, failing if it regressed from SCALING_BASELINE."""
+    baseline = (
+        json.loads(Path(os.environ["SCALING_BASELINE"]).read_text())
+        if "SCALING_BASELINE" in os.environ
+        else []
+    )
+    tolerance = float(os.environ.get("SCALING_TOLERANCE", 0.5))
+
+    def record(result: ScalingResult) -> None:
+        scaling_results.append(result)
+        LOGGER.info(f"Scaling: {json.dumps(result.to_dict(), indent=2)}")
+        regressions = find_regressions([result], baseline, tolerance)
+        assert not regressions, "\n".join(regressions)
+
+    return record
@@ -0,0 +1,76 @@
+import math
+import os
+from collections.abc import Callable
+
+import pytest
+from bluesky import RunEngine
+from dodal.devices.motors import XYZStage
+from ophyd_async.epics.adaravis import AravisDetector
+from scanspec.specs import Line
+
+from test_rig_bluesky.plans import demo_spectroscopy, spectroscopy
+from test_rig_bluesky.testing import ScalingResult, measure_plan_scaling
+from test_rig_bluesky.trajectory import demo_grid
+
+# Grids are measured up to SCALING_MAX_POINTS points
+GRID_POINTS = [25, 100, 1_000, 10_000, 100_000]
+MAX_POINTS = int(os.environ.get("SCALING_MAX_POINTS", 100))
+# Tracing memory runs each plan again, several times slower
+TRACE_MEMORY = os.environ.get("SCALING_TRACE_MEMORY", "1") == "1"
+
+POINTS = [
+    pytest.param(
+        points,
+        marks=pytest.mark.skipif(
+            points > MAX_POINTS, reason=f"SCALING_MAX_POINTS is {MAX_POINTS}"
+        ),
+    )
+    for points in GRID_POINTS
+]
+
+
+@pytest.mark.parametrize("points", POINTS)
+def test_spectroscopy_scaling(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+    record_scaling: Callable[[ScalingResult], None],
+    points: int,
+):
+    rows = round(math.sqrt(points))
+    columns = math.ceil(points / rows)
+    spec = Line(sample_stage.y, 0, 5, rows) * Line(sample_stage.x, 0, 5, columns)
+
+    result = measure_plan_scaling(
+        run_engine,
+        lambda: spectroscopy(spectroscopy_detector, sample_stage, spec),
+        points=rows * columns,
+        name="spectroscopy",
+        trace_memory=TRACE_MEMORY,
+    )
+
+    record_scaling(result)
+
+
+@pytest.mark.parametrize("points", POINTS)
+def test_demo_spectroscopy_scaling(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+    record_scaling: Callable[[ScalingResult], None],
+    points: int,
+):
+    # The demo grid is the square nearest to the number of points asked for
+    grid = demo_grid(sample_stage.x, sample_stage.y, points, 5.0, 0.0, 0.0)
+
+    result = measure_plan_scaling(
+        run_engine,
+        lambda: demo_spectroscopy(
+            spectroscopy_detector, sample_stage, total_number_of_scan_points=points
+        ),
+        points=math.prod(grid.shape()),
+        name="demo_spectroscopy",
+        trace_memory=TRACE_MEMORY,
+    )
+
+    record_scaling(result)
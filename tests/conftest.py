@@ -1,9 +1,20 @@
+import asyncio
 from pathlib import Path
 
+import dodal.beamlines.b01_1 as b01_1
 import pytest
 from bluesky import RunEngine
 from dodal.common.beamlines.beamline_utils import set_path_provider
-from ophyd_async.core import StaticPathProvider, UUIDFilenameProvider
+from dodal.devices.motors import XYZStage
+from ophyd_async.core import (
+    StaticPathProvider,
+    UUIDFilenameProvider,
+    callback_on_mock_put,
+    set_mock_value,
+)
+from ophyd_async.epics.adaravis import AravisDetector
+
+from test_rig_bluesky.state import STATE_DIRECTORY_ENV
 
 
 @pytest.fixture(scope="function")
@@ -18,3 +29,69 @@ def run_engine():
 def path_provider() -> None:
     provider = StaticPathProvider(UUIDFilenameProvider(), Path("/tmp"))
     set_path_provider(provider)
+
+
+@pytest.fixture(autouse=True)
+def state_directory(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Keep the state of the plans, e.g. the settings history, out of home."""
+    directory = tmp_path / "state"
+    monkeypatch.setenv(STATE_DIRECTORY_ENV, str(directory))
+    return directory
+
+
+@pytest.fixture
+def imaging_detector() -> AravisDetector:
+    det = b01_1.imaging_detector(connect_immediately=True, mock=True)
+    _mock_detector_behavior(det)
+    return det
+
+
+@pytest.fixture
+def spectroscopy_detector() -> AravisDetector:
+    det = b01_1.spectroscopy_detector(connect_immediately=True, mock=True)
+    _mock_detector_behavior(det)
+    return det
+
+
+@pytest.fixture
+def sample_stage() -> XYZStage:
+    stage = b01_1.sample_stage(connect_immediately=True, mock=True)
+
+    set_mock_value(stage.x.low_limit_travel, -10.0)
+    set_mock_value(stage.x.high_limit_travel, 10.0)
+    set_mock_value(stage.y.low_limit_travel, -10.0)
+    set_mock_value(stage.y.high_limit_travel, 10.0)
+
+    set_mock_value(stage.x.velocity, 1.0)
+    set_mock_value(stage.y.velocity, 1.0)
+    set_mock_value(stage.x.max_velocity, 10.0)
+    set_mock_value(stage.y.max_velocity, 10.0)
+
+    return stage
+
+
+def _mock_detector_behavior(detector: AravisDetector) -> None:
+    async def mock_acquisition() -> None:
+        # Get number of images to capture per acquire
+        num_images = await detector.driver.num_images.get_value()
+        set_mock_value(detector.fileio.num_capture, num_images)
+
+        # Increment from current num captured to new value
+        current_num_captured = await detector.fileio.num_captured.get_value()
+        counter = await detector.driver.array_counter.get_value()
+        set_mock_value(detector.driver.array_counter, counter + num_images)
+        for i in range(current_num_captured, current_num_captured + num_images + 1):
+            set_mock_value(detector.fileio.num_captured, i)
+
+    async def on_acquire(acquire: bool, wait: bool) -> None:
+        if acquire:
+            asyncio.create_task(mock_acquisition())
+
+    def on_capture(capture: bool, wait: bool) -> None:
+        # Like the IOC, each file starts with no frames captured
+        if capture:
+            set_mock_value(detector.fileio.num_captured, 0)
+
+    set_mock_value(detector.fileio.file_path_exists, True)
+    callback_on_mock_put(detector.driver.acquire, on_acquire)
+    callback_on_mock_put(detector.fileio.capture, on_capture)
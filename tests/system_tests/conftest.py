@@ -1,7 +1,7 @@
 import os
 import socket
 import textwrap
-from collections.abc import Generator
+from collections.abc import AsyncGenerator, Generator
 from pathlib import Path
 
 import pytest
@@ -10,7 +10,11 @@ from blueapi.config import ApplicationConfig, ConfigLoader
 from bluesky_stomp.messaging import StompClient
 from bluesky_stomp.models import Broker
 
-from test_rig_bluesky.testing import BlueskyPlanRunner
+from test_rig_bluesky.testing import (
+    AsyncBlueskyPlanRunner,
+    BlueskyPlanRunner,
+    NexusVerifier,
+)
 
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 
@@ -44,18 +48,18 @@ def on_controllable_machine() -> bool:
     return hostname in BEAMLINE_HOSTS
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def instrument() -> str:
     return os.environ.get("INSTRUMENT", os.environ.get("BEAMLINE", "b01-1"))
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def latest_commissioning_instrument_session() -> str:
     # Hardcoding this until a suitable API comes along
     return "cm40661-6"
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def data_directory(
     instrument: str, latest_commissioning_instrument_session: str
 ) -> Path:
@@ -72,8 +76,15 @@ def data_directory(
 @pytest.fixture
 def config() -> ApplicationConfig:
     loader = ConfigLoader(ApplicationConfig)
+    # Point BLUEAPI_CONFIG at another file to test against a local blueapi and
+    # STOMP broker instead of the rig
     loader.use_values_from_yaml(
-        PROJECT_ROOT / "configuration" / "b01-1-blueapi-client.yaml"
+        Path(
+            os.environ.get(
+                "BLUEAPI_CONFIG",
+                PROJECT_ROOT / "configuration" / "b01-1-blueapi-client.yaml",
+            )
+        )
     )
     return loader.load()
 
@@ -100,10 +111,32 @@ def stomp_client(config: ApplicationConfig) -> Generator[StompClient]:
     client.disconnect()
 
 
+@pytest.fixture(scope="session")
+def nexus_verifier(data_directory: Path) -> Generator[NexusVerifier]:
+    # Files are verified while the following tests run, and checked at the end
+    with NexusVerifier(data_directory) as verifier:
+        yield verifier
+        problems = verifier.problems(timeout=600)
+    assert not problems, "\n".join(problems)
+
+
 @pytest.fixture
 def bluesky_plan_runner(
     client: BlueapiClient,
     stomp_client: StompClient,
-    data_directory: Path,
-) -> BlueskyPlanRunner:
-    return BlueskyPlanRunner(client, stomp_client)
+    nexus_verifier: NexusVerifier,
+) -> Generator[BlueskyPlanRunner]:
+    runner = BlueskyPlanRunner(client, stomp_client, nexus_verifier)
+    yield runner
+    runner.close()
+
+
+@pytest.fixture
+async def async_plan_runner(
+    client: BlueapiClient,
+    stomp_client: StompClient,
+    nexus_verifier: NexusVerifier,
+) -> AsyncGenerator[AsyncBlueskyPlanRunner]:
+    runner = AsyncBlueskyPlanRunner(client, stomp_client, nexus_verifier)
+    yield runner
+    runner.close()
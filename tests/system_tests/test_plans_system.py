@@ -1,3 +1,5 @@
+import asyncio
+
 import dodal.beamlines.b01_1 as b01_1
 import pytest
 from blueapi.service.model import TaskRequest
@@ -5,7 +7,7 @@ from bluesky import RunEngine
 from scanspec.specs import Line
 
 from test_rig_bluesky.plans import spectroscopy
-from test_rig_bluesky.testing import BlueskyPlanRunner
+from test_rig_bluesky.testing import AsyncBlueskyPlanRunner, BlueskyPlanRunner
 
 
 def test_snapshot(
@@ -118,6 +120,26 @@ def test_generic_scan(
     )
 
 
+async def test_plans_queued_concurrently(
+    async_plan_runner: AsyncBlueskyPlanRunner,
+    latest_commissioning_instrument_session: str,
+):
+    snapshot, spectroscopy = await asyncio.gather(
+        *(
+            async_plan_runner.run(
+                TaskRequest(
+                    name=name,
+                    instrument_session=latest_commissioning_instrument_session,
+                ),
+                timeout=60,
+            )
+            for name in ["snapshot", "spectroscopy"]
+        )
+    )
+    assert (await snapshot.wait_for("FINISHED"))["scanDimensions"] == [1]
+    assert (await spectroscopy.wait_for("FINISHED"))["scanDimensions"] == [5]
+
+
 @pytest.mark.control_system
 def test_spectroscopy_re():
     run_engine = RunEngine()
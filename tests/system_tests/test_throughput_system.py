@@ -0,0 +1,31 @@
+import json
+import logging
+import os
+from pathlib import Path
+
+from test_rig_bluesky.testing import (
+    BlueskyPlanRunner,
+    benchmark_throughput,
+    task_mix,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+def test_visitor_demo_throughput(
+    bluesky_plan_runner: BlueskyPlanRunner, latest_commissioning_instrument_session: str
+):
+    report = benchmark_throughput(
+        bluesky_plan_runner,
+        task_mix(
+            latest_commissioning_instrument_session,
+            repeats=int(os.environ.get("THROUGHPUT_REPEATS", 2)),
+        ),
+        timeout=1000,
+    )
+
+    summary = report.summary()
+    LOGGER.info(f"Throughput: {json.dumps(summary, indent=2)}")
+    if "THROUGHPUT_REPORT" in os.environ:
+        Path(os.environ["THROUGHPUT_REPORT"]).write_text(json.dumps(summary, indent=2))
+    assert report.tasks_per_hour >= float(os.environ.get("MIN_TASKS_PER_HOUR", 0))
@@ -0,0 +1,71 @@
+import numpy as np
+
+from test_rig_bluesky.adaptive import AdaptiveGrid, Cell
+
+
+def _measure_until_converged(grid: AdaptiveGrid, sample, max_points: int = 1000):
+    to_measure = grid.coarse_points()
+    while to_measure and len(grid.values) < max_points:
+        for point in to_measure:
+            grid.add(point, sample(*point))
+        to_measure = grid.refine()
+    return to_measure
+
+
+def test_coarse_points_are_snaked():
+    grid = AdaptiveGrid((0, 2), (0, 1), 3)
+
+    assert grid.coarse_points() == [
+        (0.0, 0.0),
+        (1.0, 0.0),
+        (2.0, 0.0),
+        (2.0, 0.5),
+        (1.0, 0.5),
+        (0.0, 0.5),
+        (0.0, 1.0),
+        (1.0, 1.0),
+        (2.0, 1.0),
+    ]
+
+
+def test_cell_split():
+    quarters, new_points = Cell(0, 2, 0, 2).split()
+
+    assert quarters[0] == Cell(0, 1, 0, 1, depth=1)
+    assert quarters[3] == Cell(1, 2, 1, 2, depth=1)
+    assert (1.0, 1.0) in new_points
+    assert len(new_points) == 5
+
+
+def test_uniform_sample_is_not_refined():
+    grid = AdaptiveGrid((0, 4), (0, 4), 5)
+
+    _measure_until_converged(grid, lambda x, y: [1.0, 2.0, 3.0])
+
+    assert len(grid.values) == 25
+
+
+def test_points_are_added_around_feature():
+    grid = AdaptiveGrid((0, 4), (0, 4), 5, threshold=0.1, max_depth=3)
+
+    def sample(x: float, y: float) -> list[float]:
+        # A small bright spot near (1.2, 2.7) on a uniform background
+        return [100.0 if np.hypot(x - 1.2, y - 2.7) < 0.6 else 0.0, 5.0, 5.0]
+
+    remaining = _measure_until_converged(grid, sample)
+
+    assert remaining == []
+    added = np.array(list(grid.values.keys() - set(grid.coarse_points())))
+    assert len(added) > 0
+    # Only the cells around the feature are refined, not the background
+    assert np.all(np.hypot(added[:, 0] - 1.2, added[:, 1] - 2.7) < 1.5)
+    # The finest cells are an eighth of a coarse cell wide
+    assert (1.125, 2.25) in grid.values
+
+
+def test_refinement_stops_at_max_depth():
+    grid = AdaptiveGrid((0, 1), (0, 1), 2, threshold=0.0, max_depth=2)
+
+    _measure_until_converged(grid, lambda x, y: [x + y])
+
+    assert len(grid.values) == 25
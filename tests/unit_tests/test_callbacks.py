@@ -0,0 +1,141 @@
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pytest
+from bluesky import RunEngine
+from bluesky.plans import count, grid_scan, scan_nd
+from cycler import cycler
+from ophyd.sim import SynAxis, SynGauss
+
+from test_rig_bluesky.callbacks import HDF5FrameReader, MapReducer, grid_indices
+
+
+@pytest.fixture
+def motor() -> SynAxis:
+    return SynAxis(name="motor")
+
+
+@pytest.fixture
+def det(motor: SynAxis) -> SynGauss:
+    return SynGauss("det", motor, "motor", center=0, Imax=1, sigma=1)
+
+
+def test_maps_are_shaped_like_scan(run_engine: RunEngine, motor: SynAxis, det):
+    reducer = MapReducer()
+    run_engine.subscribe(reducer)
+
+    run_engine(scan_nd([det], cycler(motor, [0.0, 1.0, 2.0])))
+
+    np.testing.assert_array_equal(reducer.maps["motor"], [0.0, 1.0, 2.0])
+    np.testing.assert_allclose(reducer.maps["det"], np.exp(-np.array([0, 1, 4]) / 2))
+
+
+def test_snaked_grid_is_mapped_as_it_lies(run_engine: RunEngine, det):
+    outer, inner = SynAxis(name="outer"), SynAxis(name="inner")
+    reducer = MapReducer()
+    run_engine.subscribe(reducer)
+
+    run_engine(grid_scan([det], outer, 0, 1, 2, inner, 0, 2, 3, snake_axes=True))
+
+    np.testing.assert_array_equal(reducer.maps["inner"], [[0, 1, 2], [0, 1, 2]])
+    np.testing.assert_array_equal(reducer.maps["outer"], [[0, 0, 0], [1, 1, 1]])
+
+
+def test_grid_indices_of_nested_snakes():
+    points = np.arange(12)
+
+    indices = grid_indices(points, (2, 2, 3), [False, True, True])
+
+    # The middle dimension reverses on the second pass of the outer one, the
+    # inner one on every other row
+    assert indices.tolist() == [0, 1, 2, 5, 4, 3, 9, 10, 11, 8, 7, 6]
+
+
+def test_maps_grow_without_shape(run_engine: RunEngine, det):
+    reducer = MapReducer()
+    run_engine.subscribe(reducer)
+
+    run_engine(count([det], num=2000))
+
+    assert reducer.maps["det"].shape == (2000,)
+    assert not np.isnan(reducer.maps["det"]).any()
+
+
+def test_maps_saved_at_stop(run_engine: RunEngine, motor: SynAxis, det, tmp_path):
+    reducer = MapReducer(save_to=lambda start: tmp_path / f"{start['scan_id']}.npz")
+    run_engine.subscribe(reducer)
+
+    run_engine(scan_nd([det], cycler(motor, [0.0, 1.0])), scan_id=7)
+
+    with np.load(Path(tmp_path / "7.npz")) as saved:
+        np.testing.assert_array_equal(saved["motor"], [0.0, 1.0])
+        assert saved["det"].shape == (2,)
+
+
+def test_unreadable_external_data_is_retried_at_stop():
+    attempts = []
+
+    def read_external(stream_resource, start, stop):
+        attempts.append((start, stop))
+        if len(attempts) == 1:
+            raise OSError("Not written yet")
+        return np.array([5.0])
+
+    reducer = MapReducer(read_external=read_external)
+    _run_with_one_external_total(reducer, before_stop=lambda: attempts == [(0, 1)])
+
+    assert attempts == [(0, 1), (0, 1)]
+    np.testing.assert_array_equal(reducer.maps["total"], [5.0])
+
+
+def _run_with_one_external_total(reducer: MapReducer, before_stop=None) -> None:
+    reducer("start", {"uid": "s", "time": 0, "shape": [1]})
+    reducer(
+        "descriptor",
+        {
+            "uid": "d",
+            "name": "primary",
+            "run_start": "s",
+            "time": 0,
+            "data_keys": {
+                "total": {"dtype": "number", "shape": [], "source": "", "external": ""}
+            },
+        },
+    )
+    reducer("stream_resource", {"uid": "r", "data_key": "total"})
+    reducer(
+        "stream_datum",
+        {"stream_resource": "r", "descriptor": "d", "indices": {"start": 0, "stop": 1}},
+    )
+    assert np.isnan(reducer.maps["total"]).all()
+    if before_stop is not None:
+        assert before_stop()
+    reducer("stop", {"uid": "e", "run_start": "s", "time": 0, "exit_status": "success"})
+
+
+def test_unread_external_data_is_not_reported_when_not_reading(caplog):
+    reducer = MapReducer(read_external=None)
+    _run_with_one_external_total(reducer)
+
+    assert "Could not read" not in caplog.text
+
+
+def test_hdf5_frames_are_read_as_they_are_written(tmp_path: Path):
+    path = tmp_path / "frames.h5"
+    resource = {"uri": f"file://localhost{path}", "parameters": {"dataset": "/total"}}
+    reader = HDF5FrameReader()
+    with h5py.File(path, "w", libver="latest") as file:
+        total = file.create_dataset("total", (1,), maxshape=(None,), data=[1.0])
+        file.swmr_mode = True
+        file.flush()
+
+        np.testing.assert_array_equal(reader(resource, 0, 1), [1.0])
+        with pytest.raises(KeyError, match="has 1 of 2 frames"):
+            reader(resource, 0, 2)
+        total.resize((2,))
+        total[1] = 2.0
+        file.flush()
+        np.testing.assert_array_equal(reader(resource, 0, 2), [1.0, 2.0])
+        np.testing.assert_array_equal(reader(resource, 1, 2), [2.0])
+    reader.close()
@@ -0,0 +1,45 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from test_rig_bluesky.checkpoint import Checkpoint, scan_fingerprint
+
+
+def test_progress_is_saved(tmp_path: Path):
+    checkpoint = Checkpoint.load("grid", "scan", tmp_path)
+    assert checkpoint.start_part() == {
+        "name": "grid",
+        "scan": "scan",
+        "part": 1,
+        "first_point": 0,
+    }
+    checkpoint.complete(5)
+
+    resumed = Checkpoint.load("grid", "scan", tmp_path)
+    assert resumed.start_part()["first_point"] == 5
+    assert resumed.parts == 2
+
+    resumed.remove()
+    assert not list(tmp_path.iterdir())
+
+
+def test_other_scans_are_not_resumed(tmp_path: Path):
+    Checkpoint.load("grid", "scan", tmp_path).complete(5)
+
+    with pytest.raises(ValueError, match="Checkpoint grid is of a different scan"):
+        Checkpoint.load("grid", "other scan", tmp_path)
+
+
+@pytest.mark.parametrize("name", ["", "..", "../grid", "scans/grid"])
+def test_names_must_be_file_names(tmp_path: Path, name: str):
+    with pytest.raises(ValueError, match="must be a file name"):
+        Checkpoint.load(name, "scan", tmp_path)
+
+
+def test_fingerprint_depends_on_positions():
+    positions = np.linspace(0, 1, 11)
+
+    assert scan_fingerprint("x", positions) == scan_fingerprint("x", positions.copy())
+    assert scan_fingerprint("x", positions) != scan_fingerprint("x", positions[::-1])
+    assert scan_fingerprint("x", positions) != scan_fingerprint("y", positions)
@@ -1,3 +1,4 @@
+import json
 import subprocess
 import sys
 
@@ -7,3 +8,41 @@ from test_rig_bluesky import __version__
 def test_cli_version():
     cmd = [sys.executable, "-m", "test_rig_bluesky", "--version"]
     assert subprocess.check_output(cmd).decode().strip() == __version__
+
+
+def test_cli_estimate():
+    cmd = [sys.executable, "-m", "test_rig_bluesky", "estimate", "snapshot"]
+    estimate = json.loads(subprocess.check_output(cmd))
+    assert estimate["total"] == estimate["exposure"] + estimate["deadtime"]
+
+
+def test_cli_estimate_unknown_params():
+    cmd = [sys.executable, "-m", "test_rig_bluesky", "estimate", "snapshot"]
+    result = subprocess.run(
+        [*cmd, "--params", '{"exposure_time": 0.5}'], capture_output=True, text=True
+    )
+    assert result.returncode == 2
+    assert "error: Cannot estimate snapshot with ['exposure_time']" in result.stderr
+
+
+def test_cli_importtime():
+    cmd = [sys.executable, "-m", "test_rig_bluesky", "importtime", "json"]
+    report = json.loads(subprocess.check_output(cmd))
+    assert report["module"] == "json"
+    assert report["total"] > 0
+
+
+def test_cli_importtime_over_budget():
+    cmd = [sys.executable, "-m", "test_rig_bluesky", "importtime", "json"]
+    result = subprocess.run([*cmd, "--budget", "0"], capture_output=True, text=True)
+    assert result.returncode == 1
+    assert "over the budget" in result.stderr
+
+
+def test_cli_run(tmp_path):
+    cmd = [sys.executable, "-m", "test_rig_bluesky", "run", "snapshot"]
+    cmd += ["--frame-rate", "1000", "--data-dir", str(tmp_path)]
+    report = json.loads(subprocess.check_output(cmd))
+    assert report["points"] == 1
+    assert report["documents"] > 0
+    assert list(tmp_path.glob("*.h5"))
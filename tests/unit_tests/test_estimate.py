@@ -0,0 +1,147 @@
+import inspect
+import time
+from dataclasses import asdict
+
+import pytest
+from scanspec.specs import Line
+
+from test_rig_bluesky.estimate import estimate_duration
+from test_rig_bluesky.plans import demo_spectroscopy
+from test_rig_bluesky.run import DEVICE_NAMES
+from test_rig_bluesky.trajectory import AxisKinematics
+
+KINEMATICS = {
+    "x": AxisKinematics(velocity=1.0, acceleration_time=0.5),
+    "y": AxisKinematics(velocity=1.0, acceleration_time=0.5),
+}
+
+
+def test_estimate_spectroscopy():
+    spec = Line("sample_stage.y", 0, 1, 2) * Line("sample_stage.x", 0, 2, 3)
+
+    estimate = estimate_duration(
+        "spectroscopy",
+        {"spec": spec.serialize(), "exposure_time": 0.5},
+        ca_latency=0.01,
+        kinematics=KINEMATICS,
+    )
+
+    assert asdict(estimate) == pytest.approx(
+        {
+            "settings_load": 0.02,
+            "ndattribute_setup": 0.03,
+            "motion": 4 * 1.5 + 2.5,
+            "exposure": 3.0,
+            "deadtime": 6 * 1961e-6,
+        }
+    )
+
+
+def test_estimate_multiple_frames_per_point():
+    single = estimate_duration("spectroscopy", kinematics=KINEMATICS)
+    multiple = estimate_duration(
+        "spectroscopy", {"frames_per_point": 4}, kinematics=KINEMATICS
+    )
+
+    assert multiple.motion == single.motion
+    assert multiple.exposure == pytest.approx(4 * single.exposure)
+
+
+def test_estimate_fly_is_quicker_than_step():
+    step = estimate_duration("demo_spectroscopy", kinematics=KINEMATICS)
+    fly = estimate_duration("demo_spectroscopy", {"fly": True}, kinematics=KINEMATICS)
+
+    assert fly.exposure == step.exposure
+    assert fly.motion < step.motion
+
+
+def test_estimate_pipelined_hides_readout_behind_moves():
+    step = estimate_duration("demo_spectroscopy", kinematics=KINEMATICS)
+    pipelined = estimate_duration(
+        "demo_spectroscopy", {"pipelined": True}, kinematics=KINEMATICS
+    )
+
+    assert pipelined.motion == step.motion
+    # Only the last point's readout is not overlapped with a move
+    assert pipelined.deadtime == pytest.approx(step.deadtime / 25)
+
+
+def test_estimate_uses_baseline_kinematics():
+    estimate = estimate_duration("spectroscopy")
+
+    # 4 moves of 1.25mm at 1mm/s with 1ms acceleration time
+    assert estimate.motion == pytest.approx(4 * (1.25 + 0.001))
+
+
+def test_estimate_large_grid_is_fast():
+    start = time.monotonic()
+    estimate = estimate_duration(
+        "demo_spectroscopy", {"total_number_of_scan_points": 100_000}
+    )
+
+    assert time.monotonic() - start < 1.0
+    assert estimate.exposure == pytest.approx(316**2 * 0.1)
+
+
+def test_estimate_fly_falls_back_to_step_like_the_plan():
+    # Both axes move along a diagonal line
+    spec = Line("sample_stage.y", 0, 2, 3).zip(Line("sample_stage.x", 0, 2, 3))
+
+    for params in ({"spec": spec.serialize()}, {"frames_per_point": 2}):
+        step = estimate_duration("spectroscopy", params, kinematics=KINEMATICS)
+        fly = estimate_duration(
+            "spectroscopy", {**params, "fly": True}, kinematics=KINEMATICS
+        )
+
+        assert fly.motion == step.motion
+
+
+def test_estimate_uses_the_plan_defaults():
+    defaults = {
+        name: parameter.default
+        for name, parameter in inspect.signature(demo_spectroscopy).parameters.items()
+        if name not in DEVICE_NAMES
+    }
+
+    assert estimate_duration(
+        "demo_spectroscopy", kinematics=KINEMATICS
+    ) == estimate_duration("demo_spectroscopy", defaults, kinematics=KINEMATICS)
+
+
+def test_estimate_unknown_plan():
+    with pytest.raises(ValueError, match="Cannot estimate count"):
+        estimate_duration("count")
+
+
+def test_estimate_plan_without_a_model():
+    with pytest.raises(
+        ValueError, match="Cannot estimate adaptive_spectroscopy, there is no model"
+    ):
+        estimate_duration("adaptive_spectroscopy")
+
+
+def test_estimate_unknown_params():
+    with pytest.raises(ValueError, match=r"snapshot with \['exposure_time'\]"):
+        estimate_duration("snapshot", {"exposure_time": 0.5})
+
+
+def test_estimate_reorders_points_like_the_plan():
+    spec = Line("sample_stage.x", 0, 4, 5).concat(Line("sample_stage.x", 0.5, 4.5, 5))
+
+    estimate = estimate_duration(
+        "spectroscopy",
+        {"spec": spec.serialize(), "optimise_trajectory": True},
+        kinematics=KINEMATICS,
+    )
+
+    # 9 moves of 0.5mm, rather than going back to the start after the first line
+    assert estimate.motion == pytest.approx(9 * 1.0)
+
+
+def test_estimate_snapshot_series():
+    estimate = estimate_duration(
+        "snapshot_series", {"frame_rate": 20.0, "duration": 3.0}
+    )
+
+    assert estimate.total == pytest.approx(3.0)
+    assert estimate.deadtime == pytest.approx(60 * 1961e-6)
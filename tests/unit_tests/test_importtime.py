@@ -0,0 +1,64 @@
+import subprocess
+import sys
+
+import pytest
+
+from test_rig_bluesky.importtime import ImportReport, measure_import, parse_importtime
+
+OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:       100 |        100 |     numpy._utils
+import time:      2000 |       2100 |   numpy
+import time:       500 |        500 |   json
+import time:       300 |       2900 | mypackage
+some other line
+"""
+
+
+def test_parse_importtime():
+    timings = parse_importtime(OUTPUT)
+
+    assert [timing.module for timing in timings] == [
+        "numpy._utils",
+        "numpy",
+        "json",
+        "mypackage",
+    ]
+    assert timings[1].self_time == pytest.approx(0.002)
+    assert timings[3].cumulative == pytest.approx(0.0029)
+    assert [timing.depth for timing in timings] == [2, 1, 1, 0]
+
+
+def test_report_breaks_down_by_package():
+    report = ImportReport("mypackage", [], parse_importtime(OUTPUT))
+
+    assert report.total == pytest.approx(0.0029)
+    assert report.by_package() == pytest.approx(
+        {"numpy": 0.0021, "json": 0.0005, "mypackage": 0.0003}
+    )
+    assert [timing.module for timing in report.slowest(2)] == ["numpy", "json"]
+    assert list(report.summary(top=1)["packages"]) == ["numpy"]
+
+
+def test_preloaded_modules_are_not_counted():
+    report = measure_import("json", preload=["json"])
+
+    assert report.timings == []
+    assert report.preloaded == ["json"]
+
+
+def test_plans_import_heavy_modules_on_first_use():
+    lazy = [
+        "bluesky.plans",
+        "dodal.plans",
+        "ophyd_async.plan_stubs",
+        "test_rig_bluesky.adaptive",
+        "test_rig_bluesky.scans",
+        "test_rig_bluesky.trajectory",
+    ]
+    code = (
+        "import sys, test_rig_bluesky.plans; "
+        f"print([name for name in {lazy!r} if name in sys.modules])"
+    )
+
+    assert subprocess.check_output([sys.executable, "-c", code]).strip() == b"[]"
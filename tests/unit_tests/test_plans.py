@@ -1,84 +1,124 @@
 import asyncio
 import unittest.mock
 from collections import defaultdict
+from pathlib import Path
+from typing import Literal
 from unittest.mock import ANY, AsyncMock, Mock, patch
 
-import dodal.beamlines.b01_1 as b01_1
+import numpy as np
 import pytest
 from bluesky import RunEngine
+from bluesky.preprocessors import msg_mutator
+from bluesky.run_engine import RunEngineResult
+from bluesky.utils import FailedStatus
 from dodal.devices.motors import XYZStage
-from ophyd_async.core import callback_on_mock_put, set_mock_value
+from ophyd_async.core import (
+    PathInfo,
+    PathProvider,
+    callback_on_mock_put,
+    get_mock_put,
+    set_mock_value,
+)
 from ophyd_async.epics.adaravis import AravisDetector
+from ophyd_async.epics.motor import Motor
 from ophyd_async.testing import assert_emitted
 from scanspec.specs import Line
 
+from test_rig_bluesky.callbacks import MapReducer
 from test_rig_bluesky.plans import (
+    _settings_history,
+    adaptive_spectroscopy,
     demo_spectroscopy,
+    diff_settings,
     load_settings,
     save_settings,
     snapshot,
+    snapshot_series,
     spectroscopy,
 )
+from test_rig_bluesky.profiling import PlanProfiler
+from test_rig_bluesky.settings import SettingsReport
+from test_rig_bluesky.settings_store import SETTINGS_HISTORY, SettingsStore
+from test_rig_bluesky.state import STATE_DIRECTORY_ENV
 
 
 @pytest.fixture
-def imaging_detector() -> AravisDetector:
-    det = b01_1.imaging_detector(connect_immediately=True, mock=True)
-    _mock_detector_behavior(det)
-    return det
-
-
-@pytest.fixture
-def spectroscopy_detector() -> AravisDetector:
-    det = b01_1.spectroscopy_detector(connect_immediately=True, mock=True)
-    _mock_detector_behavior(det)
-    return det
-
+def settings_history(tmp_path: Path):
+    history = SettingsStore(tmp_path / "history.bin")
+    with patch("test_rig_bluesky.plans._settings_history", return_value=history):
+        yield history
 
-@pytest.fixture
-def sample_stage() -> XYZStage:
-    stage = b01_1.sample_stage(connect_immediately=True, mock=True)
 
-    set_mock_value(stage.x.low_limit_travel, -10.0)
-    set_mock_value(stage.x.high_limit_travel, 10.0)
-    set_mock_value(stage.y.low_limit_travel, -10.0)
-    set_mock_value(stage.y.high_limit_travel, 10.0)
-
-    set_mock_value(stage.x.velocity, 1.0)
-    set_mock_value(stage.y.velocity, 1.0)
+@patch("test_rig_bluesky.plans.YamlSettingsProvider")
+def test_save_setting(
+    mock_provider: Mock,
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    settings_history: SettingsStore,
+):
+    # Provider needs to be async or the RunEngine will complain
+    mock_provider.return_value = AsyncMock()
+    result = run_engine(save_settings(spectroscopy_detector, design_name="test"))
+    mock_provider.return_value.store.assert_called_once_with("test", ANY)
+    assert isinstance(result, RunEngineResult)
+    assert result.plan_result == 1
+    assert settings_history.designs(device="spectroscopy_detector") == ["test"]
 
-    return stage
 
+@patch("test_rig_bluesky.plans.YamlSettingsProvider")
+def test_settings_history_is_kept_in_the_state_directory(
+    mock_provider: Mock,
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    state_directory: Path,
+):
+    mock_provider.return_value = AsyncMock()
+    run_engine(save_settings(spectroscopy_detector, design_name="test"))
 
-def _mock_detector_behavior(detector: AravisDetector) -> None:
-    async def mock_acquisition() -> None:
-        # Get number of images to capture per acquire
-        num_images = await detector.driver.num_images.get_value()
-        set_mock_value(detector.fileio.num_capture, num_images)
+    history = SettingsStore(state_directory / SETTINGS_HISTORY)
+    assert history.designs() == ["test"]
 
-        # Increment from current num captured to new value
-        current_num_captured = await detector.fileio.num_captured.get_value()
-        for i in range(current_num_captured, current_num_captured + num_images + 1):
-            set_mock_value(detector.fileio.num_captured, i)
 
-    async def on_acquire(acquire: bool, wait: bool) -> None:
-        if acquire:
-            asyncio.create_task(mock_acquisition())
+def test_settings_history_is_kept_open_per_state_directory(
+    state_directory: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    history = _settings_history()
+    assert _settings_history() is history
 
-    set_mock_value(detector.fileio.file_path_exists, True)
-    callback_on_mock_put(detector.driver.acquire, on_acquire)
+    monkeypatch.setenv(STATE_DIRECTORY_ENV, str(tmp_path / "other"))
+    assert _settings_history() is not history
 
 
 @patch("test_rig_bluesky.plans.YamlSettingsProvider")
-def test_save_setting(
+async def test_restore_and_diff_settings_history(
     mock_provider: Mock,
     run_engine: RunEngine,
     spectroscopy_detector: AravisDetector,
+    settings_history: SettingsStore,
 ):
-    # Provider needs to be async or the RunEngine will complain
     mock_provider.return_value = AsyncMock()
-    run_engine(save_settings(spectroscopy_detector, design_name="test"))
-    mock_provider.return_value.store.assert_called_once_with("test", ANY)
+    acquire_time = spectroscopy_detector.driver.acquire_time
+    set_mock_value(acquire_time, 0.1)
+    run_engine(save_settings(spectroscopy_detector, "design"))
+    set_mock_value(acquire_time, 0.5)
+    run_engine(save_settings(spectroscopy_detector, "design"))
+
+    diff = run_engine(diff_settings(spectroscopy_detector, "design", version=1))
+    assert isinstance(diff, RunEngineResult)
+    assert diff.plan_result.changed == {"driver.acquire_time": (0.1, 0.5)}
+
+    run_engine(
+        load_settings(
+            spectroscopy_detector,
+            "design",
+            whitelist_pvs=["driver-acquire_time"],
+            version=1,
+        )
+    )
+    assert await acquire_time.get_value() == 0.1
+    assert settings_history.diff("design").changed == {
+        "driver.acquire_time": (0.1, 0.5)
+    }
 
 
 async def test_load_subset_of_settings(
@@ -113,6 +153,29 @@ async def test_load_settings(
     assert await spectroscopy_detector.roistat.channels[1].min_x.get_value() == 95  # type:ignore
 
 
+def test_load_settings_only_writes_changed_signals(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+):
+    whitelist = ["driver-acquire_time", "driver-num_images", "roistat-channels-1-min_x"]
+
+    first = run_engine(
+        load_settings(
+            spectroscopy_detector, "spectroscopy_detector_baseline", whitelist
+        )
+    )
+    second = run_engine(
+        load_settings(
+            spectroscopy_detector, "spectroscopy_detector_baseline", whitelist
+        )
+    )
+
+    assert isinstance(first, RunEngineResult)
+    assert isinstance(second, RunEngineResult)
+    assert first.plan_result == SettingsReport(read=3, skipped=0, written=3)
+    assert second.plan_result == SettingsReport(read=3, skipped=3, written=0)
+
+
 def test_snapshot(
     run_engine: RunEngine,
     imaging_detector: AravisDetector,
@@ -136,6 +199,53 @@ def test_snapshot(
     }
 
 
+def test_snapshot_series(
+    run_engine: RunEngine,
+    imaging_detector: AravisDetector,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    docs = defaultdict(list)
+    run_engine.subscribe(lambda name, doc: docs[name].append(doc))
+
+    run_engine(
+        snapshot_series(
+            imaging_detector, spectroscopy_detector, sample_stage, num_frames=5
+        )
+    )
+
+    assert docs["start"][0]["shape"] == [5]
+    assert [doc["name"] for doc in docs["descriptor"]] == ["primary", "positions"]
+    assert (
+        sum(
+            doc["indices"]["stop"] - doc["indices"]["start"]
+            for doc in docs["stream_datum"]
+        )
+        == 2 * 5
+    )
+    get_mock_put(imaging_detector.driver.acquire_period).assert_called_with(
+        0.1, wait=True
+    )
+
+
+def test_snapshot_series_rejects_exposures_longer_than_frames(
+    run_engine: RunEngine,
+    imaging_detector: AravisDetector,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    with pytest.raises(ValueError, match="Cannot take 0.1s exposures every 0.1s"):
+        run_engine(
+            snapshot_series(
+                imaging_detector,
+                spectroscopy_detector,
+                sample_stage,
+                frame_rate=10.0,
+                exposure_time=0.1,
+            )
+        )
+
+
 async def test_spectroscopy(
     run_engine: RunEngine,
     spectroscopy_detector: AravisDetector,
@@ -220,6 +330,555 @@ async def test_spectroscopy_sets_exposure_time_and_acquire_period(
     )
 
 
+async def test_fly_spectroscopy(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    docs = defaultdict(list)
+    run_engine.subscribe(lambda name, doc: docs[name].append(doc))
+
+    run_engine(
+        spectroscopy(
+            spectroscopy_detector,
+            sample_stage,
+            Line(sample_stage.y, 4.2, 6, 3) * Line(sample_stage.x, 0, 5, 10),
+            0.2,
+            fly=True,
+        )
+    )
+
+    assert docs["start"][0]["plan_name"] == "fly_scan"
+    assert docs["start"][0]["shape"] == [3, 10]
+    assert_emitted(
+        docs,
+        start=1,
+        descriptor=1,
+        stream_resource=4,
+        stream_datum=4 * 3,
+        event=3,
+        stop=1,
+    )
+    data_keys = [resource.get("data_key") for resource in docs["stream_resource"]]
+    assert data_keys == ["spectroscopy_detector", "RedTotal", "GreenTotal", "BlueTotal"]
+    assert [event["data"]["sample_stage-y"] for event in docs["event"]] == [
+        4.2,
+        5.1,
+        6.0,
+    ]
+    for event in docs["event"]:
+        np.testing.assert_allclose(
+            event["data"]["sample_stage-x"], np.linspace(0, 5, 10)
+        )
+    assert await spectroscopy_detector.driver.num_images.get_value() == 10
+    assert await sample_stage.x.velocity.get_value() == 1.0
+
+
+def test_fly_spectroscopy_takes_frames_once_at_velocity(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    acquire = get_mock_put(spectroscopy_detector.driver.acquire)
+    frames_started_before_run_up = []
+
+    def rows_started() -> int:
+        return sum(args == (True,) for args, _ in acquire.call_args_list)
+
+    async def run_up(setpoint: float) -> None:
+        await asyncio.sleep(0.1)
+        frames_started_before_run_up.append(rows_started())
+        set_mock_value(sample_stage.x.user_readback, setpoint)
+
+    def on_move(setpoint: float, wait: bool) -> None:
+        # Kicked off towards the end of the row, or moved back to run up again
+        if setpoint > 5:
+            asyncio.create_task(run_up(setpoint))
+        else:
+            set_mock_value(sample_stage.x.user_readback, setpoint)
+
+    callback_on_mock_put(sample_stage.x.user_setpoint, on_move)
+    run_engine(
+        spectroscopy(
+            spectroscopy_detector,
+            sample_stage,
+            Line(sample_stage.y, 0, 1, 2) * Line(sample_stage.x, 0, 5, 10),
+            0.2,
+            fly=True,
+        )
+    )
+
+    assert frames_started_before_run_up == [0, 1]
+    assert rows_started() == 2
+
+
+def test_fly_spectroscopy_falls_back_to_step_scan(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    docs = defaultdict(list)
+    run_engine.subscribe(lambda name, doc: docs[name].append(doc))
+
+    spec = Line(sample_stage.x, 0, 5, 5).zip(Line(sample_stage.y, 0, 5, 5))
+    run_engine(spectroscopy(spectroscopy_detector, sample_stage, spec, fly=True))
+
+    assert docs["start"][0]["plan_name"] == "spec_scan"
+    assert_emitted(
+        docs,
+        start=1,
+        descriptor=1,
+        stream_resource=4,
+        stream_datum=4 * 5,
+        event=5,
+        stop=1,
+    )
+
+
+def test_spectroscopy_with_optimised_trajectory(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    docs = defaultdict(list)
+    run_engine.subscribe(lambda name, doc: docs[name].append(doc))
+
+    run_engine(
+        spectroscopy(
+            spectroscopy_detector,
+            sample_stage,
+            Line(sample_stage.y, 0, 1, 2) * Line(sample_stage.x, 0, 2, 3),
+            optimise_trajectory=True,
+        )
+    )
+
+    optimisation = docs["start"][0]["trajectory_optimisation"]
+    assert optimisation["travel_time"] < optimisation["original_travel_time"]
+    assert [event["data"]["sample_stage-x"] for event in docs["event"]] == [
+        0.0,
+        1.0,
+        2.0,
+        2.0,
+        1.0,
+        0.0,
+    ]
+
+
+async def test_spectroscopy_with_multiple_frames_per_point(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    docs = defaultdict(list)
+    run_engine.subscribe(lambda name, doc: docs[name].append(doc))
+
+    run_engine(
+        spectroscopy(
+            spectroscopy_detector,
+            sample_stage,
+            Line(sample_stage.y, 0, 1, 2) * Line(sample_stage.x, 0, 2, 3),
+            0.2,
+            frames_per_point=3,
+        )
+    )
+
+    assert docs["start"][0]["plan_name"] == "step_scan"
+    assert docs["start"][0]["shape"] == [2, 3]
+    assert docs["start"][0]["plan_args"]["frames_per_point"] == 3
+    assert_emitted(
+        docs,
+        start=1,
+        descriptor=1,
+        stream_resource=4,
+        stream_datum=4 * 6,
+        event=6,
+        stop=1,
+    )
+    descriptor = docs["descriptor"][0]
+    assert descriptor["data_keys"]["RedTotal"]["shape"] == [3]
+    assert [event["data"]["sample_stage-x"] for event in docs["event"]] == [
+        0.0,
+        1.0,
+        2.0,
+        0.0,
+        1.0,
+        2.0,
+    ]
+    assert await spectroscopy_detector.driver.num_images.get_value() == 3
+
+
+async def test_spectroscopy_only_writes_changed_ndattributes(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    nd_attributes_file = spectroscopy_detector.roistat.nd_attributes_file  # type: ignore
+
+    def run_spectroscopy():
+        # The IOC resets the capture counter when a new file is opened
+        set_mock_value(spectroscopy_detector.fileio.num_captured, 0)
+        run_engine(spectroscopy(spectroscopy_detector, sample_stage))
+
+    run_spectroscopy()
+    run_spectroscopy()
+
+    get_mock_put(nd_attributes_file).assert_called_once()
+
+    # E.g. after an IOC restart
+    set_mock_value(nd_attributes_file, "")
+    run_spectroscopy()
+
+    assert get_mock_put(nd_attributes_file).call_count == 2
+    assert "RedTotal" in await nd_attributes_file.get_value()
+
+
+def test_spectroscopy_rejects_spec_outside_limits(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    set_mock_value(sample_stage.x.dial_low_limit_travel, -10.0)
+    set_mock_value(sample_stage.x.dial_high_limit_travel, 10.0)
+    spec = Line(sample_stage.x, 0, 20, 5)
+
+    with pytest.raises(ValueError, match="outside its limits"):
+        run_engine(spectroscopy(spectroscopy_detector, sample_stage, spec))
+
+    # Rejected before anything was set up or moved
+    get_mock_put(spectroscopy_detector.driver.acquire_time).assert_not_called()
+    get_mock_put(sample_stage.x.user_setpoint).assert_not_called()
+
+
+def test_spectroscopy_rejects_rows_too_fast_to_fly(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    spec = Line(sample_stage.x, 0, 9, 3)
+
+    with pytest.raises(ValueError, match="Cannot fly: sample_stage-x must fly at"):
+        run_engine(
+            spectroscopy(spectroscopy_detector, sample_stage, spec, 0.01, fly=True)
+        )
+
+    get_mock_put(sample_stage.x.user_setpoint).assert_not_called()
+
+
+def test_spectroscopy_only_checks_fly_limits_when_flying(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    docs = defaultdict(list)
+    run_engine.subscribe(lambda name, doc: docs[name].append(doc))
+    spec = Line(sample_stage.x, 0, 9, 3)
+
+    # Several frames per point cannot be flown, so it steps within the limits
+    run_engine(
+        spectroscopy(
+            spectroscopy_detector,
+            sample_stage,
+            spec,
+            0.01,
+            fly=True,
+            frames_per_point=2,
+        )
+    )
+
+    assert docs["start"][0]["plan_name"] == "step_scan"
+    assert len(docs["event"]) == 3
+
+
+def test_pipelined_spectroscopy_moves_while_frames_are_written(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    messages = []
+    spec = Line(sample_stage.x, 0, 1, 3)
+
+    run_engine(
+        msg_mutator(
+            spectroscopy(spectroscopy_detector, sample_stage, spec, pipelined=True),
+            lambda msg: messages.append(msg) or msg,
+        )
+    )
+
+    events = []
+    for msg in messages:
+        if msg.command == "create":
+            events.append([])
+        elif events and msg.command in ("read", "set"):
+            events[-1].append((msg.command, msg.obj.name))
+        if msg.command == "save":
+            events[-1].append(("save", None))
+    # The stage is read back, then moves on before the detector is read
+    assert events[0][: events[0].index(("save", None))] == [
+        ("read", "sample_stage"),
+        ("set", "sample_stage-x"),
+        ("read", "spectroscopy_detector"),
+    ]
+    assert ("set", "sample_stage-x") not in events[-1]
+    assert [
+        call.args[0] for call in get_mock_put(sample_stage.x.user_setpoint).mock_calls
+    ] == [0.0, 0.5, 1.0]
+
+
+def test_profile_spectroscopy(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    profiler = PlanProfiler("spectroscopy")
+
+    run_engine(profiler.profile(spectroscopy(spectroscopy_detector, sample_stage)))
+
+    report = profiler.report()
+    assert [timing.path for timing in report.phases] == [
+        ("validate spec",),
+        ("load settings",),
+        ("read ROI names",),
+        ("setup ndattributes",),
+        ("scan",),
+    ]
+    assert report.messages["trigger"].count == 5
+
+
+def test_adaptive_spectroscopy(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    docs = defaultdict(list)
+    run_engine.subscribe(lambda name, doc: docs[name].append(doc))
+    red_total = spectroscopy_detector.roistat.channels[1].total  # type: ignore
+
+    # A sharp edge in the red channel at x = 2.6
+    def on_move(x: float, wait: bool) -> None:
+        set_mock_value(sample_stage.x.user_readback, x)
+        set_mock_value(red_total, 100.0 if x > 2.6 else 0.0)
+
+    callback_on_mock_put(sample_stage.x.user_setpoint, on_move)
+
+    run_engine(
+        adaptive_spectroscopy(
+            spectroscopy_detector, sample_stage, max_points=40, max_depth=2
+        )
+    )
+
+    assert docs["start"][0]["plan_name"] == "adaptive_spectroscopy"
+    assert docs["start"][0]["plan_args"]["max_points"] == 40
+    assert len(docs["event"]) == 40
+    xs = [event["data"]["sample_stage-x"] for event in docs["event"]]
+    # After the coarse grid, points are only added either side of the edge
+    assert all(2.5 <= x <= 3.75 for x in xs[25:])
+    data_keys = [resource.get("data_key") for resource in docs["stream_resource"]]
+    assert data_keys == ["spectroscopy_detector", "RedTotal", "GreenTotal", "BlueTotal"]
+
+
+def test_adaptive_spectroscopy_stops_on_time_budget(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    docs = defaultdict(list)
+    run_engine.subscribe(lambda name, doc: docs[name].append(doc))
+
+    run_engine(
+        adaptive_spectroscopy(spectroscopy_detector, sample_stage, time_budget=0)
+    )
+
+    assert len(docs["event"]) == 0
+    assert docs["stop"][0]["exit_status"] == "success"
+
+
+def _frame_numbers(stream_resource, start: int, stop: int) -> np.ndarray:
+    return np.arange(start, stop, dtype=np.float64)
+
+
+class _NewDirectoryEachRun(PathProvider):
+    def __init__(self, root: Path):
+        self.root = root
+        self.runs = 0
+
+    def __call__(self, device_name: str | None = None) -> PathInfo:
+        self.runs += 1
+        return PathInfo(directory_path=self.root / str(self.runs), filename="data")
+
+
+@pytest.fixture
+def checkpoints(
+    tmp_path: Path, state_directory: Path, monkeypatch: pytest.MonkeyPatch
+) -> Path:
+    # Like blueapi's, the beamline's path provider gives each run a new directory
+    monkeypatch.setattr(
+        "dodal.common.beamlines.beamline_utils.PATH_PROVIDER",
+        _NewDirectoryEachRun(tmp_path / "data"),
+    )
+    return state_directory / "checkpoints"
+
+
+def _fail_on_move(motor: Motor, number: int) -> None:
+    moves = 0
+
+    def on_move(value: float, wait: bool) -> None:
+        nonlocal moves
+        moves += 1
+        if moves == number:
+            raise RuntimeError("Stage fault")
+
+    callback_on_mock_put(motor.user_setpoint, on_move)
+
+
+def _follow_setpoint(motor: Motor) -> None:
+    def on_move(value: float, wait: bool) -> None:
+        set_mock_value(motor.user_readback, value)
+
+    callback_on_mock_put(motor.user_setpoint, on_move)
+
+
+def test_spectroscopy_resumes_from_checkpoint(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+    checkpoints: Path,
+):
+    docs = defaultdict(list)
+    run_engine.subscribe(lambda name, doc: docs[name].append(doc))
+    reducer = MapReducer(read_external=None)
+    run_engine.subscribe(reducer)
+    spec = Line(sample_stage.y, 0, 1, 2) * Line(sample_stage.x, 0, 2, 3)
+
+    def run_spectroscopy():
+        # The IOC resets the capture counter when a new file is opened
+        set_mock_value(spectroscopy_detector.fileio.num_captured, 0)
+        run_engine(
+            spectroscopy(spectroscopy_detector, sample_stage, spec, checkpoint="grid")
+        )
+
+    _fail_on_move(sample_stage.x, 4)
+    with pytest.raises(FailedStatus):
+        run_spectroscopy()
+    assert len(docs["event"]) == 3
+    assert (checkpoints / "grid.checkpoint.json").exists()
+
+    _follow_setpoint(sample_stage.x)
+    _follow_setpoint(sample_stage.y)
+    run_spectroscopy()
+
+    assert len(docs["event"]) == 6
+    assert docs["start"][1]["checkpoint"] == {
+        "name": "grid",
+        "scan": docs["start"][0]["checkpoint"]["scan"],
+        "part": 2,
+        "first_point": 3,
+    }
+    assert [event["data"]["sample_stage-x"] for event in docs["event"][3:]] == [
+        0,
+        1,
+        2,
+    ]
+    np.testing.assert_array_equal(
+        reducer.maps["sample_stage-y"], [[np.nan] * 3, [1, 1, 1]]
+    )
+    assert not list(checkpoints.iterdir())
+
+
+def test_fly_spectroscopy_resumes_after_completed_rows(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+    checkpoints: Path,
+):
+    docs = defaultdict(list)
+    run_engine.subscribe(lambda name, doc: docs[name].append(doc))
+    spec = Line(sample_stage.y, 0, 2, 3) * Line(sample_stage.x, 0, 5, 10)
+
+    def run_spectroscopy():
+        set_mock_value(spectroscopy_detector.fileio.num_captured, 0)
+        run_engine(
+            spectroscopy(
+                spectroscopy_detector, sample_stage, spec, fly=True, checkpoint="fly"
+            )
+        )
+
+    _fail_on_move(sample_stage.y, 2)
+    with pytest.raises(FailedStatus):
+        run_spectroscopy()
+    _follow_setpoint(sample_stage.y)
+    run_spectroscopy()
+
+    assert docs["start"][1]["checkpoint"]["first_point"] == 10
+    assert [event["data"]["sample_stage-y"] for event in docs["event"]] == [0, 1, 2]
+    assert not list(checkpoints.iterdir())
+
+
+@pytest.mark.parametrize(
+    "kwargs, red_total",
+    [
+        ({}, np.arange(6.0).reshape(2, 3)),
+        ({"fly": True}, np.arange(6.0).reshape(2, 3)),
+        ({"frames_per_point": 2}, np.arange(12.0).reshape(2, 3, 2)),
+        ({"optimise_trajectory": True}, [[0, 1, 2], [5, 4, 3]]),
+        ({"optimise_trajectory": True, "fly": True}, [[0, 1, 2], [5, 4, 3]]),
+    ],
+)
+def test_map_reducer(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+    kwargs: dict,
+    red_total: np.ndarray,
+):
+    reducer = MapReducer(read_external=_frame_numbers)
+    run_engine.subscribe(reducer)
+
+    run_engine(
+        spectroscopy(
+            spectroscopy_detector,
+            sample_stage,
+            Line(sample_stage.y, 0, 1, 2) * Line(sample_stage.x, 0, 2, 3),
+            **kwargs,
+        )
+    )
+
+    maps = reducer.maps
+    np.testing.assert_array_equal(maps["RedTotal"], red_total)
+    np.testing.assert_array_equal(maps["sample_stage-y"], [[0, 0, 0], [1, 1, 1]])
+    np.testing.assert_array_equal(maps["sample_stage-x"], [[0, 1, 2], [0, 1, 2]])
+    assert "spectroscopy_detector" not in maps
+
+
+@pytest.mark.parametrize(
+    "reduce_frames, red_total",
+    [
+        ("sum", [[1, 5, 9], [13, 17, 21]]),
+        ("mean", [[0.5, 2.5, 4.5], [6.5, 8.5, 10.5]]),
+    ],
+)
+def test_map_reducer_reduces_frames_of_each_point(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+    reduce_frames: Literal["sum", "mean"],
+    red_total: list[list[float]],
+):
+    reducer = MapReducer(read_external=_frame_numbers, reduce_frames=reduce_frames)
+    run_engine.subscribe(reducer)
+
+    run_engine(
+        spectroscopy(
+            spectroscopy_detector,
+            sample_stage,
+            Line(sample_stage.y, 0, 1, 2) * Line(sample_stage.x, 0, 2, 3),
+            frames_per_point=2,
+        )
+    )
+
+    np.testing.assert_array_equal(reducer.maps["RedTotal"], red_total)
+    np.testing.assert_array_equal(reducer.maps["sample_stage-x"], [[0, 1, 2]] * 2)
+
+
 def test_demo_spectroscopy():
     fake_detector = unittest.mock.MagicMock(name="fake_detector")
     fake_stage = unittest.mock.MagicMock(name="fake_stage")
@@ -239,6 +898,7 @@ def test_demo_spectroscopy():
     called_kwargs = mock_spec.call_args.kwargs
     assert called_kwargs["spectroscopy_detector"] is fake_detector
     assert called_kwargs["sample_stage"] is fake_stage
+    assert called_kwargs["optimise_trajectory"] is False
     assert called_kwargs["spec"] == Line(fake_stage.y, 0.0, 5.0, 5) * Line(
         fake_stage.x, 0.0, 5.0, 5
     )
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+from bluesky import RunEngine
+from bluesky import plan_stubs as bps
+from bluesky.run_engine import RunEngineResult
+from bluesky.utils import MsgGenerator
+
+from test_rig_bluesky.profiling import PlanProfiler, phase
+
+
+def nested_plan() -> MsgGenerator[int]:
+    with phase("outer"):
+        yield from bps.sleep(0.02)
+        with phase("inner"):
+            yield from bps.sleep(0.01)
+            yield from bps.null()
+    return 42
+
+
+def test_phases_are_ignored_without_profiler(run_engine: RunEngine):
+    result = run_engine(nested_plan())
+
+    assert isinstance(result, RunEngineResult)
+    assert result.plan_result == 42
+
+
+def test_profiler_records_phases_and_messages(run_engine: RunEngine):
+    profiler = PlanProfiler("nested")
+
+    result = run_engine(profiler.profile(nested_plan()))
+
+    assert isinstance(result, RunEngineResult)
+    assert result.plan_result == 42
+    report = profiler.report()
+    durations = {timing.path: timing.duration for timing in report.phases}
+    assert durations.keys() == {("outer",), ("outer", "inner")}
+    assert durations[("outer", "inner")] == pytest.approx(0.01, abs=0.01)
+    assert durations[("outer",)] >= durations[("outer", "inner")] + 0.02
+    assert report.total >= durations[("outer",)]
+    assert report.messages["sleep"].count == 2
+    assert report.messages["null"].count == 1
+    assert report.messages["sleep"].max >= 0.02
+
+
+def test_profiler_reports_errors_thrown_into_plan(run_engine: RunEngine):
+    profiler = PlanProfiler()
+
+    def failing_plan() -> MsgGenerator[None]:
+        with phase("failing"):
+            yield from bps.null()
+            raise ValueError("oops")
+
+    with pytest.raises(ValueError):
+        run_engine(profiler.profile(failing_plan()))
+
+    assert [timing.path for timing in profiler.report().phases] == [("failing",)]
+
+
+def test_report_exports(run_engine: RunEngine):
+    profiler = PlanProfiler("nested")
+    run_engine(profiler.profile(nested_plan()))
+    report = profiler.report()
+
+    exported = json.loads(report.to_json())
+    assert [p["phase"] for p in exported["phases"]] == ["outer/inner", "outer"]
+    assert exported["messages"]["sleep"]["count"] == 2
+
+    stacks = dict(line.rsplit(" ", 1) for line in report.to_folded().splitlines())
+    assert int(stacks["nested;outer;inner;sleep"]) == pytest.approx(1e4, rel=0.5)
+    assert int(stacks["nested;outer;sleep"]) == pytest.approx(2e4, rel=0.5)
+    # Folded stacks hold self time, so they add up to the total
+    assert sum(int(t) for t in stacks.values()) == pytest.approx(
+        report.total * 1e6, rel=0.01
+    )
@@ -0,0 +1,87 @@
+import subprocess
+import sys
+
+import pytest
+from bluesky import RunEngine
+from ophyd_async.core import Device
+from scanspec.specs import Line
+
+from test_rig_bluesky.plans import spectroscopy
+from test_rig_bluesky.run import (
+    RunReport,
+    find_plan,
+    make_devices,
+    plan_arguments,
+    run_plan,
+)
+
+
+@pytest.fixture
+def devices(run_engine: RunEngine) -> dict[str, Device]:
+    return make_devices("sim", frame_rate=1000)
+
+
+def test_plan_arguments_resolve_devices_and_specs(devices: dict[str, Device]):
+    spec = Line("sample_stage.y", 0, 1, 2) * Line("sample_stage.x", 0, 1, 3)
+
+    arguments = plan_arguments(
+        spectroscopy, {"spec": spec.serialize(), "exposure_time": 0.01}, devices
+    )
+
+    stage = devices["sample_stage"]
+    assert arguments["spec"].axes() == [stage.y, stage.x]  # type: ignore
+    assert arguments["exposure_time"] == 0.01
+    assert arguments["sample_stage"] is stage
+    assert arguments["spectroscopy_detector"] is devices["spectroscopy_detector"]
+    assert "imaging_detector" not in arguments
+
+
+def test_plan_arguments_reject_unknown_parameters(devices: dict[str, Device]):
+    with pytest.raises(ValueError, match="no parameters \\['exposure'\\]"):
+        plan_arguments(spectroscopy, {"exposure": 0.01}, devices)
+
+
+def test_find_plan_only_finds_public_plans():
+    assert find_plan("snapshot").__name__ == "snapshot"
+    with pytest.raises(ValueError, match="No plan _settings_provider"):
+        find_plan("_settings_provider")
+
+
+def test_run_fly_scan_counts_frames(run_engine: RunEngine, devices: dict[str, Device]):
+    spec = Line("sample_stage.y", 0, 0.1, 2) * Line("sample_stage.x", 0, 0.02, 3)
+
+    report = run_plan(
+        run_engine,
+        "spectroscopy",
+        {"spec": spec.serialize(), "exposure_time": 0.001, "fly": True},
+        devices,
+    )
+
+    assert report.points == 6
+    assert report.live_time == pytest.approx(0.006)
+    assert report.documents["event"] == 2
+    assert 0 < report.dead_time_fraction < 1
+
+
+def test_run_snapshot(run_engine: RunEngine, devices: dict[str, Device]):
+    report = run_plan(run_engine, "snapshot", devices=devices)
+
+    assert report.points == 1
+    assert report.documents["start"] == report.documents["stop"] == 1
+    assert report.summary()["documents"] == sum(report.documents.values())
+
+
+def test_simulated_devices_do_not_need_blueapi():
+    # blueapi is only installed for development
+    code = (
+        "import sys; import test_rig_bluesky.testing; "
+        "assert 'blueapi' not in sys.modules, 'blueapi was imported'"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_report_of_instant_run():
+    report = RunReport("snapshot", 0.0, 0, 0.0, {})
+
+    assert report.points_per_second == 0.0
+    assert report.dead_time_fraction == 0.0
@@ -0,0 +1,77 @@
+import json
+from dataclasses import replace
+from pathlib import Path
+from typing import Any
+
+import pytest
+from bluesky import RunEngine
+from bluesky.plans import count
+from ophyd.sim import SynAxis, SynGauss
+
+from test_rig_bluesky.testing import (
+    ScalingResult,
+    find_regressions,
+    measure_plan_scaling,
+    save_scaling_results,
+)
+
+RESULT = ScalingResult(
+    plan="spectroscopy",
+    points=100,
+    total_time=2.0,
+    plan_time=0.5,
+    run_engine_time=1.5,
+    messages=1000,
+    documents={"event": 100, "start": 1, "stop": 1},
+    peak_memory=10_000,
+)
+
+
+@pytest.mark.parametrize("trace_memory", [True, False])
+def test_measure_plan_scaling(run_engine: RunEngine, trace_memory: bool):
+    motor = SynAxis(name="motor")
+    det: Any = SynGauss("det", motor, "motor", center=0, Imax=1)
+
+    result = measure_plan_scaling(
+        run_engine, lambda: count([det], num=10), 10, "count", trace_memory
+    )
+
+    assert result.points == 10
+    assert result.documents == {"start": 1, "descriptor": 1, "event": 10, "stop": 1}
+    assert result.messages > 10
+    assert result.total_time == pytest.approx(result.plan_time + result.run_engine_time)
+    assert (result.peak_memory is not None) == trace_memory
+    assert ("peak_memory_per_point" in result.metrics()) == trace_memory
+
+
+def test_no_regressions_within_tolerance(tmp_path: Path):
+    save_scaling_results([RESULT], tmp_path / "baseline.json")
+    baseline = json.loads((tmp_path / "baseline.json").read_text())
+
+    assert find_regressions([replace(RESULT, plan_time=0.7)], baseline) == []
+
+
+@pytest.mark.parametrize(
+    "changes, metric",
+    [
+        ({"plan_time": 0.8}, "plan_time_per_point"),
+        ({"run_engine_time": 3.0}, "run_engine_time_per_point"),
+        ({"messages": 1001}, "messages_per_point"),
+        ({"documents": {"event": 200}}, "documents_per_point"),
+        ({"peak_memory": 20_000}, "peak_memory_per_point"),
+    ],
+)
+def test_regressions_are_found(changes: dict, metric: str):
+    baseline = [RESULT.to_dict()]
+
+    (regression,) = find_regressions([replace(RESULT, **changes)], baseline)
+
+    assert regression.startswith(f"spectroscopy of 100 points: {metric} rose")
+
+
+def test_sizes_not_in_baseline_are_not_compared():
+    baseline = [RESULT.to_dict()]
+
+    assert (
+        find_regressions([replace(RESULT, points=25, messages=10**6)], baseline) == []
+    )
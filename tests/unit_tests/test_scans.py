@@ -0,0 +1,50 @@
+import dodal.beamlines.b01_1 as b01_1
+import pytest
+from dodal.devices.motors import XYZStage
+from scanspec.specs import Line
+
+from test_rig_bluesky.scans import fly_rows, series_num_frames
+
+
+@pytest.fixture
+def sample_stage() -> XYZStage:
+    return b01_1.sample_stage(connect_immediately=True, mock=True)
+
+
+def test_fly_rows_for_grid(sample_stage: XYZStage):
+    rows = fly_rows(Line(sample_stage.y, 0, 1, 2) * Line(sample_stage.x, 0, 4, 5))
+
+    assert rows is not None
+    assert [row.motor for row in rows] == [sample_stage.x, sample_stage.x]
+    assert [(row.start, row.stop) for row in rows] == [(-0.5, 4.5), (-0.5, 4.5)]
+    assert [row.fixed_positions for row in rows] == [
+        {sample_stage.y: 0.0},
+        {sample_stage.y: 1.0},
+    ]
+    assert {row.num_frames for row in rows} == {5}
+
+
+def test_fly_rows_for_snaked_grid(sample_stage: XYZStage):
+    rows = fly_rows(Line(sample_stage.y, 0, 1, 2) * ~Line(sample_stage.x, 0, 4, 5))
+
+    assert rows is not None
+    assert [(row.start, row.stop) for row in rows] == [(-0.5, 4.5), (4.5, -0.5)]
+
+
+def test_fly_rows_rejects_diagonal(sample_stage: XYZStage):
+    spec = Line(sample_stage.x, 0, 5, 5).zip(Line(sample_stage.y, 0, 5, 5))
+
+    assert fly_rows(spec) is None
+
+
+@pytest.mark.parametrize(
+    "num_frames, duration, expected",
+    [(None, None, 10), (5, None, 5), (None, 2.0, 40), (None, 0.01, 1)],
+)
+def test_series_num_frames(num_frames: int | None, duration: float | None, expected):
+    assert series_num_frames(20.0, num_frames, duration) == expected
+
+
+def test_series_num_frames_rejects_both():
+    with pytest.raises(ValueError, match="not both"):
+        series_num_frames(20.0, 5, 1.0)
@@ -0,0 +1,126 @@
+import os
+from pathlib import Path
+
+import pytest
+from bluesky import RunEngine
+from bluesky.preprocessors import msg_mutator
+from bluesky.run_engine import RunEngineResult, call_in_bluesky_event_loop
+from bluesky.utils import Msg
+from dodal.devices.motors import XYZStage
+from ophyd_async.core import YamlSettingsProvider, get_mock_put
+from ophyd_async.epics.motor import Motor
+
+from test_rig_bluesky.settings import (
+    CachedSettingsProvider,
+    SettingsDesign,
+    SettingsReport,
+    apply_settings_concurrently,
+    clear_settings_cache,
+    read_settings,
+    settings_cache_info,
+)
+
+
+@pytest.fixture
+def provider(tmp_path: Path) -> CachedSettingsProvider:
+    clear_settings_cache()
+    (tmp_path / "design.yaml").write_text("x.velocity: 1.0\n")
+    return CachedSettingsProvider(YamlSettingsProvider(tmp_path), tmp_path)
+
+
+async def test_retrieve_is_cached(provider: CachedSettingsProvider):
+    assert await provider.retrieve("design") == {"x.velocity": 1.0}
+    assert await provider.retrieve("design") == {"x.velocity": 1.0}
+
+    info = settings_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+
+
+async def test_cache_is_shared_between_providers(
+    provider: CachedSettingsProvider, tmp_path: Path
+):
+    await provider.retrieve("design")
+    other = CachedSettingsProvider(YamlSettingsProvider(tmp_path), tmp_path)
+    await other.retrieve("design")
+
+    assert settings_cache_info().hits == 1
+
+
+async def test_changed_file_is_reread(provider: CachedSettingsProvider, tmp_path: Path):
+    await provider.retrieve("design")
+    path = tmp_path / "design.yaml"
+    path.write_text("x.velocity: 2.0\n")
+    os.utime(path, ns=(0, path.stat().st_mtime_ns + 1))
+
+    assert await provider.retrieve("design") == {"x.velocity": 2.0}
+    assert settings_cache_info().misses == 2
+
+
+async def test_store_invalidates(provider: CachedSettingsProvider):
+    await provider.retrieve("design")
+    await provider.store("design", {"x.velocity": 3.0})
+
+    assert await provider.retrieve("design") == {"x.velocity": 3.0}
+    assert settings_cache_info().misses == 2
+
+
+async def test_read_settings_in_a_running_event_loop(
+    provider: CachedSettingsProvider, tmp_path: Path
+):
+    assert read_settings("design", tmp_path) == {"x.velocity": 1.0}
+    await provider.retrieve("design")
+
+    info = settings_cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+
+
+async def test_read_settings_merges_old_files_like_the_provider(
+    provider: CachedSettingsProvider, tmp_path: Path
+):
+    (tmp_path / "old.yaml").write_text("- x.velocity: 1.0\n- y.velocity: 2.0\n")
+
+    with pytest.warns(DeprecationWarning):
+        settings = read_settings("old", tmp_path)
+
+    assert settings == {"x.velocity": 1.0, "y.velocity": 2.0}
+    assert await provider.retrieve("old") == settings
+
+
+async def test_cached_settings_cannot_be_changed(
+    provider: CachedSettingsProvider, tmp_path: Path
+):
+    (tmp_path / "table.yaml").write_text("rois:\n  names: [a, b]\n")
+
+    read_settings("table", tmp_path)["rois"]["names"].append("c")
+    (await provider.retrieve("table"))["rois"]["names"].append("d")
+
+    assert read_settings("table", tmp_path) == {"rois": {"names": ["a", "b"]}}
+
+
+def test_apply_settings_concurrently(
+    run_engine: RunEngine, provider: CachedSettingsProvider, tmp_path: Path
+):
+    (tmp_path / "other.yaml").write_text("velocity: 2.0\nacceleration_time: 0.5\n")
+    stage = XYZStage("SIM-STAGE:", name="stage")
+    motor = Motor("SIM-MOTOR:", name="motor")
+    for device in (stage, motor):
+        call_in_bluesky_event_loop(device.connect(mock=True))
+    messages: list[Msg] = []
+    plan = apply_settings_concurrently(
+        provider,
+        [
+            (stage, "design", None),
+            SettingsDesign(motor, "other", whitelist_pvs=["velocity"]),
+        ],
+        overrides={stage.z.velocity: 4.0},
+    )
+
+    result = run_engine(msg_mutator(plan, lambda msg: messages.append(msg) or msg))
+
+    assert isinstance(result, RunEngineResult)
+    assert result.plan_result == SettingsReport(read=3, skipped=0, written=3)
+    assert [msg.command for msg in messages].count("wait") == 1
+    assert get_mock_put(stage.x.velocity).call_args.args[0] == 1.0
+    assert get_mock_put(motor.velocity).call_args.args[0] == 2.0
+    assert get_mock_put(stage.z.velocity).call_args.args[0] == 4.0
+    get_mock_put(motor.acceleration_time).assert_not_called()
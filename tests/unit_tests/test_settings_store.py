@@ -0,0 +1,139 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from ophyd_async.core import StrictEnum
+
+from test_rig_bluesky.settings_store import SettingsStore
+
+
+class TriggerMode(StrictEnum):
+    OFF = "Off"
+    ON = "On"
+
+
+SETTINGS = {
+    "driver.acquire_time": 0.1,
+    "driver.num_images": 1,
+    "driver.trigger_mode": TriggerMode.OFF,
+    "fileio.file_path": "/tmp/",
+    "fileio.lazy_open": True,
+    "roistat.channels.1.name_": "Red",
+    "roistat.nd_attributes_file": "",
+}
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> SettingsStore:
+    return SettingsStore(tmp_path / "history.bin")
+
+
+def test_values_round_trip(store: SettingsStore):
+    store.save(
+        "design",
+        {
+            **SETTINGS,
+            "array": np.arange(6, dtype=np.int32).reshape(2, 3),
+            "nothing": None,
+            "table": {"x": [1.0, 2.0], "labels": ["a", "b"]},
+        },
+    )
+
+    loaded = SettingsStore(store._path).load("design")
+
+    assert loaded.pop("driver.trigger_mode") == "Off"
+    np.testing.assert_array_equal(loaded.pop("array"), np.arange(6).reshape(2, 3))
+    assert loaded.pop("table") == {"x": [1.0, 2.0], "labels": ["a", "b"]}
+    assert loaded == {
+        **{k: v for k, v in SETTINGS.items() if k != "driver.trigger_mode"},
+        "nothing": None,
+    }
+
+
+def test_versions_are_indexed_by_design_and_device(store: SettingsStore):
+    assert store.save("detector_baseline", SETTINGS, device="detector") == 1
+    assert store.save("detector_baseline", SETTINGS, device="detector") == 2
+    assert store.save("stage_baseline", {"x.velocity": 1.0}, device="stage") == 1
+
+    assert store.designs() == ["detector_baseline", "stage_baseline"]
+    assert store.designs(device="stage") == ["stage_baseline"]
+    assert [v.version for v in store.versions("detector_baseline")] == [1, 2]
+
+
+def test_unchanged_values_are_not_written_again(store: SettingsStore):
+    store.save("design", SETTINGS)
+    first = store._path.stat().st_size
+    store.save("design", {**SETTINGS, "driver.acquire_time": 0.2})
+    second = store._path.stat().st_size - first
+
+    assert second < first / 2
+    assert store.load("design", 1)["driver.acquire_time"] == 0.1
+    assert store.load("design")["driver.acquire_time"] == 0.2
+
+
+def test_diff_versions(store: SettingsStore):
+    store.save("design", SETTINGS)
+    changed = {**SETTINGS, "driver.acquire_time": 0.2, "driver.num_images": 5}
+    del changed["fileio.lazy_open"]
+    store.save("design", {**changed, "driver.acquire_period": 0.25})
+
+    diff = store.diff("design")
+
+    assert diff.added == {"driver.acquire_period": 0.25}
+    assert diff.removed == {"fileio.lazy_open": True}
+    assert diff.changed == {
+        "driver.acquire_time": (0.1, 0.2),
+        "driver.num_images": (1, 5),
+    }
+    assert not store.diff("design", 1, 1)
+
+
+def test_diff_against_values(store: SettingsStore):
+    store.save("design", SETTINGS)
+
+    diff = store.diff_values("design", {**SETTINGS, "driver.num_images": 3})
+
+    assert diff.changed == {"driver.num_images": (1, 3)}
+    assert not diff.added and not diff.removed
+
+
+def test_unknown_version(store: SettingsStore):
+    store.save("design", SETTINGS)
+
+    with pytest.raises(KeyError, match="No version 3 of design"):
+        store.load("design", 3)
+    with pytest.raises(KeyError, match="No versions of other"):
+        store.load("other")
+
+
+def test_interrupted_save_is_dropped(store: SettingsStore):
+    store.save("design", SETTINGS)
+    store.save("design", {**SETTINGS, "driver.num_images": 2})
+    size = store._path.stat().st_size
+    with open(store._path, "r+b") as file:
+        file.truncate(size - 3)
+
+    reopened = SettingsStore(store._path)
+    assert [v.version for v in reopened.versions("design")] == [1]
+    assert reopened.save("design", {**SETTINGS, "driver.num_images": 4}) == 2
+    assert SettingsStore(store._path).load("design")["driver.num_images"] == 4
+
+
+def test_stores_of_one_file_save_in_turn(store: SettingsStore):
+    other = SettingsStore(store._path)
+
+    assert store.save("design", SETTINGS) == 1
+    assert other.save("design", {**SETTINGS, "driver.num_images": 2}) == 2
+    assert store.save("design", {**SETTINGS, "driver.num_images": 3}) == 3
+
+    reopened = SettingsStore(store._path)
+    assert [v.version for v in reopened.versions("design")] == [1, 2, 3]
+    assert reopened.load("design", version=2)["driver.num_images"] == 2
+
+
+async def test_pinned_version_provider(store: SettingsStore):
+    store.save("design", SETTINGS)
+    store.save("design", {**SETTINGS, "driver.num_images": 2})
+
+    assert (await store.at_version(1).retrieve("design"))["driver.num_images"] == 1
+    assert (await store.retrieve("design"))["driver.num_images"] == 2
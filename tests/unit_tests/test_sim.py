@@ -0,0 +1,215 @@
+import time
+from collections import Counter
+from pathlib import Path
+
+import bluesky.plan_stubs as bps
+import h5py
+import numpy as np
+import pytest
+from bluesky import RunEngine
+from bluesky.plans import count
+from dodal.beamlines import b01_1
+from dodal.common.beamlines.beamline_utils import get_path_provider
+from dodal.devices.motors import XYZStage
+from ophyd_async.core import StaticPathProvider, UUIDFilenameProvider
+from ophyd_async.epics.adaravis import AravisDetector
+from scanspec.specs import Line
+
+from test_rig_bluesky.callbacks import MapReducer
+from test_rig_bluesky.plans import snapshot, snapshot_series, spectroscopy
+from test_rig_bluesky.testing import (
+    SimulatedSample,
+    simulated_imaging_detector,
+    simulated_sample_stage,
+    simulated_spectroscopy_detector,
+)
+from test_rig_bluesky.trajectory import AxisKinematics
+
+
+@pytest.fixture
+def sample_stage(run_engine: RunEngine) -> XYZStage:
+    return simulated_sample_stage(velocity=10.0, acceleration_time=0.05)
+
+
+@pytest.fixture
+def spectroscopy_detector(sample_stage: XYZStage) -> AravisDetector:
+    return simulated_spectroscopy_detector(sample_stage, frame_rate=1000)
+
+
+@pytest.fixture
+def imaging_detector(sample_stage: XYZStage) -> AravisDetector:
+    return simulated_imaging_detector(sample_stage, frame_rate=1000)
+
+
+async def _read_dataset(detector: AravisDetector, dataset: str) -> np.ndarray:
+    path = await detector.fileio.full_file_name.get_value()
+    with h5py.File(path, "r") as file:
+        return np.asarray(file[dataset])
+
+
+def test_sample_transmission_varies_across_the_stage():
+    sample = SimulatedSample(num_spots=50)
+
+    transmissions = np.array(
+        [sample.transmission(x, y) for x in range(-10, 11) for y in range(-10, 11)]
+    )
+
+    assert transmissions.min() < 0.5
+    assert transmissions.max() == 1.0
+
+
+async def test_devices_are_made_by_the_beamline_factories(
+    run_engine: RunEngine, sample_stage: XYZStage, tmp_path: Path
+):
+    beamline_path_provider = get_path_provider()
+    detector = simulated_spectroscopy_detector(
+        sample_stage,
+        frame_rate=1000,
+        path_provider=StaticPathProvider(UUIDFilenameProvider(), tmp_path),
+    )
+
+    assert sample_stage.x.user_readback.source.endswith("-MO-PPMAC-01:X.RBV")
+    assert "roistat" in dict(detector.children())
+    # Each is new, and not left in the factory's cache for others
+    assert simulated_sample_stage() is not sample_stage
+    assert b01_1.sample_stage(mock=True) is not sample_stage
+    b01_1.sample_stage.cache_clear()
+    # Frames go to the path provider given, which is not left as the beamline's
+    assert get_path_provider() is beamline_path_provider
+    run_engine(count([detector]))
+    path = Path(await detector.fileio.full_file_name.get_value())
+    assert path.parent == tmp_path
+
+
+async def test_stage_moves_at_its_velocity(
+    run_engine: RunEngine, sample_stage: XYZStage
+):
+    start = time.monotonic()
+    run_engine(bps.mv(sample_stage.x, 1.0))
+    elapsed = time.monotonic() - start
+
+    expected = float(AxisKinematics(10.0, 0.05).move_time(1.0))
+    assert elapsed == pytest.approx(expected, abs=0.05)
+    assert await sample_stage.x.user_readback.get_value() == 1.0
+
+
+async def test_spectroscopy_writes_roi_totals_to_hdf5(
+    run_engine: RunEngine,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    reducer = MapReducer()
+    run_engine.subscribe(reducer)
+
+    run_engine(
+        spectroscopy(
+            spectroscopy_detector,
+            sample_stage,
+            Line(sample_stage.y, 0, 0.1, 2) * Line(sample_stage.x, 0, 0.2, 3),
+            exposure_time=0.01,
+        )
+    )
+
+    frames = await _read_dataset(spectroscopy_detector, "/entry/data/data")
+    red_total = await _read_dataset(
+        spectroscopy_detector, "/entry/instrument/NDAttributes/RedTotal"
+    )
+    assert frames.shape == (6, 1216, 1936)
+    assert np.all(red_total > 0)
+    np.testing.assert_array_equal(reducer.maps["RedTotal"].ravel(), red_total)
+
+
+async def test_pipelined_spectroscopy_takes_frames_where_it_records(
+    run_engine: RunEngine, sample_stage: XYZStage
+):
+    # Stripes across x, so frames taken on the way to a point would differ
+    sample = SimulatedSample(num_spots=0)
+    stripes = np.arange(sample.transmission_map.shape[1]) // 2 % 2
+    sample.transmission_map[:] = np.where(stripes, 0.5, 1.0)[None, :, None]
+    spectroscopy_detector = simulated_spectroscopy_detector(
+        sample_stage, sample, frame_rate=1000
+    )
+    spec = Line(sample_stage.y, 0, 0.1, 2) * Line(sample_stage.x, 0, 0.2, 3)
+    midpoints = spec.frames().midpoints
+    expected = list(
+        zip(midpoints[sample_stage.x], midpoints[sample_stage.y], strict=True)
+    )
+    totals = []
+    for pipelined in (False, True):
+        reducer = MapReducer()
+        positions: list[tuple[float, float]] = []
+
+        def record_positions(name, doc, positions=positions):
+            if name == "event":
+                data = doc["data"]
+                positions.append((data["sample_stage-x"], data["sample_stage-y"]))
+
+        tokens = [run_engine.subscribe(reducer), run_engine.subscribe(record_positions)]
+        run_engine(
+            spectroscopy(
+                spectroscopy_detector,
+                sample_stage,
+                spec,
+                exposure_time=0.01,
+                pipelined=pipelined,
+            )
+        )
+        for token in tokens:
+            run_engine.unsubscribe(token)
+        totals.append(reducer.maps["RedTotal"])
+        assert positions == pytest.approx(expected)
+
+    # Each frame was taken at its point, not while moving to the next one
+    assert np.ptp(totals[0]) > 0.05 * totals[0].max()
+    np.testing.assert_allclose(totals[1], totals[0], rtol=1e-3)
+
+
+async def test_snapshot_writes_images(
+    run_engine: RunEngine,
+    imaging_detector: AravisDetector,
+    spectroscopy_detector: AravisDetector,
+    sample_stage: XYZStage,
+):
+    run_engine(snapshot(imaging_detector, spectroscopy_detector, sample_stage))
+
+    images = await _read_dataset(imaging_detector, "/entry/data/data")
+    assert images.shape == (1, 1024, 1280)
+    assert images.dtype == np.uint8
+    assert images.any()
+
+
+async def test_snapshot_series_takes_frames_at_the_frame_rate(
+    run_engine: RunEngine, sample_stage: XYZStage
+):
+    # Detectors that run at the rate the plan asks for
+    imaging_detector = simulated_imaging_detector(sample_stage)
+    spectroscopy_detector = simulated_spectroscopy_detector(sample_stage)
+    streams: dict[str, str] = {}
+    events: Counter[str] = Counter()
+
+    def count_events(name, doc):
+        if name == "descriptor":
+            streams[doc["uid"]] = doc["name"]
+        elif name == "event":
+            events[streams[doc["descriptor"]]] += 1
+
+    start = time.monotonic()
+    run_engine(
+        snapshot_series(
+            imaging_detector,
+            spectroscopy_detector,
+            sample_stage,
+            frame_rate=20,
+            num_frames=10,
+        ),
+        count_events,
+    )
+    elapsed = time.monotonic() - start
+
+    # 10 frames at 20Hz take 0.5s, plus the time to arm and stage the detectors
+    assert 0.45 <= elapsed < 2.0
+    for detector in (imaging_detector, spectroscopy_detector):
+        frames = await _read_dataset(detector, "/entry/data/data")
+        assert len(frames) == 10
+    assert await imaging_detector.driver.acquire_period.get_value() == 0.05
+    assert events["positions"] >= 2
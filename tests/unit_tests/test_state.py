@@ -0,0 +1,21 @@
+from pathlib import Path
+
+import pytest
+
+from test_rig_bluesky.state import STATE_DIRECTORY_ENV, state_directory
+
+
+def test_state_directory_is_configured(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv(STATE_DIRECTORY_ENV, str(tmp_path / "state"))
+
+    assert state_directory() == tmp_path / "state"
+    assert (tmp_path / "state").is_dir()
+
+
+def test_state_directory_defaults_to_the_users_state(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.delenv(STATE_DIRECTORY_ENV)
+    monkeypatch.setenv("XDG_STATE_HOME", str(tmp_path))
+
+    assert state_directory() == tmp_path / "test_rig_bluesky"
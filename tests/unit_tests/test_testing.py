@@ -0,0 +1,481 @@
+import asyncio
+import hashlib
+import threading
+import tracemalloc
+from pathlib import Path
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+import h5py
+import numpy as np
+import pytest
+from blueapi.client.client import BlueapiClient
+from blueapi.service.model import TaskRequest, TaskResponse, WorkerTask
+from blueapi.worker.event import WorkerState
+from bluesky_stomp.messaging import StompClient
+
+from test_rig_bluesky.testing import (
+    AsyncBlueskyPlanRunner,
+    AsyncScanMessages,
+    BlueskyPlanRunner,
+    NexusVerifier,
+    ScanMessageLog,
+    ScanMessageRouter,
+    ScanMessages,
+    benchmark_throughput,
+    task_mix,
+    verify_nexus_file,
+)
+
+
+@pytest.fixture
+def stomp_client() -> MagicMock:
+    client = MagicMock(spec=StompClient)
+    client.subscribe.return_value = "subscription-1"
+    return client
+
+
+def _send(stomp_client: MagicMock, file_path: str, status: str, **kwargs: Any):
+    ((_, callback), _) = stomp_client.subscribe.call_args
+    callback({"filePath": file_path, "status": status, **kwargs}, MagicMock())
+
+
+def test_router_subscribes_once(stomp_client: MagicMock):
+    with ScanMessageRouter(stomp_client) as router:
+        for _ in range(3):
+            consumer = ScanMessages()
+            router.register(consumer)
+            router.unregister(consumer)
+
+    stomp_client.subscribe.assert_called_once()
+    stomp_client.unsubscribe.assert_called_once_with("subscription-1")
+
+
+def test_router_routes_each_scan_to_its_own_consumer(stomp_client: MagicMock):
+    with ScanMessageRouter(stomp_client) as router:
+        first, second = ScanMessages(), ScanMessages()
+        router.register(first)
+        router.register(second)
+
+        _send(stomp_client, "a.nxs", "STARTED")
+        _send(stomp_client, "b.nxs", "STARTED")
+        _send(stomp_client, "b.nxs", "FINISHED", scanDimensions=[3])
+        _send(stomp_client, "a.nxs", "FINISHED", scanDimensions=[5])
+
+    assert first["FINISHED"][0]["scanDimensions"] == [5]
+    assert second["FINISHED"][0]["scanDimensions"] == [3]
+    assert first.finished.result(timeout=0)["filePath"] == "a.nxs"
+
+
+def test_router_drops_messages_from_earlier_scans(stomp_client: MagicMock):
+    with ScanMessageRouter(stomp_client) as router:
+        earlier = ScanMessages()
+        router.register(earlier)
+        _send(stomp_client, "a.nxs", "STARTED")
+        router.unregister(earlier)
+
+        later = ScanMessages()
+        router.register(later)
+        _send(stomp_client, "a.nxs", "FINISHED")
+        _send(stomp_client, "b.nxs", "STARTED")
+
+    assert earlier.counts == {"STARTED": 1}
+    assert later.counts == {"STARTED": 1}
+    assert later["STARTED"][0]["filePath"] == "b.nxs"
+
+
+def test_scan_messages_keeps_bounded_summary():
+    messages = ScanMessages(max_per_status=2)
+    for percent in range(100):
+        messages.add({"status": "UPDATED", "percentComplete": percent})
+
+    assert messages.counts["UPDATED"] == 100
+    assert [m["percentComplete"] for m in messages["UPDATED"]] == [98, 99]
+    assert messages["FINISHED"] == []
+
+
+def test_scan_messages_streams_until_finished():
+    messages = ScanMessages(stream=True)
+    for status in ["STARTED", "UPDATED", "FINISHED", "STARTED"]:
+        messages.add({"status": status})
+
+    assert [m["status"] for m in messages] == ["STARTED", "UPDATED", "FINISHED"]
+
+
+def test_scan_messages_stream_times_out():
+    with pytest.raises(TimeoutError):
+        next(ScanMessages(stream=True).stream(timeout=0.01))
+
+
+def test_scan_messages_not_streamed():
+    with pytest.raises(RuntimeError):
+        list(ScanMessages())
+
+
+def test_scan_message_log_queries_by_status_and_scan(tmp_path: Path):
+    with ScanMessageLog(tmp_path / "messages.jsonl") as log:
+        messages = ScanMessages(max_per_status=0, log=log)
+        for scan in [1, 2]:
+            messages.add({"status": "STARTED", "scanNumber": scan})
+            for percent in range(10):
+                messages.add(
+                    {"status": "UPDATED", "scanNumber": scan, "percent": percent}
+                )
+            messages.add({"status": "FINISHED", "scanNumber": scan})
+
+        assert messages["UPDATED"] == []
+        assert len(log) == 24
+        assert log.counts(scan=2) == {"STARTED": 1, "UPDATED": 10, "FINISHED": 1}
+        assert log.first("FINISHED") == {"status": "FINISHED", "scanNumber": 1}
+        assert [m["percent"] for m in log.find("UPDATED", scan=2)] == list(range(10))
+        assert log.first("ABORTED") is None
+
+
+def test_scan_message_log_appends_to_existing_log(tmp_path: Path):
+    path = tmp_path / "messages.jsonl"
+    with ScanMessageLog(path) as log:
+        log.append({"status": "STARTED"})
+    # A record torn by a crash part way through writing it
+    with (tmp_path / "messages.jsonl.index").open("ab") as index:
+        index.write(b"torn")
+
+    with ScanMessageLog(path) as log:
+        log.append({"status": "FINISHED"})
+
+        assert [m["status"] for m in log.find()] == ["STARTED", "FINISHED"]
+        assert log.counts() == {"STARTED": 1, "FINISHED": 1}
+
+
+def test_scan_message_log_memory_is_flat(tmp_path: Path):
+    def peak_memory(updates: int) -> int:
+        with ScanMessageLog(tmp_path / f"{updates}.jsonl") as log:
+            messages = ScanMessages(max_per_status=1, log=log)
+            tracemalloc.start()
+            try:
+                for percent in range(updates):
+                    messages.add({"status": "UPDATED", "percent": percent})
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    assert peak_memory(5000) < 2 * peak_memory(500)
+
+
+def _write_nexus_file(directory: Path, totals: np.ndarray, frames: np.ndarray) -> Path:
+    # Frames and ROI totals written by a detector, linked into the NeXus file
+    with h5py.File(directory / "detector.h5", "w") as detector:
+        detector["entry/data/data"] = frames
+        detector.create_dataset(
+            "entry/instrument/NDAttributes/total", data=totals, chunks=(2,)
+        )
+    path = directory / "scan.nxs"
+    with h5py.File(path, "w") as file:
+        data = file.create_group("entry/detector")
+        data.attrs["NX_class"] = "NXdata"
+        data["data"] = h5py.ExternalLink("detector.h5", "entry/data/data")
+        file["entry/instrument"] = h5py.ExternalLink("detector.h5", "entry/instrument")
+        file["entry/title"] = "scan"
+    return path
+
+
+def test_verify_nexus_file_with_no_frames(tmp_path: Path):
+    path = _write_nexus_file(tmp_path, np.arange(6.0), np.zeros((0, 4, 4), np.uint16))
+
+    verification = verify_nexus_file(path, [3, 2])
+
+    checks = {check.name: check for check in verification.datasets}
+    assert checks["/entry/data/data"].shape == (0, 4, 4)
+    assert checks["/entry/data/data"].checksum == _checksum(np.zeros(0, np.uint16))
+    assert not verification.ok
+
+
+def _checksum(values: np.ndarray) -> str:
+    return hashlib.blake2b(values.tobytes(), digest_size=16).hexdigest()
+
+
+def test_verify_nexus_file(tmp_path: Path):
+    frames = np.arange(6 * 4 * 4, dtype=np.uint16).reshape(6, 4, 4)
+    path = _write_nexus_file(tmp_path, np.arange(6.0), frames)
+
+    verification = verify_nexus_file(path, [3, 2])
+
+    assert verification.ok, verification.problems
+    checks = {check.name: check for check in verification.datasets}
+    assert set(checks) == {"/entry/data/data", "/entry/instrument/NDAttributes/total"}
+    assert checks["/entry/data/data"].shape == (6, 4, 4)
+    # The same however the dataset is stored, memory mapped or read in chunks
+    assert checks["/entry/data/data"].checksum == _checksum(frames)
+    assert checks["/entry/instrument/NDAttributes/total"].checksum == _checksum(
+        np.arange(6.0)
+    )
+
+
+def test_verify_nexus_file_finds_missing_points(tmp_path: Path):
+    totals = np.array([1.0, 2.0, np.nan, 4.0, 5.0])
+    path = _write_nexus_file(tmp_path, totals, np.zeros((5, 2, 2)))
+
+    verification = verify_nexus_file(path, [3, 2])
+
+    assert verification.problems == [
+        "/entry/data/data has shape (5, 2, 2), expected a scan of (3, 2)",
+        "/entry/instrument/NDAttributes/total has shape (5,), "
+        "expected a scan of (3, 2)",
+        "/entry/instrument/NDAttributes/total has 1 NaN values",
+    ]
+
+
+def test_nexus_verifier_collects_problems(tmp_path: Path):
+    _write_nexus_file(tmp_path, np.arange(4.0), np.zeros((4, 2, 2)))
+
+    with NexusVerifier(tmp_path) as verifier:
+        verifier.submit_scan({"filePath": "scan.nxs", "scanDimensions": [4]})
+        verifier.submit("missing.nxs", [4])
+        problems = verifier.problems(timeout=10)
+
+    assert len(problems) == 1
+    assert "missing.nxs" in problems[0]
+
+
+def test_task_mix():
+    requests = task_mix("cm12345-1", repeats=2)
+
+    assert [request.name for request in requests] == 2 * [
+        "snapshot",
+        "spectroscopy",
+        "demo_spectroscopy",
+        "count",
+        "spec_scan",
+    ]
+    assert {request.instrument_session for request in requests} == {"cm12345-1"}
+
+
+def test_benchmark_throughput_pipelines_tasks(stomp_client: MagicMock):
+    client = MagicMock(spec=BlueapiClient)
+    calls: list[str] = []
+
+    def create_task(request: TaskRequest) -> TaskResponse:
+        calls.append(f"create {request.name}")
+        return TaskResponse(task_id=f"task-{request.name}")
+
+    def start_task(task: WorkerTask) -> WorkerTask:
+        calls.append(f"start {task.task_id}")
+        _send(stomp_client, f"{task.task_id}.nxs", "STARTED")
+        _send(stomp_client, f"{task.task_id}.nxs", "FINISHED")
+        return task
+
+    client.create_task.side_effect = create_task
+    client.start_task.side_effect = start_task
+    client.get_task.return_value = MagicMock(is_complete=True, errors=[])
+    client.get_state.return_value = WorkerState.IDLE
+    runner = BlueskyPlanRunner(client, stomp_client)
+
+    report = benchmark_throughput(
+        runner,
+        [TaskRequest(name=name, instrument_session="cm12345-1") for name in "abc"],
+        timeout=1,
+    )
+
+    # Each task is created while the one before it is running
+    assert calls == [
+        "create a",
+        "start task-a",
+        "create b",
+        "start task-b",
+        "create c",
+        "start task-c",
+    ]
+    assert [timing.name for timing in report.timings] == ["a", "b", "c"]
+    assert all(timing.time_to_finished is not None for timing in report.timings)
+    assert report.tasks_per_hour > 0
+    assert report.summary()["tasks"] == 3
+
+
+def test_benchmark_throughput_cleans_up_after_a_failed_task(
+    stomp_client: MagicMock,
+):
+    calls: list[str] = []
+    client = _blueapi_client(stomp_client, calls)
+    client.get_task.return_value = MagicMock(is_complete=True, errors=["Failed"])
+    runner = BlueskyPlanRunner(client, stomp_client)
+
+    with (
+        patch.object(runner.router, "unregister") as unregister,
+        pytest.raises(AssertionError, match="Failed"),
+    ):
+        benchmark_throughput(
+            runner,
+            [TaskRequest(name=name, instrument_session="cm12345-1") for name in "ab"],
+            timeout=1,
+        )
+
+    # The consumer of the failed task is unregistered, and the task created
+    # after it is cleared rather than left for the worker
+    unregister.assert_called_once()
+    client.clear_task.assert_called_once_with("task-b")
+    assert calls == ["create a", "start task-a", "create b"]
+
+
+def _blueapi_client(stomp_client: MagicMock, calls: list[str]) -> MagicMock:
+    """A client whose tasks each run a scan, writing a file named after the task."""
+    client = MagicMock(spec=BlueapiClient)
+
+    def create_task(request: TaskRequest) -> TaskResponse:
+        calls.append(f"create {request.name}")
+        return TaskResponse(task_id=f"task-{request.name}")
+
+    def start_task(task: WorkerTask) -> WorkerTask:
+        calls.append(f"start {task.task_id}")
+        _send(stomp_client, f"{task.task_id}.nxs", "STARTED")
+        _send(stomp_client, f"{task.task_id}.nxs", "UPDATED")
+        _send(stomp_client, f"{task.task_id}.nxs", "FINISHED")
+        return task
+
+    client.create_task.side_effect = create_task
+    client.start_task.side_effect = start_task
+    client.get_task.return_value = MagicMock(is_complete=True, errors=[])
+    client.get_state.return_value = WorkerState.IDLE
+    return client
+
+
+async def test_async_runner_runs_tasks_concurrently(stomp_client: MagicMock):
+    calls: list[str] = []
+    runner = AsyncBlueskyPlanRunner(_blueapi_client(stomp_client, calls), stomp_client)
+
+    results = await asyncio.gather(
+        *(
+            runner.run(TaskRequest(name=name, instrument_session="cm12345-1"), 1)
+            for name in "abc"
+        )
+    )
+    runner.close()
+
+    assert [(await m.wait_for("FINISHED"))["filePath"] for m in results] == [
+        "task-a.nxs",
+        "task-b.nxs",
+        "task-c.nxs",
+    ]
+    # Tasks are created concurrently, but the worker runs one at a time
+    assert sorted(call for call in calls if call.startswith("create")) == [
+        "create a",
+        "create b",
+        "create c",
+    ]
+    assert [call for call in calls if call.startswith("start")] == [
+        "start task-a",
+        "start task-b",
+        "start task-c",
+    ]
+
+
+async def test_async_runners_share_an_event_loop():
+    stomp_clients = [MagicMock(spec=StompClient) for _ in range(2)]
+    calls: list[list[str]] = [[], []]
+    runners = [
+        AsyncBlueskyPlanRunner(_blueapi_client(stomp, instrument_calls), stomp)
+        for stomp, instrument_calls in zip(stomp_clients, calls, strict=True)
+    ]
+
+    await asyncio.gather(
+        *(
+            runner.run(TaskRequest(name="a", instrument_session="cm12345-1"), 1)
+            for runner in runners
+        )
+    )
+
+    assert calls == [["create a", "start task-a"], ["create a", "start task-a"]]
+
+
+async def test_async_runner_clears_task_cancelled_before_it_starts(
+    stomp_client: MagicMock,
+):
+    calls: list[str] = []
+    client = _blueapi_client(stomp_client, calls)
+    client.get_task.return_value = MagicMock(is_complete=False, errors=[])
+    runner = AsyncBlueskyPlanRunner(client, stomp_client, poll_interval=0.01)
+    running = asyncio.create_task(
+        runner.run(TaskRequest(name="a", instrument_session="cm12345-1"), 10)
+    )
+    while "start task-a" not in calls:
+        await asyncio.sleep(0.01)
+    waiting = asyncio.create_task(
+        runner.run(TaskRequest(name="b", instrument_session="cm12345-1"), 10)
+    )
+    while "create b" not in calls:
+        await asyncio.sleep(0.01)
+
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    running.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await running
+
+    # b waited for the worker and was never started, a was started and aborted
+    assert calls == ["create a", "start task-a", "create b"]
+    client.clear_task.assert_called_once_with("task-b")
+    client.abort.assert_called_once()
+
+
+async def test_async_runner_aborts_task_cancelled_while_it_starts(
+    stomp_client: MagicMock,
+):
+    client = _blueapi_client(stomp_client, [])
+    starting, start = threading.Event(), threading.Event()
+    start_task = client.start_task.side_effect
+
+    def slow_start_task(task: WorkerTask) -> WorkerTask:
+        starting.set()
+        start.wait(timeout=5)
+        return start_task(task)
+
+    client.start_task.side_effect = slow_start_task
+    runner = AsyncBlueskyPlanRunner(client, stomp_client)
+    run = asyncio.create_task(
+        runner.run(TaskRequest(name="a", instrument_session="cm12345-1"), 10)
+    )
+    await asyncio.to_thread(starting.wait, 5)
+
+    run.cancel()
+    await asyncio.sleep(0.01)
+    # Not aborted before the start it would have to follow
+    client.abort.assert_not_called()
+    start.set()
+    with pytest.raises(asyncio.CancelledError):
+        await run
+
+    client.abort.assert_called_once()
+
+
+async def test_async_scan_messages_stream(stomp_client: MagicMock):
+    runner = AsyncBlueskyPlanRunner(_blueapi_client(stomp_client, []), stomp_client)
+    messages = AsyncScanMessages(stream=True)
+
+    run = asyncio.create_task(
+        runner.run(TaskRequest(name="a", instrument_session="cm12345-1"), 1, messages)
+    )
+    statuses = [message["status"] async for message in messages]
+    await run
+
+    assert statuses == ["STARTED", "UPDATED", "FINISHED"]
+
+
+async def test_async_scan_messages_wait_for_times_out():
+    with pytest.raises(TimeoutError):
+        await AsyncScanMessages().wait_for("FINISHED", timeout=0.01)
+
+
+async def test_async_runner_aborts_task_on_timeout(stomp_client: MagicMock):
+    client = _blueapi_client(stomp_client, [])
+    client.get_task.return_value = MagicMock(is_complete=False, errors=[])
+    runner = AsyncBlueskyPlanRunner(client, stomp_client, poll_interval=0.01)
+    messages = AsyncScanMessages()
+
+    with pytest.raises(TimeoutError):
+        await runner.run(
+            TaskRequest(name="a", instrument_session="cm12345-1"), 0.1, messages
+        )
+
+    client.abort.assert_called_once()
+    # Messages from the aborted scan are no longer routed to its consumer
+    _send(stomp_client, "task-a.nxs", "UPDATED")
+    assert messages.counts == {"STARTED": 1, "UPDATED": 1, "FINISHED": 1}
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+from scanspec.specs import Line
+
+from test_rig_bluesky.trajectory import (
+    MAX_REORDERED_POINTS,
+    AxisKinematics,
+    axis_key,
+    kinematics_from_settings,
+    nearest_neighbour_order,
+    optimise_trajectory,
+    snake,
+)
+
+KINEMATICS = {
+    "x": AxisKinematics(velocity=1.0, acceleration_time=0.5),
+    "y": AxisKinematics(velocity=1.0, acceleration_time=0.5),
+}
+
+
+def test_move_time():
+    times = KINEMATICS["x"].move_time([0.0, 0.125, 0.5, 2.0, -2.0])
+
+    assert times == pytest.approx([0.0, 0.5, 1.0, 2.5, 2.5])
+
+
+@pytest.mark.parametrize(
+    "distance, time, moved",
+    [
+        (2.0, 0.0, 0.0),
+        (2.0, 0.5, 0.25),
+        (2.0, 1.25, 1.0),
+        (2.0, 2.5, 2.0),
+        (2.0, 10.0, 2.0),
+        (-2.0, 0.5, -0.25),
+        (0.125, 0.25, 0.0625),
+    ],
+)
+def test_distance_moved(distance: float, time: float, moved: float):
+    assert KINEMATICS["x"].distance_moved(distance, time) == pytest.approx(moved)
+
+
+def test_kinematics_from_settings():
+    kinematics = kinematics_from_settings(
+        {
+            "x.acceleration_time": 0.001,
+            "x.velocity": 1.0,
+            "x.offset": 0.0,
+            "y.velocity": 2.0,
+        }
+    )
+
+    assert kinematics == {"x": AxisKinematics(velocity=1.0, acceleration_time=0.001)}
+
+
+@pytest.mark.parametrize("axis", ["sample_stage.x", "sample_stage-x", "x"])
+def test_axis_key(axis: str):
+    assert axis_key(axis) == "x"
+
+
+def test_snake_grid():
+    spec = Line("z", 0, 1, 2) * Line("y", 0, 1, 2) * Line("x", 0, 1, 2)
+
+    assert snake(spec) == Line("z", 0, 1, 2) * ~Line("y", 0, 1, 2) * ~Line("x", 0, 1, 2)
+
+
+def test_optimise_grid_is_snaked():
+    spec = Line("y", 0, 4, 5) * Line("x", 0, 4, 5)
+
+    optimised = optimise_trajectory(spec, KINEMATICS)
+
+    assert optimised.spec == Line("y", 0, 4, 5) * ~Line("x", 0, 4, 5)
+    assert optimised.positions is None
+    assert optimised.original_travel_time == pytest.approx(20 * 1.5 + 4 * 4.5)
+    assert optimised.travel_time == pytest.approx(24 * 1.5)
+    assert optimised.time_saved == pytest.approx(12.0)
+
+
+def test_optimise_points_are_reordered():
+    spec = Line("x", 0, 4, 5).concat(Line("x", 0.5, 4.5, 5))
+
+    optimised = optimise_trajectory(spec, KINEMATICS)
+
+    assert optimised.spec is None
+    assert optimised.positions is not None
+    assert np.array_equal(
+        optimised.positions["x"], [0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5]
+    )
+    assert optimised.time_saved > 0
+
+
+def test_optimise_keeps_spec_that_cannot_be_improved():
+    spec = Line("x", 0, 4, 5)
+
+    optimised = optimise_trajectory(spec, KINEMATICS)
+
+    assert optimised.spec is spec
+    assert optimised.time_saved == 0
+
+
+def test_nearest_neighbour_order_visits_every_point():
+    rng = np.random.default_rng(0)
+    positions = {"x": rng.uniform(0, 5, 1000), "y": rng.uniform(0, 5, 1000)}
+
+    order = nearest_neighbour_order(positions, KINEMATICS)
+
+    assert order[0] == 0
+    assert sorted(order) == list(range(1000))
+
+
+def test_optimise_keeps_order_of_large_point_sets():
+    num_points = 100 * MAX_REORDERED_POINTS
+    spec = Line("x", 0, 4, num_points).zip(Line("y", 4, 0, num_points))
+
+    optimised = optimise_trajectory(spec, KINEMATICS)
+
+    assert optimised.spec is spec
+    assert optimised.time_saved == 0
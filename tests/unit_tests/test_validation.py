@@ -0,0 +1,75 @@
+import time
+
+import dodal.beamlines.b01_1 as b01_1
+import pytest
+from bluesky import RunEngine
+from dodal.devices.motors import XYZStage
+from ophyd_async.core import set_mock_value
+from scanspec.specs import Line
+
+from test_rig_bluesky.validation import AxisLimits, spec_problems, validate_spec
+
+LIMITS = AxisLimits(low=-10, high=10, max_velocity=5, acceleration_time=0.5)
+
+
+@pytest.fixture
+def sample_stage(run_engine: RunEngine) -> XYZStage:
+    stage = b01_1.sample_stage(connect_immediately=True, mock=True)
+    for axis in (stage.x, stage.y):
+        set_mock_value(axis.low_limit_travel, -10.0)
+        set_mock_value(axis.high_limit_travel, 10.0)
+        set_mock_value(axis.dial_low_limit_travel, -10.0)
+        set_mock_value(axis.dial_high_limit_travel, 10.0)
+        set_mock_value(axis.max_velocity, 5.0)
+        set_mock_value(axis.acceleration_time, 0.5)
+    return stage
+
+
+def test_million_point_spec_is_checked_quickly():
+    spec = Line("y", -10, 10, 1000) * Line("x", -10, 10, 1000)
+
+    start = time.perf_counter()
+    problems = spec_problems(spec, {"x": LIMITS, "y": LIMITS})
+
+    assert problems == []
+    assert time.perf_counter() - start < 1
+
+
+def test_points_outside_limits():
+    spec = Line("y", 0, 1, 2) * Line("x", 5, 15, 11)
+
+    assert spec_problems(spec, {"x": LIMITS, "y": LIMITS}) == [
+        "x goes from 5 to 15, 10 of 22 positions are outside its limits -10 to 10"
+    ]
+
+
+def test_limits_not_enforced():
+    unlimited = AxisLimits(
+        low=0, high=0, max_velocity=5, acceleration_time=0.5, enforced=False
+    )
+
+    assert spec_problems(Line("x", 5, 15, 11), {"x": unlimited}) == []
+
+
+def test_fly_problems(sample_stage: XYZStage):
+    # Frames 1mm wide taken every 0.1s need about 10mm/s, and the run up from
+    # the edge at 9mm then passes the limit
+    spec = Line(sample_stage.y, 0, 1, 2) * Line(sample_stage.x, -8.5, 8.5, 18)
+    limits = {
+        sample_stage.x: LIMITS,
+        sample_stage.y: LIMITS,
+    }
+
+    assert spec_problems(spec, limits) == []
+    problems = spec_problems(spec, limits, fly_exposure_time=0.1)
+    assert len(problems) == 2, problems
+    assert problems[0].startswith("sample_stage-x must fly at 9.8")
+    assert "outside its limits" in problems[1]
+    assert spec_problems(spec, limits, fly_exposure_time=1.0) == []
+
+
+def test_validate_spec_reads_limits(run_engine: RunEngine, sample_stage: XYZStage):
+    run_engine(validate_spec(Line(sample_stage.x, -10, 10, 5)))
+
+    with pytest.raises(ValueError, match="outside its limits"):
+        run_engine(validate_spec(Line(sample_stage.x, 0, 20, 5)))